@@ -0,0 +1,390 @@
+import chess
+import numpy as np
+
+from functions.eval import board_bitboards
+
+'''
+Lock-step random playouts of many games at once on NumPy arrays.
+
+Every game is a row of a signed mailbox (piece type, positive for the side to move, negative for the opponent),
+always seen from the side to move: after each move the board is mirrored vertically and the signs are negated. So
+the side to move always plays "up" the board and castles from e1, which keeps move generation branch-free.
+'''
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(1, 7)
+NO_SQUARE = 64  # padding column of the mailbox, always empty
+
+# ray directions: orthogonal first, then diagonal. NE and NW are the squares an enemy pawn attacks the king from.
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))  # (rank step, file step)
+NE, NW = 4, 5
+KNIGHT_JUMPS = ((2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+
+
+def _square_table(steps, max_distance):
+    table = np.full((64, len(steps), max_distance), NO_SQUARE, dtype=np.int8)  # small, so comparisons are fast
+    for square in range(64):
+        rank, file = divmod(square, 8)
+        for d, (rank_step, file_step) in enumerate(steps):
+            for k in range(max_distance):
+                r, f = rank + rank_step * (k + 1), file + file_step * (k + 1)
+                if not (0 <= r < 8 and 0 <= f < 8):
+                    break
+                table[square, d, k] = r * 8 + f
+    return table
+
+
+RAYS = _square_table(DIRECTIONS, 7)  # [square, direction, distance] -> square, NO_SQUARE off the board
+KNIGHT_TARGETS = _square_table(KNIGHT_JUMPS, 1)[:, :, 0]  # [square, jump] -> square
+FLIP = np.arange(64) ^ 56  # vertical mirror
+
+# directions and distances each piece type moves along (pawns are generated separately)
+PIECE_DIRECTIONS = np.zeros((7, 8), dtype=bool)
+PIECE_DIRECTIONS[ROOK, :4] = PIECE_DIRECTIONS[BISHOP, 4:] = True
+PIECE_DIRECTIONS[QUEEN] = PIECE_DIRECTIONS[KING] = True
+PIECE_DISTANCES = np.zeros((7, 7), dtype=bool)
+PIECE_DISTANCES[[BISHOP, ROOK, QUEEN]] = True
+PIECE_DISTANCES[KING, 0] = True
+
+# castling rights columns, from the point of view of the side to move
+OWN_KINGSIDE, OWN_QUEENSIDE, ENEMY_KINGSIDE, ENEMY_QUEENSIDE = range(4)
+CASTLING_ROOKS = (chess.BB_H1, chess.BB_A1, chess.BB_H8, chess.BB_A8)  # white to move
+DARK_SQUARES = np.array([bool(chess.BB_DARK_SQUARES & chess.BB_SQUARES[square]) for square in range(64)])
+
+_zobrist = np.random.default_rng(0).integers(0, 2 ** 63, size=(13 * 64 + 4 + 64 + 1), dtype=np.int64)
+ZOBRIST_PIECES = _zobrist[:13 * 64].reshape(13, 64)  # [piece + 6, square]
+ZOBRIST_CASTLING = _zobrist[13 * 64:13 * 64 + 4]
+ZOBRIST_EP = _zobrist[13 * 64 + 4:13 * 64 + 68]
+ZOBRIST_BLACK = _zobrist[-1]
+
+
+class BatchBoards:
+    """
+    Positions of a batch of standard chess games, from the point of view of the side to move of each game
+    """
+    def __init__(self, boards):
+        if any(board.chess960 for board in boards):
+            raise ValueError('batch playouts only support standard chess')
+        pieces = board_bitboards(boards)  # [N, color, piece type, rank, file], white first
+        types = np.arange(1, 7).reshape(1, 6, 1, 1)
+        mailbox = ((pieces[:, 0] * types).sum(axis=1) - (pieces[:, 1] * types).sum(axis=1)).reshape(-1, 64)
+        self.turn = np.array([board.turn for board in boards], dtype=bool)
+        self.board = np.zeros((len(boards), 65), dtype=np.int8)
+        self.board[:, :64] = np.where(self.turn[:, np.newaxis], mailbox, -mailbox[:, FLIP])
+        castling = np.array([[bool(board.clean_castling_rights() & rook) for rook in CASTLING_ROOKS]
+                             for board in boards], dtype=bool).reshape(len(boards), 4)
+        self.castling = np.where(self.turn[:, np.newaxis], castling, castling[:, [2, 3, 0, 1]])
+        ep_square = np.array([NO_SQUARE if board.ep_square is None else board.ep_square for board in boards])
+        self.ep_square = np.where(self.turn | (ep_square == NO_SQUARE), ep_square, ep_square ^ 56)
+        self.halfmove_clock = np.array([board.halfmove_clock for board in boards], dtype=np.int64)
+        self.fullmove_number = np.array([board.fullmove_number for board in boards], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.board)
+
+    def select(self, games):
+        """
+        Keep the games at the indices <games> only
+        """
+        for name in ('board', 'turn', 'castling', 'ep_square', 'halfmove_clock', 'fullmove_number'):
+            setattr(self, name, getattr(self, name)[games])
+
+    def king_squares(self):
+        games, squares = np.nonzero(self.board[:, :64] == KING)
+        king_squares = np.full(len(self), NO_SQUARE)
+        king_squares[games] = squares
+        return king_squares
+
+    def attacked(self, games, squares):
+        """
+        Check if the opponent attacks <squares> of <games> in the current positions
+        """
+        board = self.board[games]
+        return _attacked(np.take_along_axis(board, RAYS[squares].reshape(len(games), 56), axis=1),
+                         np.take_along_axis(board, KNIGHT_TARGETS[squares], axis=1))
+
+    def legal_moves(self):
+        """
+        Legal moves of every game, as arrays of game index, from square, to square, promotion piece type and
+        special move (1 = en passant, 2 = kingside castling, 3 = queenside castling)
+        """
+        board = self.board
+        moves = [self._piece_moves(), self._pawn_moves(), self._castling_moves()]
+        games, from_squares, to_squares, promotions, specials = (np.concatenate(column) for column in zip(*moves))
+
+        # a move is legal if the king is not attacked after it. Only king moves, moves out of check, moves of
+        # pieces that may be pinned and en passant captures can be illegal. Castling is checked when it is generated.
+        running = np.arange(len(self))
+        king_squares = self.king_squares()
+        rays = RAYS[king_squares].reshape(len(self), 56)
+        ray_pieces = np.take_along_axis(board, rays, axis=1)
+        self.in_check = _attacked(ray_pieces, np.take_along_axis(board, KNIGHT_TARGETS[king_squares], axis=1))
+        ray_pieces = ray_pieces.reshape(-1, 8, 7)
+        first = (ray_pieces != 0).argmax(axis=2)[:, :, np.newaxis]  # first piece on each ray from the king
+        shielding, directions = np.nonzero(np.take_along_axis(ray_pieces, first, axis=2)[:, :, 0] > 0)
+        first_squares = np.take_along_axis(rays.reshape(-1, 8, 7), first, axis=2)[:, :, 0]
+        pinned = np.zeros((len(self), 65), dtype=bool)  # own pieces that may be pinned
+        pinned[running[shielding], first_squares[shielding, directions]] = True
+        moving = board[games, from_squares]
+        test = ((moving == KING) | self.in_check[games] | pinned[games, from_squares] | (specials == 1)) & \
+            (specials < 2)
+        tested = np.nonzero(test)[0]
+        t_games, t_from, t_to, t_moving, t_specials = (column[tested] for column in
+                                                       (games, from_squares, to_squares, moving, specials))
+        t_kings = np.where(t_moving == KING, t_to, king_squares[t_games])
+        rays = RAYS[t_kings].reshape(len(tested), 56)
+        knights = KNIGHT_TARGETS[t_kings]
+        ray_pieces = self._after_move(board[t_games[:, np.newaxis], rays], rays, t_from, t_to, t_moving, t_specials)
+        knight_pieces = self._after_move(board[t_games[:, np.newaxis], knights], knights, t_from, t_to, t_moving,
+                                         t_specials)
+        legal = np.ones(len(games), dtype=bool)
+        legal[tested] = ~_attacked(ray_pieces, knight_pieces)
+        return games[legal], from_squares[legal], to_squares[legal], promotions[legal], specials[legal]
+
+    @staticmethod
+    def _after_move(pieces, squares, from_squares, to_squares, moving, specials):
+        """
+        Pieces on <squares> after each move, without making the moves
+        """
+        from_squares, to_squares = from_squares.astype(np.int8), to_squares.astype(np.int8)
+        pieces = np.where(squares == from_squares[:, np.newaxis], 0, pieces)
+        pieces = np.where(squares == to_squares[:, np.newaxis], moving[:, np.newaxis], pieces)
+        captured = np.where(specials == 1, to_squares - 8, NO_SQUARE).astype(np.int8)  # the pawn taken en passant
+        return np.where(squares == captured[:, np.newaxis], np.int8(0), pieces)
+
+    def _piece_moves(self):
+        board = self.board
+        games, squares = np.nonzero(board[:, :64] >= KNIGHT)
+        piece_types = board[games, squares]
+
+        # sliding pieces and kings: every square up to and including the first piece on each ray
+        targets = RAYS[squares]  # [piece, direction, distance]
+        pieces = board[games[:, np.newaxis, np.newaxis], targets]
+        empty = pieces == 0
+        reached = np.ones_like(empty)
+        reached[:, :, 1:] = np.cumprod(empty[:, :, :-1], axis=2)
+        valid = reached & (pieces <= 0) & (targets != NO_SQUARE) & \
+            PIECE_DIRECTIONS[piece_types][:, :, np.newaxis] & PIECE_DISTANCES[piece_types][:, np.newaxis, :]
+        index, _, _ = np.nonzero(valid)
+        slider_moves = games[index], squares[index], targets[valid]
+
+        knights = piece_types == KNIGHT
+        targets = KNIGHT_TARGETS[squares[knights]]
+        valid = (targets != NO_SQUARE) & (board[games[knights][:, np.newaxis], targets] <= 0)
+        index, _ = np.nonzero(valid)
+        knight_games, knight_squares = games[knights][index], squares[knights][index]
+
+        games = np.concatenate([slider_moves[0], knight_games])
+        no_flags = np.zeros(len(games), dtype=np.int64)
+        return games, np.concatenate([slider_moves[1], knight_squares]), \
+            np.concatenate([slider_moves[2], targets[valid]]), no_flags, no_flags
+
+    def _pawn_moves(self):
+        board = self.board
+        games, squares = np.nonzero(board[:, :64] == PAWN)
+        ep_squares = self.ep_square[games]
+        moves = []
+
+        push = board[games, squares + 8] == 0
+        moves.append((games[push], squares[push], squares[push] + 8, 0))
+        double = push & (board[games, np.where(squares < 16, squares + 16, NO_SQUARE)] == 0) & (squares < 16)
+        moves.append((games[double], squares[double], squares[double] + 16, 0))
+        for offset, edge_file in ((7, 0), (9, 7)):
+            targets = np.where((squares & 7) == edge_file, NO_SQUARE, squares + offset)
+            capture = board[games, targets] < 0
+            moves.append((games[capture], squares[capture], targets[capture], 0))
+            en_passant = (targets == ep_squares) & (targets != NO_SQUARE)
+            moves.append((games[en_passant], squares[en_passant], targets[en_passant], 1))
+
+        games, from_squares, to_squares = (np.concatenate([move[i] for move in moves]) for i in range(3))
+        specials = np.concatenate([np.full(len(move[0]), move[3]) for move in moves])
+        promotions = np.zeros(len(games), dtype=np.int64)
+        promotion = to_squares >= 56
+        if promotion.any():  # one move per promotion piece type
+            keep = ~promotion
+            games, from_squares, to_squares, specials = (np.concatenate([column[keep]] + [column[promotion]] * 4)
+                                                         for column in (games, from_squares, to_squares, specials))
+            promotions = np.concatenate([np.zeros(keep.sum(), dtype=np.int64)] +
+                                        [np.full(promotion.sum(), piece_type)
+                                         for piece_type in (QUEEN, ROOK, BISHOP, KNIGHT)])
+        return games, from_squares, to_squares, promotions, specials
+
+    def _castling_moves(self):
+        board = self.board
+        moves = []
+        for right, rook, between, king_path, to_square, special in (
+                (OWN_KINGSIDE, 7, [5, 6], (4, 5, 6), 6, 2), (OWN_QUEENSIDE, 0, [1, 2, 3], (4, 3, 2), 2, 3)):
+            possible = self.castling[:, right] & (board[:, 4] == KING) & (board[:, rook] == ROOK) & \
+                (board[:, between] == 0).all(axis=1)
+            games = np.nonzero(possible)[0]
+            if len(games):  # the king may not castle out of, through or into check
+                attacked = self.attacked(np.repeat(games, 3), np.tile(king_path, len(games)))
+                games = games[~attacked.reshape(-1, 3).any(axis=1)]
+            num_moves = len(games)
+            moves.append((games, np.full(num_moves, 4), np.full(num_moves, to_square),
+                          np.zeros(num_moves, dtype=np.int64), np.full(num_moves, special)))
+        return tuple(np.concatenate(column) for column in zip(*moves))
+
+    def position_keys(self, games, en_passant):
+        """
+        Hash of the current position of each game, with the en passant square only if <en_passant> (a legal en
+        passant capture exists), like the transposition key of python-chess
+        """
+        board = self.board[games, :64].astype(np.int64) + 6
+        keys = np.bitwise_xor.reduce(ZOBRIST_PIECES[board, np.arange(64)], axis=1)
+        keys ^= np.bitwise_xor.reduce(np.where(self.castling[games], ZOBRIST_CASTLING, 0), axis=1)
+        keys ^= np.where(en_passant, ZOBRIST_EP[np.minimum(self.ep_square[games], 63)], 0)
+        keys ^= np.where(self.turn[games], 0, ZOBRIST_BLACK)
+        return keys
+
+    def insufficient_material(self):
+        """
+        Neither side has sufficient winning material (see chess.Board.has_insufficient_material())
+        """
+        board = self.board[:, :64]
+        result = np.ones(len(self), dtype=bool)
+        pawns = (np.abs(board) == PAWN).any(axis=1)
+        knights = np.abs(board) == KNIGHT
+        bishops = np.abs(board) == BISHOP
+        same_color_bishops = ~(bishops & DARK_SQUARES).any(axis=1) | ~(bishops & ~DARK_SQUARES).any(axis=1)
+        for sign in (1, -1):
+            own = board * sign > 0
+            heavy = (own & ((board * sign == PAWN) | (board * sign == ROOK) | (board * sign == QUEEN))).any(axis=1)
+            own_knights = (own & knights).any(axis=1)
+            only_knight = (own.sum(axis=1) <= 2) & ~((board * sign < 0) & (np.abs(board) != KING) &
+                                                     (np.abs(board) != QUEEN)).any(axis=1)
+            own_bishops = (own & bishops).any(axis=1)
+            insufficient = np.where(own_knights, only_knight,
+                                    np.where(own_bishops, same_color_bishops & ~pawns & ~knights.any(axis=1), True))
+            result &= ~heavy & insufficient
+        return result
+
+    def play(self, games, from_squares, to_squares, promotions, specials):
+        """
+        Make one move in each of <games>, then turn their boards around for the other side
+        """
+        board = self.board
+        moving = board[games, from_squares]
+        capture = (board[games, to_squares] != 0) | (specials == 1)
+        board[games, from_squares] = 0
+        board[games, to_squares] = np.where(promotions > 0, promotions, moving)
+        board[games[specials == 1], to_squares[specials == 1] - 8] = 0
+        for special, rook, rook_to in ((2, 7, 5), (3, 0, 3)):
+            castles = games[specials == special]
+            board[castles, rook] = 0
+            board[castles, rook_to] = ROOK
+
+        castling = self.castling
+        castling[games[from_squares == 4], OWN_KINGSIDE] = False  # the king can only castle from e1
+        castling[games[from_squares == 4], OWN_QUEENSIDE] = False
+        for column, square in ((OWN_KINGSIDE, 7), (OWN_QUEENSIDE, 0), (ENEMY_KINGSIDE, 63), (ENEMY_QUEENSIDE, 56)):
+            castling[games[(from_squares == square) | (to_squares == square)], column] = False
+        double = (moving == PAWN) & (to_squares - from_squares == 16)
+        self.ep_square[games] = np.where(double, (from_squares + 8) ^ 56, NO_SQUARE)
+        self.halfmove_clock[games] = np.where((moving == PAWN) | capture, 0, self.halfmove_clock[games] + 1)
+        self.fullmove_number[games] += ~self.turn[games]
+        self.turn[games] = ~self.turn[games]
+
+        board[games, :64] = -board[games[:, np.newaxis], FLIP]
+        castling[games] = castling[games][:, [2, 3, 0, 1]]
+
+    def to_boards(self, games):
+        """
+        python-chess boards of the current positions of <games>
+        """
+        boards = []
+        for game in games:
+            mailbox = self.board[game, :64]
+            turn = bool(self.turn[game])
+            if not turn:
+                mailbox = -mailbox[FLIP]
+            board = chess.Board(None)
+            bits = [int(np.packbits(mask, bitorder='little').view(np.uint64)[0]) for mask in
+                    [mailbox > 0, mailbox < 0] + [np.abs(mailbox) == piece_type for piece_type in range(1, 7)]]
+            board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK] = bits[0], bits[1]
+            board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings = bits[2:]
+            board.occupied = bits[0] | bits[1]
+            board.turn = turn
+            castling = self.castling[game] if turn else self.castling[game][[2, 3, 0, 1]]
+            board.castling_rights = sum(rook for rook, right in zip(CASTLING_ROOKS, castling) if right)
+            ep_square = int(self.ep_square[game])
+            board.ep_square = None if ep_square == NO_SQUARE else ep_square if turn else ep_square ^ 56
+            board.halfmove_clock = int(self.halfmove_clock[game])
+            board.fullmove_number = int(self.fullmove_number[game])
+            boards.append(board)
+        return boards
+
+
+def _attacked(ray_pieces, knight_pieces):
+    """
+    Check if the square at the origin of the rays is attacked by the opponent (negative pieces).
+    ray_pieces [N, 56] are the pieces along the 8 rays of the square, knight_pieces [N, 8] the pieces a knight
+    jump away.
+    """
+    ray_pieces = ray_pieces.reshape(-1, 8, 7)
+    occupied = ray_pieces != 0
+    first = occupied.argmax(axis=2)
+    first_pieces = np.take_along_axis(ray_pieces, first[:, :, np.newaxis], axis=2)[:, :, 0]
+    orthogonal, diagonal = first_pieces[:, :4], first_pieces[:, 4:]
+    adjacent = first == 0
+    return ((orthogonal == -ROOK) | (orthogonal == -QUEEN)).any(axis=1) | \
+        ((diagonal == -BISHOP) | (diagonal == -QUEEN)).any(axis=1) | \
+        ((first_pieces == -KING) & adjacent).any(axis=1) | \
+        ((first_pieces[:, [NE, NW]] == -PAWN) & adjacent[:, [NE, NW]]).any(axis=1) | \
+        (knight_pieces == -KNIGHT).any(axis=1)
+
+
+def batch_playouts(boards, max_plies=None, rng=None):
+    """
+    Random playouts of all <boards> in lock-step: every ply, each running game plays a legal move chosen uniformly
+    at random, until the game is over or <max_plies> moves have been played.
+    Returns:
+        - the results from the point of view of white (1, -1 or 0), NaN for games that are still running
+        - the number of moves played in each game
+        - python-chess boards of the final positions of the running games (None for finished games)
+    Repetitions only count positions reached in the playout.
+    """
+    rng = rng or np.random.default_rng()
+    games = BatchBoards(boards)
+    results = np.full(len(boards), np.nan)
+    plies = np.zeros(len(boards), dtype=np.int64)
+    final_boards = [None] * len(boards)
+    index = np.arange(len(boards))  # original index of each running game
+    # keys of the positions since the last capture or pawn move, for fivefold repetitions
+    history = np.zeros((len(boards), 152), dtype=np.int64)
+    history_length = np.zeros(len(boards), dtype=np.int64)
+    ply = 0
+    while len(games):
+        if max_plies is not None and ply == max_plies:
+            for i, board in zip(index, games.to_boards(range(len(games)))):
+                final_boards[i] = board
+            break
+        plies[index] = ply
+        running = np.arange(len(games))
+
+        # game over: same rules as chess.Board.outcome()
+        moves = games.legal_moves()
+        move_games, specials = moves[0], moves[4]
+        no_moves = np.bincount(move_games, minlength=len(games)) == 0
+        checkmate = no_moves & games.in_check
+        keys = games.position_keys(running, np.bincount(move_games[specials == 1], minlength=len(games)) > 0)
+        repetitions = ((history == keys[:, np.newaxis]) & (np.arange(history.shape[1]) < history_length[:, np.newaxis]))
+        fivefold = repetitions.sum(axis=1) >= 4
+        finished = no_moves | games.insufficient_material() | (games.halfmove_clock >= 150) | fivefold
+        results[index[finished]] = np.where(checkmate, np.where(games.turn, -1, 1), 0)[finished]
+        history[running, history_length] = keys
+        history_length += 1
+
+        # one random legal move per running game
+        order = np.lexsort((rng.random(len(move_games)), move_games))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = move_games[order][1:] != move_games[order][:-1]
+        chosen = order[last]
+        chosen = chosen[~finished[move_games[chosen]]]
+        games.play(*(column[chosen] for column in moves))
+        history_length[games.halfmove_clock == 0] = 0
+
+        keep = ~finished
+        games.select(keep)
+        index, history, history_length = index[keep], history[keep], history_length[keep]
+        ply += 1
+    return results, plies, final_boards
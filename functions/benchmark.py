@@ -0,0 +1,922 @@
+import gc
+import random
+import time
+import tracemalloc
+
+import chess
+
+import numpy as np
+
+from functions.batch_playout import BatchBoards, batch_playouts
+from functions.compare_models import play
+from functions.decisive_moves import checking_candidates, find_decisive_move
+from functions.eval import evaluate, evaluate_reference, evaluate_batch, pawn_hash
+from functions.incremental_eval import IncrementalEvaluator
+from functions.playout import PlayoutBoard
+from models.mcts import MCTS
+from models.mcts_decisive_moves import MCTSDecisiveMoves
+from models.mcts_epsilon_greedy import MCTSEpsilonGreedy
+from models.mcts_ept import MCTSEarlyPlayoutTermination
+from models.mcts_progressive_unpruning import MCTSProgressiveUnpruning
+from models.mcts_root_parallelization import MCTSRootParallelization
+from models.mcts_score_bounded import MCTSScoreBounded
+from models.mcts_solver import MCTSSolver
+from models.mcts_tree_parallelization import MCTSTreeParallelization
+from node.shared_arena import SharedNodeArena
+from players.mcts_player import MCTSPlayer
+
+# (FEN, number of moves to mate, first move of the mate)
+MATE_SUITE = [
+    ('6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1', 1, 'a1a8'),
+    ('r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 2 4', 1, 'f3f7'),
+    ('7k/5Q2/6K1/8/8/8/8/8 w - - 0 1', 1, 'f7f8'),
+    ('r1b2k1r/ppp1bppp/8/1B1Q4/5q2/2P5/PPP2PPP/R3R1K1 w - - 1 1', 2, 'd5d8'),
+    ('6k1/pp4p1/2p5/2bp4/8/P5Pb/1P3rrP/2BRRN1K b - - 0 1', 2, 'g2g1'),
+    ('kbK5/pp6/1P6/8/8/8/8/R7 w - - 0 1', 2, 'a1a6'),
+    ('5rk1/1p3ppp/p7/8/8/2B4R/PPP2PPQ/6K1 w - - 0 1', 3, 'h3h7'),
+]
+
+
+def count_nodes(node):
+    count = 1
+    for child in node.children:
+        count += count_nodes(child)
+    return count
+
+
+def fen_corpus(num_games=100, max_plies=200, seed=0):
+    """
+    Positions of random games, used as the golden corpus of the evaluation checks
+    """
+    rng = random.Random(seed)
+    fens = []
+    for _ in range(num_games):
+        board = chess.Board()
+        while not board.is_game_over() and board.ply() < max_plies:
+            board.push(rng.choice(list(board.legal_moves)))
+            fens.append(board.fen())
+    return fens
+
+
+def check_evaluate_parity(fens=None):
+    """
+    Check that evaluate() gives exactly the same values as evaluate_reference() for both sides of every position
+    """
+    if fens is None:
+        fens = fen_corpus()
+    for fen in fens:
+        board = chess.Board(fen)
+        for is_white in (True, False):
+            expected = evaluate_reference(board, is_white)
+            actual = evaluate(board, is_white)
+            assert actual == expected and type(actual) == type(expected), \
+                f'{fen} ({"white" if is_white else "black"}): {actual} != {expected}'
+    print(f'evaluate parity: {len(fens)} positions OK')
+    return len(fens)
+
+
+def benchmark_evaluate(fens=None):
+    """
+    Number of evaluations per second of the reference and the bitboard evaluation functions
+    """
+    if fens is None:
+        fens = fen_corpus()
+    boards = [chess.Board(fen) for fen in fens]
+    results = {}
+    for function in (evaluate_reference, evaluate):
+        start_time = time.time()
+        for board in boards:
+            function(board, board.turn)
+        results[function.__name__] = len(boards) / (time.time() - start_time)
+        print(f'{function.__name__:>18}: {results[function.__name__]:.2f} evals/sec')
+    return results
+
+
+def benchmark_pawn_hash(fens=None):
+    """
+    Number of evaluations per second without and with the pawn hash table, and the hit rate of the table
+    """
+    if fens is None:
+        fens = fen_corpus()
+    boards = [chess.Board(fen) for fen in fens]
+    max_size = pawn_hash.max_size
+    results = {}
+    for name, size in (('no pawn hash', 0), ('pawn hash', max_size)):
+        pawn_hash.max_size = size
+        pawn_hash.clear()
+        pawn_hash.hits = pawn_hash.misses = 0
+        start_time = time.time()
+        for board in boards:
+            evaluate(board, board.turn)
+        results[name] = len(boards) / (time.time() - start_time)
+        print(f'{name:>12}: {results[name]:.2f} evals/sec')
+    results['hit_rate'] = pawn_hash.get_stats()['pawn_hash_hit_rate']
+    print(f'pawn hash hit rate: {results["hit_rate"]:.2%}')
+    return results
+
+
+def check_evaluate_batch_parity(fens=None):
+    """
+    Check that evaluate_batch() gives the same values as evaluate() for both sides of every position
+    """
+    if fens is None:
+        fens = fen_corpus()
+    boards = [chess.Board(fen) for fen in fens]
+    for is_white in (True, False, [board.turn for board in boards]):
+        scores = evaluate_batch(boards, is_white)
+        sides = is_white if isinstance(is_white, list) else [is_white] * len(boards)
+        for board, side, actual in zip(boards, sides, scores):
+            expected = evaluate(board, side)
+            assert actual == expected, f'{board.fen()} ({"white" if side else "black"}): {actual} != {expected}'
+    print(f'evaluate_batch parity: {len(fens)} positions OK')
+    return len(fens)
+
+
+def benchmark_evaluate_batch(batch_sizes=(1, 4, 16, 64, 256, 1024, 4096), fens=None):
+    """
+    Number of evaluations per second of evaluate_batch() for each batch size, compared with evaluate()
+    """
+    if fens is None:
+        fens = fen_corpus()
+    boards = [chess.Board(fen) for fen in fens]
+    start_time = time.time()
+    for board in boards:
+        evaluate(board, board.turn)
+    results = {'scalar': len(boards) / (time.time() - start_time)}
+    print(f'{"scalar":>10}: {results["scalar"]:.2f} evals/sec')
+    for batch_size in batch_sizes:
+        num_batches = max(1, len(boards) // batch_size)
+        batches = [[boards[(i * batch_size + j) % len(boards)] for j in range(batch_size)]
+                   for i in range(num_batches)]
+        start_time = time.time()
+        for batch in batches:
+            evaluate_batch(batch, True)
+        results[batch_size] = num_batches * batch_size / (time.time() - start_time)
+        print(f'{f"batch {batch_size}":>10}: {results[batch_size]:.2f} evals/sec')
+    return results
+
+
+def check_incremental_parity(num_games=20, max_plies=200, seed=0):
+    """
+    Play random games through an IncrementalEvaluator and check that the evaluation of every child of every
+    position is the same as a full evaluate() of the child board
+    """
+    rng = random.Random(seed)
+    num_checked = 0
+    for _ in range(num_games):
+        board = chess.Board()
+        evaluator = IncrementalEvaluator(board)
+        while not board.is_game_over() and board.ply() < max_plies:
+            for move in list(board.legal_moves):
+                for is_white in (True, False):
+                    actual = evaluator.evaluate_move(move, is_white)
+                    board.push(move)
+                    expected = evaluate(board, is_white)
+                    board.pop()
+                    assert actual == expected, f'{board.fen()} {move}: {actual} != {expected}'
+                num_checked += 1
+            evaluator.push(rng.choice(list(board.legal_moves)))
+        while board.move_stack:  # popping must restore the evaluation of every earlier position
+            evaluator.pop()
+            assert evaluator.evaluate(board.turn) == evaluate(board, board.turn), board.fen()
+    print(f'incremental evaluation parity: {num_checked} moves OK')
+    return num_checked
+
+
+def benchmark_incremental_evaluation(fens=None):
+    """
+    Number of child positions scored per second by push/evaluate/pop and by an IncrementalEvaluator
+    """
+    if fens is None:
+        fens = fen_corpus()
+    boards = [chess.Board(fen) for fen in fens]
+    moves = [list(board.legal_moves) for board in boards]
+    num_children = sum(len(legal_moves) for legal_moves in moves)
+
+    start_time = time.time()
+    for board, legal_moves in zip(boards, moves):
+        for move in legal_moves:
+            board.push(move)
+            evaluate(board, not board.turn)
+            board.pop()
+    full = num_children / (time.time() - start_time)
+
+    start_time = time.time()
+    for board, legal_moves in zip(boards, moves):
+        evaluator = IncrementalEvaluator(board)
+        for move in legal_moves:
+            evaluator.evaluate_move(move, board.turn)
+    incremental = num_children / (time.time() - start_time)
+
+    print(f'{"full":>12}: {full:.2f} children/sec')
+    print(f'{"incremental":>12}: {incremental:.2f} children/sec ({incremental / full:.2f}x)')
+    return {'full': full, 'incremental': incremental}
+
+
+def random_playout(board):
+    """
+    Random playout on a chess.Board with is_game_over(), as done before the playout board. Returns the result and
+    the final position.
+    """
+    board = board.copy()
+    while not board.is_game_over():
+        board.push(random.choice([move for move in board.legal_moves]))
+    return board.result(), board.fen()
+
+
+def fast_random_playout(board):
+    """
+    Random playout on a PlayoutBoard. Returns the result and the final position.
+    """
+    board = PlayoutBoard.from_board(board)
+    while True:
+        moves = board.legal_move_list()
+        result = board.outcome_of(moves)
+        if result is not None:
+            return result, board.fen()
+        board.play(random.choice(moves))
+
+
+def check_playout_parity(num_playouts=200, seed=0):
+    """
+    Check that random playouts on a PlayoutBoard play the same games and end with the same results as playouts
+    on a chess.Board, starting from positions with a move history
+    """
+    fens = fen_corpus(num_games=10, seed=seed)
+    rng = random.Random(seed)
+    for i in range(num_playouts):
+        board = chess.Board()
+        for _ in range(rng.randrange(40)):  # a move history, so that repetitions before the playout count
+            board.push(rng.choice(list(board.legal_moves)))
+        if i % 2:
+            board = chess.Board(rng.choice(fens))
+        random.seed(i)
+        expected = random_playout(board)
+        random.seed(i)
+        actual = fast_random_playout(board)
+        assert actual == expected, f'{board.fen()}: {actual} != {expected}'
+    print(f'playout parity: {num_playouts} playouts OK')
+    return num_playouts
+
+
+def benchmark_playouts(num_playouts=200, board=None):
+    """
+    Number of random playouts (to the end of the game) per second on a chess.Board and on a PlayoutBoard
+    """
+    if board is None:
+        board = chess.Board()
+    results = {}
+    for function in (random_playout, fast_random_playout):
+        random.seed(0)
+        start_time = time.time()
+        for _ in range(num_playouts):
+            function(board)
+        results[function.__name__] = num_playouts / (time.time() - start_time)
+        print(f'{function.__name__:>19}: {results[function.__name__]:.2f} playouts/sec')
+    return results
+
+
+def check_batch_move_generation(fens=None, seed=0):
+    """
+    Check that the lock-step batch engine generates exactly the legal moves of python-chess in every position, and
+    that playing one of them gives the same position as chess.Board.push()
+    """
+    if fens is None:
+        fens = fen_corpus()
+    boards = [chess.Board(fen) for fen in fens]
+    games = BatchBoards(boards)
+    moves = games.legal_moves()
+    for i, board in enumerate(boards):
+        flip = 0 if board.turn else 56  # the batch engine sees every board from the side to move
+        legal = moves[0] == i
+        actual = sorted(chess.Move(int(from_square) ^ flip, int(to_square) ^ flip, int(promotion) or None).uci()
+                        for from_square, to_square, promotion in zip(*(column[legal] for column in moves[1:4])))
+        expected = sorted(move.uci() for move in board.legal_moves)
+        assert actual == expected, f'{board.fen()}: {set(actual) ^ set(expected)}'
+
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(moves[0])), moves[0]))
+    chosen = order[np.append(moves[0][order][1:] != moves[0][order][:-1], True)]  # one random move per game
+    games.select(np.unique(moves[0]))
+    boards = [board for board in boards if any(board.legal_moves)]
+    games.play(np.arange(len(boards)), *(column[chosen] for column in moves[1:]))
+    for board, actual, from_square, to_square, promotion in zip(boards, games.to_boards(range(len(boards))),
+                                                                *(column[chosen] for column in moves[1:4])):
+        flip = 0 if board.turn else 56
+        board.push(chess.Move(int(from_square) ^ flip, int(to_square) ^ flip, int(promotion) or None))
+        assert actual.fen(en_passant='fen') == board.fen(en_passant='fen'), f'{board.fen()} != {actual.fen()}'
+    print(f'batch move generation: {len(fens)} positions OK')
+    return len(fens)
+
+
+def check_batch_playout_statistics(num_playouts=400, board=None, seed=0):
+    """
+    Compare the outcomes and the lengths of lock-step batch playouts with random playouts on a PlayoutBoard.
+    Both choose moves uniformly at random, so their statistics must agree within the sampling error.
+    """
+    if board is None:
+        board = chess.Board()
+    results, plies, _ = batch_playouts([board] * num_playouts, rng=np.random.default_rng(seed))
+    batch = [np.mean(results == 1), np.mean(results == -1), np.mean(results == 0), plies.mean()]
+
+    random.seed(seed)
+    results = []
+    for _ in range(num_playouts):
+        playout = PlayoutBoard.from_board(board)
+        num_plies = 0
+        while True:
+            moves = playout.legal_move_list()
+            result = playout.outcome_of(moves)
+            if result is not None:
+                break
+            playout.play(random.choice(moves))
+            num_plies += 1
+        results.append((result, num_plies))
+    reference = [np.mean([result == outcome for result, _ in results]) for outcome in ('1-0', '0-1', '1/2-1/2')]
+    reference.append(np.mean([num_plies for _, num_plies in results]))
+
+    for name, values in (('batch', batch), ('python-chess', reference)):
+        print(f'{name:>12}: white {values[0]:.3f}, black {values[1]:.3f}, draw {values[2]:.3f}, '
+              f'{values[3]:.1f} plies')
+    tolerance = 4 * np.sqrt(0.25 * 2 / num_playouts)  # 4 standard errors of a difference of two frequencies
+    assert all(abs(a - b) < tolerance for a, b in zip(batch[:3], reference[:3])), 'outcome frequencies differ'
+    assert abs(batch[3] - reference[3]) < 0.2 * reference[3], 'playout lengths differ'
+    return batch, reference
+
+
+def benchmark_batch_playouts(batch_sizes=(1, 16, 64, 256, 1024), max_plies=(None, 3), board=None):
+    """
+    Number of lock-step batch playouts per second for each batch size, to the end of the game and terminated early
+    """
+    if board is None:
+        board = chess.Board()
+    results = {}
+    for plies in max_plies:
+        for batch_size in batch_sizes:
+            num_batches = 1 if plies is None else max(1, 1024 // batch_size)
+            start_time = time.time()
+            for _ in range(num_batches):
+                batch_playouts([board] * batch_size, max_plies=plies)
+            results[plies, batch_size] = num_batches * batch_size / (time.time() - start_time)
+            print(f'max plies {plies}, batch {batch_size:>4}: {results[plies, batch_size]:.2f} playouts/sec')
+    return results
+
+
+def check_decisive_moves(fens=None):
+    """
+    Check that the checking candidates include every move that gives check, and that find_decisive_move() finds a
+    mate in one exactly when trying every legal move does
+    """
+    if fens is None:
+        fens = fen_corpus()
+    num_moves = num_candidates = 0
+    for fen in fens:
+        board = chess.Board(fen)
+        moves = list(board.legal_moves)
+        checks = {move for move in moves if board.gives_check(move)}
+        mates = {move for move in checks if (board.push(move), board.is_checkmate(), board.pop())[1]}
+        for legal_moves in (moves, None):
+            candidates = checking_candidates(board, legal_moves)
+            assert checks <= set(candidates), f'{fen}: missing checks {checks - set(candidates)}'
+            move = find_decisive_move(board, legal_moves)
+            assert move in mates if mates else move is None, f'{fen}: {move} not in {mates}'
+        num_moves += len(moves)
+        num_candidates += len(candidates)
+    print(f'decisive moves: {len(fens)} positions OK, {num_candidates / num_moves:.1%} of the moves are candidates')
+
+
+def scan_decisive_move(board, moves):
+    """
+    Decisive move detection by playing every legal move, as MCTSDecisiveMoves used to do
+    """
+    temp_board = board.copy(stack=False)
+    for move in moves:
+        temp_board.push(move)
+        if temp_board.is_checkmate():
+            return move
+        temp_board.pop()
+    return None
+
+
+def benchmark_decisive_moves(num_playouts=100, max_plies=50, num_sims=300, board=None):
+    """
+    Playout plies per second with a random policy, with decisive moves found by playing every move, with the check
+    mask filter and with anti-decisive moves, then MCTSDecisiveMoves simulations per second with each policy
+    """
+    if board is None:
+        board = chess.Board()
+
+    policies = {
+        'random': lambda playout, moves: random.choice(moves),
+        'scan': lambda playout, moves: scan_decisive_move(playout, moves) or random.choice(moves),
+        'check masks': MCTSDecisiveMoves(board).choose_move,
+        'anti-decisive': MCTSDecisiveMoves(board, anti_decisive=True).choose_move,
+    }
+    results = {}
+    for name, policy in policies.items():
+        random.seed(0)
+        num_plies = 0
+        start_time = time.time()
+        for _ in range(num_playouts):
+            playout = PlayoutBoard.from_board(board)
+            for _ in range(max_plies):
+                moves = playout.legal_move_list()
+                if playout.outcome_of(moves) is not None:
+                    break
+                playout.play(policy(playout, moves))
+                num_plies += 1
+        results[name] = num_plies / (time.time() - start_time)
+        print(f'{name:>13}: {results[name]:.0f} plies/sec')
+
+    scan = type('MCTSDecisiveMovesScan', (MCTSDecisiveMoves,), {
+        'choose_move': lambda self, curr_board, moves=None: scan_decisive_move(curr_board, moves) or
+        self.get_random_move(curr_board, moves)})
+    for name, model_class, kwargs in (('scan', scan, {}), ('check masks', MCTSDecisiveMoves, {}),
+                                      ('anti-decisive', MCTSDecisiveMoves, {'anti_decisive': True})):
+        random.seed(0)
+        model = model_class(board, max_sims=num_sims, max_time=None, **kwargs)
+        model.run(board)
+        results[name, 'sims'] = model.stats['total_simulations'] / model.stats['total_time']
+        print(f'{name:>13}: {results[name, "sims"]:.0f} sims/sec')
+        model.close()
+    return results
+
+
+def benchmark_greedy_policies(top_k=(1, 3, 5), num_sims=300, num_games=2, game_sims=50, fens=None, board=None):
+    """
+    Compare the 'delta' greedy policy of MCTSEpsilonGreedy with the 'evaluate' policy: how often its move is one of
+    the best moves of the full evaluation, simulations per second, and the score of <num_games> games (alternating
+    colours, <game_sims> simulations per move) against the 'evaluate' model.
+    """
+    if fens is None:
+        fens = fen_corpus()[::10]
+    if board is None:
+        board = chess.Board()
+    results = {}
+    model = MCTSEpsilonGreedy(board, max_sims=num_sims, max_time=None)
+    model.run(board)
+    results['evaluate'] = model.stats['total_simulations'] / model.stats['total_time']
+    print(f'greedy policy evaluate: {results["evaluate"]:.0f} sims/sec')
+    model.close()
+
+    for k in top_k:
+        model = MCTSEpsilonGreedy(board, greedy_policy='delta', greedy_top_k=k, max_sims=num_sims, max_time=None)
+        agreement = 0
+        num_positions = 0
+        for fen in fens:
+            position = chess.Board(fen)
+            if position.is_game_over():
+                continue
+            evaluator = IncrementalEvaluator(position)
+            best_score = evaluator.evaluate_move(model.get_best_move(position, evaluator), position.turn)
+            move = model.get_delta_best_move(position, evaluator)
+            agreement += evaluator.evaluate_move(move, position.turn) == best_score
+            num_positions += 1
+        model.run(board)
+        sims_per_sec = model.stats['total_simulations'] / model.stats['total_time']
+        model.close()
+
+        player = MCTSPlayer(MCTSEpsilonGreedy(greedy_policy='delta', greedy_top_k=k, max_sims=game_sims,
+                                              max_time=None))
+        baseline = MCTSPlayer(MCTSEpsilonGreedy(max_sims=game_sims, max_time=None))
+        wins, losses, ties = 0, 0, 0
+        for i in range(num_games):
+            player.reset()
+            baseline.reset()
+            _, result, _ = play(player, baseline, player1_plays_first=i % 2 == 0, board=board.copy())
+            wins, losses, ties = wins + result[0], losses + result[1], ties + result[2]
+        player.close()
+        baseline.close()
+        results['delta', k] = {'agreement': agreement / num_positions, 'sims_per_sec': sims_per_sec,
+                               'wins': wins, 'losses': losses, 'ties': ties}
+        print(f'greedy policy delta, top {k}: {sims_per_sec:.0f} sims/sec, best move {agreement / num_positions:.1%},'
+              f' vs evaluate +{wins} -{losses} ={ties}')
+    return results
+
+
+def interior_nodes(node):
+    """
+    Fully expanded nodes of the tree below <node>, where selection chooses between the children
+    """
+    nodes = []
+    if node.initialized and not node.untried_actions and node.children:
+        nodes.append(node)
+        for child in node.children:
+            nodes.extend(interior_nodes(child))
+    return nodes
+
+
+def benchmark_child_ordering(model_classes=(MCTSProgressiveUnpruning, MCTSScoreBounded), rank_intervals=(1, 8, 32),
+                             num_sims=2000, num_rounds=200, board=None):
+    """
+    Selection steps per second on the interior nodes of a searched tree, and simulations per second of the search,
+    for each number of visits between two rankings of the children (1 ranks on every visit, like a full sort)
+    """
+    if board is None:
+        board = chess.Board()
+    results = {}
+    for model_class in model_classes:
+        for interval in rank_intervals:
+            random.seed(0)
+            model = model_class(board, max_sims=num_sims, max_time=None, rank_interval=interval)
+            model.run(board)
+            sims_per_sec = model.stats['total_simulations'] / model.stats['total_time']
+            nodes = interior_nodes(model.tree)
+            start_time = time.time()
+            for _ in range(num_rounds):
+                for node in nodes:
+                    node.num_visits += 1  # a visit since the last selection, as in a search
+                    model.selection(node)
+            steps_per_sec = num_rounds * len(nodes) / (time.time() - start_time)
+            model.close()
+            results[model_class.__name__, interval] = {'steps_per_sec': steps_per_sec, 'sims_per_sec': sims_per_sec}
+            print(f'{model_class.__name__}, rank interval {interval:>2}: {steps_per_sec:.0f} selections/sec over '
+                  f'{len(nodes)} nodes | {sims_per_sec:.0f} sims/sec')
+    return results
+
+
+def benchmark_bound_propagation(num_sims=2000, board=None):
+    """
+    Time the bound propagation of MCTSScoreBounded along the path of every leaf of a searched tree, incremental and
+    recomputed from all children at every node. Then compare the simulations per second of the score-bounded model
+    with MCTSProgressiveUnpruning, which has no bounds to propagate.
+    """
+    if board is None:
+        board = chess.Board()
+    random.seed(0)
+    model = MCTSScoreBounded(board, max_sims=num_sims, max_time=None)
+    model.run(board)
+    model.search_path = []
+    paths = [model._get_path(node) for node in model.tree.descendants if not node.children]
+    results = {}
+    for name, propagate in (('incremental', model.propagate_bounds), ('recompute', model.recompute_bounds)):
+        start_time = time.time()
+        for path in paths:
+            propagate(path)
+        results[name] = len(paths) / (time.time() - start_time)
+        print(f'{name:>11}: {results[name]:.0f} paths/sec ({len(paths)} paths)')
+    model.close()
+
+    for model_class in (MCTSProgressiveUnpruning, MCTSScoreBounded):
+        random.seed(0)
+        model = model_class(board, max_sims=num_sims, max_time=None)
+        model.run(board)
+        results[model_class.__name__] = model.stats['total_simulations'] / model.stats['total_time']
+        print(f'{model_class.__name__}: {results[model_class.__name__]:.0f} sims/sec')
+        model.close()
+    return results
+
+
+def benchmark_solver(suite=MATE_SUITE, max_sims=5000, max_time=30, seed=0):
+    """
+    Search each mate-in-N position of <suite> with MCTSScoreBounded and MCTSSolver. Reports the move played, the
+    simulations used, the time taken and, for the solver, whether the root was proven and the simulations saved.
+    """
+    results = {}
+    for fen, num_moves, solution in suite:
+        for model_class in (MCTSScoreBounded, MCTSSolver):
+            random.seed(seed)
+            board = chess.Board(fen)
+            model = model_class(board, max_sims=max_sims, max_time=max_time)
+            move = model.run(board)
+            stats = model.get_stats()
+            model.close()
+            result = {'move': move.uci(), 'simulations': stats['total_simulations'], 'time': stats['total_time'],
+                      'proven': model.tree.proven is not None, 'simulations_saved': stats.get('simulations_saved', 0)}
+            results[fen, model_class.__name__] = result
+            print(f'mate in {num_moves} ({solution}), {model_class.__name__:>16}: {result["move"]} | '
+                  f'{result["simulations"]} sims | {result["time"]:.2f} s | proven {result["proven"]} | '
+                  f'{result["simulations_saved"]} sims saved')
+    return results
+
+
+def benchmark_time_management(model_class=MCTSEarlyPlayoutTermination, max_sims=1000, max_time=2, clock=60,
+                              num_games=2, game_sims=200, fens=None):
+    """
+    Compare a fixed budget per move with the early stopping and time allocation of the SearchController: the average
+    time per move over <fens>, how many moves stopped early, and how often the move is the one of the fixed budget.
+    Then the average time per game of <num_games> self-play games with <game_sims> simulations per move.
+    """
+    if fens is None:
+        fens = fen_corpus()[::200]
+    positions = [chess.Board(fen) for fen in fens]
+    positions = [position for position in positions if not position.is_game_over()]
+    configs = {
+        'fixed': {},
+        'early stop': {'early_stop': True},
+        'early stop + kld': {'early_stop': True, 'min_kld_gain': 1e-6},
+        'clock': {'early_stop': True, 'clock': clock, 'min_kld_gain': 1e-6},
+    }
+    results = {}
+    fixed_moves = None
+    for name, kwargs in configs.items():
+        model = model_class(max_sims=max_sims, max_time=max_time, **kwargs)
+        moves = []
+        for j, position in enumerate(positions):
+            random.seed(j)  # the same playouts until a search stops early
+            model.controller.new_game()  # every position is searched as the first move of a game on the clock
+            moves.append(model.run(position))
+        stats = model.get_stats()
+        model.close()
+        if fixed_moves is None:
+            fixed_moves = moves
+        agreement = sum(move == fixed for move, fixed in zip(moves, fixed_moves)) / len(positions)
+
+        players = [MCTSPlayer(model_class(max_sims=game_sims, max_time=None, **kwargs)) for _ in range(2)]
+        game_time = 0
+        for i in range(num_games):
+            random.seed(i)
+            _, _, total_time = play(players[0], players[1], board=chess.Board())
+            game_time += total_time
+            for player in players:
+                player.reset()
+        game_stops = sum(player.get_stats()['early_stops'] for player in players)
+        game_moves = sum(player.get_stats()['searches'] for player in players)
+        for player in players:
+            player.close()
+
+        results[name] = {'time_per_move': stats['total_time'] / len(positions), 'early_stops': stats['early_stops'],
+                         'agreement': agreement, 'time_per_game': game_time / num_games,
+                         'game_early_stops': game_stops / game_moves}
+        print(f'time management {name:>16}: {results[name]["time_per_move"]:.2f} s per move, '
+              f'{stats["early_stops"]}/{len(positions)} stopped early, same move {agreement:.0%} | '
+              f'{results[name]["time_per_game"]:.1f} s per game, {game_stops}/{game_moves} moves stopped early')
+    return results
+
+
+def benchmark_search_iter(model_class=MCTSEarlyPlayoutTermination, intervals=(0.1, 0.01, 0), num_sims=3000,
+                          repeats=5, board=None):
+    """
+    Overhead of the snapshots of search_iter against run (final snapshot only), with a snapshot every <interval>
+    seconds (0 takes one after every simulation). Throughput differences are within the noise of the playouts, so
+    the overhead is also measured directly: the time taken by the snapshots over the time of the search. Every search
+    starts from a new tree with the same seed, the runs of the intervals are interleaved and the best one is kept.
+    """
+    if board is None:
+        board = chess.Board()
+    intervals = (None,) + tuple(intervals)
+    results = {interval: {'sims_per_sec': 0} for interval in intervals}
+    for _ in range(repeats):
+        for interval in intervals:
+            random.seed(0)
+            model = model_class(board, max_sims=num_sims, max_time=None, early_stop=False)
+            num_snapshots = 0
+            for snapshot in model.search_iter(board, interval):
+                num_snapshots += 1
+            # cost of one snapshot of the final tree, which has the most root children
+            start_time = time.time()
+            for _ in range(100):
+                model.snapshot(num_sims, 0)
+            snapshot_time = (time.time() - start_time) / 100
+            model.close()
+            result = results[interval]
+            if snapshot['simulations'] / snapshot['time'] > result['sims_per_sec']:
+                result.update(sims_per_sec=snapshot['simulations'] / snapshot['time'], snapshots=num_snapshots,
+                              overhead=(num_snapshots - 1) * snapshot_time / snapshot['time'])
+    for interval in intervals:
+        result = results[interval]
+        print(f'search_iter interval {interval}: {result["sims_per_sec"]:.0f} sims/sec, {result["snapshots"]} '
+              f'snapshots, overhead {result["overhead"]:.3%}')
+    return results
+
+
+def benchmark_pondering(model_class=MCTSEarlyPlayoutTermination, num_games=2, game_sims=300):
+    """
+    Games of a pondering player against the same model without pondering (alternating colours, <game_sims>
+    simulations per move): the ponder hit rate, and the visits inherited per move by each player
+    """
+    player = MCTSPlayer(model_class(max_sims=game_sims, max_time=None), ponder=True)
+    baseline = MCTSPlayer(model_class(max_sims=game_sims, max_time=None))
+    wins, losses, ties = 0, 0, 0
+    for i in range(num_games):
+        random.seed(i)
+        _, result, _ = play(player, baseline, player1_plays_first=i % 2 == 0, board=chess.Board())
+        wins, losses, ties = wins + result[0], losses + result[1], ties + result[2]
+        player.reset()
+        baseline.reset()
+    stats, baseline_stats = player.get_stats(), baseline.get_stats()
+    player.close()
+    baseline.close()
+    print(f'pondering: {stats["ponder_hits"]}/{stats["pondered_moves"]} ponder hits ({stats["ponder_hit_rate"]:.1%}), '
+          f'{stats["ponder_simulations"] / max(stats["ponder_searches"], 1):.0f} ponder sims per move, '
+          f'{stats["ponder_visits_per_hit"]:.0f} ponder visits per hit, inherited visits '
+          f'per move {stats["inherited_visits_per_move"]:.0f} vs {baseline_stats["inherited_visits_per_move"]:.0f} '
+          f'without pondering, +{wins} -{losses} ={ties}')
+    return stats, baseline_stats
+
+
+def check_root_parallel_pondering(num_processes=2, ponder_time=1, max_time=0.3):
+    """
+    Check that MCTSRootParallelization counts a ponder hit when the pondering is stopped by the reply, for
+    independent and for sharing trees: after <ponder_time> seconds from the opening, every reply has been searched
+    """
+    for share_interval in (0, 20):
+        model = MCTSRootParallelization(max_sims=100000, max_time=max_time, num_processes=num_processes,
+                                        share_interval=share_interval)
+        player = MCTSPlayer(model, ponder=True)
+        board = chess.Board()
+        board.push(player.get_next_move(board, False))
+        time.sleep(ponder_time)
+        reply = next(iter(board.legal_moves))
+        board.push(reply)
+        player.get_next_move(board, False)  # stops the pondering before the search of the move
+        stats = player.get_stats()
+        player.close()
+        assert stats['ponder_hits'] == 1, f'{stats["ponder_hits"]} ponder hits for the pondered reply {reply}'
+        assert stats['ponder_visits'] > 0, f'the reply {reply} was not searched while pondering'
+        print(f'root parallel pondering, share interval {share_interval}: {stats["ponder_visits_per_hit"]:.0f} '
+              f'ponder visits on the reply OK')
+
+
+def check_transposition_reuse(model_class=MCTSEarlyPlayoutTermination, num_sims=300, num_plies=6, seed=0,
+                              node_store='tree'):
+    """
+    Check that the transposition table only holds nodes below the current root: stale positions are pruned when the
+    root moves down the game, the nodes of an arena are moved to the compacted arena, and a new game after reset()
+    gets no hits from the nodes of the previous game
+    """
+    random.seed(seed)
+    board = chess.Board()
+    model = model_class(board, transposition_table=True, max_sims=num_sims, max_time=None, node_store=node_store)
+    node_id = (lambda node: node.index) if node_store == 'arena' else id
+    for _ in range(num_plies):
+        root_ply = board.ply()
+        board.push(model.run(board))
+        assert all(ply > root_ply for _, ply in model.transpositions.table), 'positions not below the root'
+        if node_store == 'arena':
+            model._set_root(board)  # compacts the arena, as the next search would
+            assert all(node.arena is model.tree.arena for node in model.transpositions.table.values()), \
+                'nodes of an arena that was compacted'
+    model.reset()
+    assert not model.transpositions.table, 'entries of the previous game after reset()'
+    board = chess.Board()
+    model.run(board)
+    reachable = set()
+    stack = [model.tree]
+    while stack:
+        node = stack.pop()
+        if node_id(node) not in reachable:
+            reachable.add(node_id(node))
+            stack.extend(node.children)
+    assert all(node_id(node) in reachable for node in model.transpositions.table.values()), \
+        'nodes of the previous game'
+    assert sum(child.num_visits for child in model.tree.children) <= model.tree.num_visits
+    model.close()
+    print(f'transposition reuse, {node_store} nodes: {num_plies} plies and a new game OK')
+
+
+def check_shared_arena_detach(capacity=16):
+    """
+    Check that a shared arena cannot be compacted: it has no extract(), detaching one of its nodes raises a
+    ValueError, and so does a model asking for node_store='shared'
+    """
+    arena = SharedNodeArena(capacity)
+    try:
+        board = chess.Board()
+        arena.reset(board)
+        root = arena.add_node(board)
+        move = next(iter(board.legal_moves))
+        board.push(move)
+        child = arena.add_node(board, action=move, parent=root)
+        assert not hasattr(arena, 'extract'), 'shared arenas expose extract()'
+        try:
+            child.parent = None
+            raise AssertionError('a node of a shared arena was detached')
+        except ValueError:
+            pass
+    finally:
+        arena.close(unlink=True)
+    try:
+        MCTS(chess.Board(), node_store='shared')
+        raise AssertionError("node_store='shared' was accepted")
+    except ValueError:
+        pass
+    print('shared arena detach: rejected OK')
+
+
+def benchmark_node_store(model_class=MCTSEarlyPlayoutTermination, num_sims=2000, board=None, **kwargs):
+    """
+    Compare the anytree node store against the array-backed node arena.
+    Reports the number of bytes allocated per tree node and the number of simulations per second.
+    """
+    if board is None:
+        board = chess.Board()
+    results = {}
+    for node_store in ('tree', 'arena'):
+        # 1. throughput, without the tracing overhead of tracemalloc
+        model = model_class(board, node_store=node_store, max_sims=num_sims, max_time=None, **kwargs)
+        gc.collect()
+        start_time = time.time()
+        model.run(board)
+        time_taken = time.time() - start_time
+        sims_per_sec = model.get_stats()['total_simulations'] / time_taken
+        del model
+
+        # 2. memory footprint of the tree that was built
+        gc.collect()
+        tracemalloc.start()
+        model = model_class(board, node_store=node_store, max_sims=num_sims, max_time=None, **kwargs)
+        model.run(board)
+        gc.collect()
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        num_nodes = count_nodes(model.tree)
+
+        results[node_store] = {'bytes_per_node': memory / num_nodes, 'sims_per_sec': sims_per_sec,
+                               'num_nodes': num_nodes}
+        print(f'{node_store:>6}: {num_nodes} nodes | {memory / num_nodes:.1f} bytes/node | '
+              f'{sims_per_sec:.2f} sims/sec')
+    return results
+
+
+def benchmark_parallel_scaling(num_workers=(1, 2, 4, 8, 16), max_time=5, board=None, **kwargs):
+    """
+    Compare root parallelization against tree parallelization (threads and processes) for each number of workers.
+    Reports the number of simulations per second of one search.
+    """
+    if board is None:
+        board = chess.Board()
+    configs = {
+        'root': lambda n: MCTSRootParallelization(board, num_processes=n, num_trees=n, max_time=max_time, **kwargs),
+        'tree (threads)': lambda n: MCTSTreeParallelization(board, num_workers=n, workers='thread',
+                                                            max_time=max_time, **kwargs),
+        'tree (processes)': lambda n: MCTSTreeParallelization(board, num_workers=n, workers='process',
+                                                              max_time=max_time, **kwargs),
+    }
+    results = {}
+    for name, make_model in configs.items():
+        for n in num_workers:
+            model = make_model(n)
+            model.run(board)
+            stats = model.get_stats()
+            model.close()
+            sims_per_sec = stats['total_simulations'] / stats['total_time']
+            results[name, n] = sims_per_sec
+            print(f'{name:>16} | {n:>2} workers | {sims_per_sec:.2f} sims/sec')
+    return results
+
+
+def benchmark_leaf_parallelization(model_class=MCTSEarlyPlayoutTermination, leaf_playouts=(1, 2, 4, 8), max_time=5,
+                                   num_games=2, board=None, **kwargs):
+    """
+    Measure leaf parallelization for each number of playouts per leaf (K). Reports the number of playouts and tree
+    descents per second of one search, and the score of <num_games> games against the same model with K = 1.
+    """
+    if board is None:
+        board = chess.Board()
+    results = {}
+    for k in leaf_playouts:
+        model = model_class(board, leaf_playouts=k, max_time=max_time, **kwargs)
+        model.run(board)
+        stats = model.get_stats()
+        sims_per_sec = stats['total_simulations'] / stats['total_time']
+
+        # playing strength against the single playout baseline, alternating colours
+        player = MCTSPlayer(model)
+        baseline = MCTSPlayer(model_class(leaf_playouts=1, max_time=max_time, **kwargs))
+        wins, losses, ties = 0, 0, 0
+        for i in range(num_games):
+            player.reset()
+            baseline.reset()
+            _, result, _ = play(player, baseline, player1_plays_first=i % 2 == 0, board=board.copy())
+            wins, losses, ties = wins + result[0], losses + result[1], ties + result[2]
+        player.close()
+        baseline.close()
+
+        results[k] = {'sims_per_sec': sims_per_sec, 'descents_per_sec': sims_per_sec / k,
+                      'wins': wins, 'losses': losses, 'ties': ties}
+        print(f'K = {k:>2} | {sims_per_sec:.2f} sims/sec | {sims_per_sec / k:.2f} descents/sec | '
+              f'vs K = 1: {wins} wins, {losses} losses, {ties} ties')
+    return results
+
+
+if __name__ == '__main__':
+    check_evaluate_parity()
+    benchmark_evaluate()
+    benchmark_pawn_hash()
+    check_evaluate_batch_parity()
+    benchmark_evaluate_batch()
+    check_incremental_parity()
+    benchmark_incremental_evaluation()
+    check_playout_parity()
+    benchmark_playouts()
+    check_batch_move_generation()
+    check_batch_playout_statistics()
+    benchmark_batch_playouts()
+    check_decisive_moves()
+    benchmark_decisive_moves()
+    benchmark_greedy_policies()
+    benchmark_child_ordering()
+    benchmark_bound_propagation()
+    benchmark_solver()
+    benchmark_time_management()
+    benchmark_search_iter()
+    benchmark_pondering()
+    check_root_parallel_pondering()
+    check_transposition_reuse()
+    check_transposition_reuse(node_store='arena')
+    check_shared_arena_detach()
+    benchmark_node_store(MCTSEarlyPlayoutTermination, num_sims=2000)
+    benchmark_node_store(MCTS, num_sims=200)
+    benchmark_parallel_scaling()
+    benchmark_leaf_parallelization()
@@ -164,6 +164,14 @@ def compare_models(player1, player2, num_games=50, verbose=False, board=None, **
         stats = player1.get_stats()
         results['Model 1']['Simulations'] += stats['total_simulations']
         results['Model 1']['Computing Time'] += stats['total_time']
+        results['Model 1']['Moves'] = stats['searches']
+        results['Model 1']['Early Stops'] = stats['early_stops']
+        results['Model 1']['Inherited Visits'] = stats['inherited_visits_per_move']
+        if player1.ponder:
+            results['Model 1']['Ponder Hits'] = stats['ponder_hits']
+            results['Model 1']['Pondered Moves'] = stats['pondered_moves']
+            results['Model 1']['Ponder Visits'] = stats['ponder_visits_per_hit']
+        player1.close()
     if type(player2) != MCTSPlayer:
         player2.close()
         del results["Model 2"]["Simulations"]
@@ -172,6 +180,14 @@ def compare_models(player1, player2, num_games=50, verbose=False, board=None, **
         stats = player2.get_stats()
         results['Model 2']['Simulations'] += stats['total_simulations']
         results['Model 2']['Computing Time'] += stats['total_time']
+        results['Model 2']['Moves'] = stats['searches']
+        results['Model 2']['Early Stops'] = stats['early_stops']
+        results['Model 2']['Inherited Visits'] = stats['inherited_visits_per_move']
+        if player2.ponder:
+            results['Model 2']['Ponder Hits'] = stats['ponder_hits']
+            results['Model 2']['Pondered Moves'] = stats['pondered_moves']
+            results['Model 2']['Ponder Visits'] = stats['ponder_visits_per_hit']
+        player2.close()
 
     print("----- Statistics -----")
     print(f"Average time per game: {results['Total Time'] / num_games:.2f} s")
@@ -181,11 +197,21 @@ def compare_models(player1, player2, num_games=50, verbose=False, board=None, **
     if type(player1) == MCTSPlayer:
         print(
             f"\t{title1} - Total Simulations: {results['Model 1']['Simulations']} | Total Computing Time: {results['Model 1']['Computing Time']:.2f} | Simulations per sec: {results['Model 1']['Simulations'] / results['Model 1']['Computing Time']:.2f} sims/sec")
+        print(
+            f"\t{title1} - Moves stopped early: {results['Model 1']['Early Stops']} / {results['Model 1']['Moves']} | Inherited visits per move: {results['Model 1']['Inherited Visits']:.0f}")
+        if player1.ponder:
+            print(
+                f"\t{title1} - Ponder hits: {results['Model 1']['Ponder Hits']} / {results['Model 1']['Pondered Moves']} | Ponder hit rate: {results['Model 1']['Ponder Hits'] / max(results['Model 1']['Pondered Moves'], 1):.2%} | Ponder visits per hit: {results['Model 1']['Ponder Visits']:.0f}")
     print(
         f"\t{title2} - Wins: {results['Model 2']['Wins']} | Win Percentage: {results['Model 2']['Wins'] / num_games:.2%}")
     if type(player2) == MCTSPlayer:
         print(
             f"\t{title2} - Total Simulations: {results['Model 2']['Simulations']} | Total Computing Time: {results['Model 2']['Computing Time']:.2f} | Simulations per sec: {results['Model 2']['Simulations'] / results['Model 2']['Computing Time']:.2f} sims/sec")
+        print(
+            f"\t{title2} - Moves stopped early: {results['Model 2']['Early Stops']} / {results['Model 2']['Moves']} | Inherited visits per move: {results['Model 2']['Inherited Visits']:.0f}")
+        if player2.ponder:
+            print(
+                f"\t{title2} - Ponder hits: {results['Model 2']['Ponder Hits']} / {results['Model 2']['Pondered Moves']} | Ponder hit rate: {results['Model 2']['Ponder Hits'] / max(results['Model 2']['Pondered Moves'], 1):.2%} | Ponder visits per hit: {results['Model 2']['Ponder Visits']:.0f}")
     print(f"\tTies: {results['Ties']} | Tie Percentage: {results['Ties'] / num_games:.2%}")
     print()
     print(f"Outcome occurrences:")
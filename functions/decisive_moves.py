@@ -0,0 +1,101 @@
+import chess
+from chess import BB_SQUARES, BB_KNIGHT_ATTACKS, BB_PAWN_ATTACKS, BB_DIAG_ATTACKS, BB_DIAG_MASKS, \
+    BB_FILE_ATTACKS, BB_FILE_MASKS, BB_RANK_ATTACKS, BB_RANK_MASKS
+
+
+def check_masks(board: chess.Board):
+    """
+    Squares from which each piece type of the side to move would attack the enemy king, and the pieces of the side
+    to move that block one of its own sliders from the enemy king (moving them can give a discovered check).
+    Returns (masks indexed by piece type, blockers), or None if there is no enemy king.
+    """
+    king = board.king(not board.turn)
+    if king is None:
+        return None
+    occupied = board.occupied
+    diagonal = BB_DIAG_ATTACKS[king][BB_DIAG_MASKS[king] & occupied]
+    straight = BB_RANK_ATTACKS[king][BB_RANK_MASKS[king] & occupied] | \
+        BB_FILE_ATTACKS[king][BB_FILE_MASKS[king] & occupied]
+    masks = [0, BB_PAWN_ATTACKS[not board.turn][king], BB_KNIGHT_ATTACKS[king], diagonal, straight,
+             diagonal | straight, 0]
+
+    ours = board.occupied_co[board.turn]
+    snipers = ours & ((BB_DIAG_ATTACKS[king][0] & (board.bishops | board.queens)) |
+                      ((BB_RANK_ATTACKS[king][0] | BB_FILE_ATTACKS[king][0]) & (board.rooks | board.queens)))
+    blockers = 0
+    for sniper in chess.scan_reversed(snipers):
+        between = chess.between(king, sniper) & occupied
+        if between & ours and between & (between - 1) == 0:  # exactly one piece in between, and it is ours
+            blockers |= between
+    return masks, blockers
+
+
+def checking_candidates(board: chess.Board, moves=None):
+    """
+    Legal moves of <board> that may give check: direct checks found with the attack masks of the enemy king, moves
+    of discovered check blockers, castling, promotions and en passant. Every checking move is included, and most of
+    the other moves are filtered out without playing them.
+    """
+    check = check_masks(board)
+    if check is None:
+        return []
+    masks, blockers = check
+    targets = masks[chess.PAWN] | masks[chess.KNIGHT] | masks[chess.QUEEN]
+    if moves is None:
+        # castling can give check with the rook, a promotion along the file of the pawn
+        from_mask = blockers | board.kings | (board.pawns & (chess.BB_RANK_2 | chess.BB_RANK_7))
+        if board.ep_square is not None:
+            from_mask |= board.pawns & BB_PAWN_ATTACKS[not board.turn][board.ep_square]
+        # moves to a checking square, then the moves of the other pieces that can still give check
+        moves = list(board.generate_legal_moves(chess.BB_ALL, targets))
+        moves.extend(board.generate_legal_moves(from_mask, chess.BB_ALL & ~targets))
+    king = board.king(board.turn)
+    ep_square = board.ep_square
+    candidates = []
+    for move in moves:
+        from_square, to_square = move.from_square, move.to_square
+        if BB_SQUARES[from_square] & blockers or move.promotion:  # a promoting pawn can check along its own file
+            candidates.append(move)
+        elif BB_SQUARES[to_square] & targets:
+            if BB_SQUARES[to_square] & masks[board.piece_type_at(from_square)]:
+                candidates.append(move)
+        elif from_square == king:
+            if board.is_castling(move):
+                candidates.append(move)
+        elif to_square == ep_square and board.pawns & BB_SQUARES[from_square]:
+            candidates.append(move)
+    return candidates
+
+
+def find_decisive_move(board: chess.Board, moves=None):
+    """
+    A move of <board> that checkmates the opponent (mate in one), or None. <moves> are the legal moves of the
+    board, if they have already been generated.
+    """
+    for move in checking_candidates(board, moves):
+        board.push(move)
+        try:
+            if board.is_checkmate():
+                return move
+        finally:
+            board.pop()
+    return None
+
+
+def allows_decisive_move(board: chess.Board, move):
+    """
+    Whether the opponent has a mate in one after <move>
+    """
+    board.push(move)
+    try:
+        return find_decisive_move(board) is not None
+    finally:
+        board.pop()
+
+
+# testing
+if __name__ == '__main__':
+    board = chess.Board('r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 2 4')
+    print(find_decisive_move(board))  # Qxf7#
+    board = chess.Board('rnbqkbnr/pppp1ppp/8/4p3/6P1/5P2/PPPPP2P/RNBQKBNR b KQkq - 0 2')
+    print(find_decisive_move(board))  # Qh4#
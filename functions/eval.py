@@ -1,4 +1,5 @@
 import chess
+import numpy as np
 
 MAX_SCORE = 5000
 
@@ -102,10 +103,381 @@ def tanh(x):
     return 2 * sigmoid - 1
 
 
+def _piece_square_values(piece_type, pcsq):
+    """
+    Material + piece-square value of a piece on each python-chess square, for both sides
+    """
+    value = piece_values[piece_type]
+    light = [value + pcsq[flip[square]] if pcsq else value for square in chess.SQUARES]
+    dark = [value + pcsq[square] if pcsq else value for square in chess.SQUARES]
+    return light, dark
+
+
+# material + piece-square tables: piece_square_values[color][piece_type][square], color is LIGHT or DARK
+piece_square_values = [[None] * 7, [None] * 7]
+for _piece_type, _pcsq in ((chess.PAWN, pawn_pcsq), (chess.KNIGHT, knight_pcsq), (chess.BISHOP, bishop_pcsq),
+                           (chess.ROOK, None), (chess.QUEEN, None), (chess.KING, None)):
+    piece_square_values[LIGHT][_piece_type], piece_square_values[DARK][_piece_type] = \
+        _piece_square_values(_piece_type, _pcsq)
+
+BB_FILE_MASKS = list(enumerate(chess.BB_FILES, 1))  # (TSCP column, file mask)
+
+PAWN_HASH_SIZE = 1 << 16
+
+
+class PawnHashTable:
+    """
+    Pawn structure terms keyed by the pawn bitboards of both sides: the pawn ranks, the pawn scores and the king
+    shelter of each side. Pawns change rarely during a search, so most evaluations find their pawn terms here.
+    The table is cleared when it reaches <max_size> entries, a size of 0 disables it.
+    """
+    def __init__(self, max_size=PAWN_HASH_SIZE):
+        self.max_size = max_size
+        self.table = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, light_pawns, dark_pawns):
+        """
+        Pawn ranks, pawn scores and king shelters of a pawn structure
+        """
+        key = (light_pawns, dark_pawns)
+        entry = self.table.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        pawn_rank, pawn_score = evaluate_pawns(light_pawns, dark_pawns)
+        entry = (pawn_rank, pawn_score, king_shelter(pawn_rank))
+        if self.max_size:
+            if len(self.table) >= self.max_size:
+                self.table.clear()
+            self.table[key] = entry
+        return entry
+
+    def clear(self):
+        self.table.clear()
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'pawn_hash_hits': self.hits,
+            'pawn_hash_misses': self.misses,
+            'pawn_hash_hit_rate': self.hits / lookups if lookups else 0,
+            'pawn_hash_entries': len(self.table),
+        }
+
+
+pawn_hash = PawnHashTable()  # shared by evaluate() and the incremental evaluator
+
+
 def evaluate(chess_board: chess.Board, is_white: bool):
     """
     Board evaluation function from Tom Kerrigan's Simple Chess Program
     Source: http://www.tckerrigan.com/Chess/TSCP/
+
+    Bitboard implementation: pieces are read from the board's bitboards instead of piece_at(), material and
+    piece-square values come from precomputed tables, and pawn ranks are found with file masks. Pawn terms are
+    looked up in the pawn hash table.
+    Gives the same results as evaluate_reference().
+    """
+    if chess_board.is_checkmate():  # the side to move has been mated
+        return -MAX_SCORE if bool(is_white) == chess_board.turn else MAX_SCORE
+
+    white, black = chess_board.occupied_co[chess.WHITE], chess_board.occupied_co[chess.BLACK]
+    pawns, rooks, kings = chess_board.pawns, chess_board.rooks, chess_board.kings
+    piece_mat, piece_score = evaluate_pieces(chess_board)
+    pawn_rank, pawn_score, shelter = pawn_hash.get(pawns & white, pawns & black)
+    rook_score = evaluate_rooks(rooks & white, rooks & black, pawn_rank)
+    king_score = evaluate_kings(kings & white, kings & black, shelter, piece_mat)
+
+    score_light = piece_score[LIGHT] + pawn_score[LIGHT] + rook_score[LIGHT] + king_score[LIGHT]
+    score_dark = piece_score[DARK] + pawn_score[DARK] + rook_score[DARK] + king_score[DARK]
+    if is_white:
+        return score_light - score_dark
+    return score_dark - score_light
+
+
+def move_delta(chess_board: chess.Board, move):
+    """
+    Cheap score of <move> for the side to move: the change of its material + piece-square score and the material
+    it captures, followed by the MVV-LVA order of the capture (most valuable victim, then least valuable attacker).
+    Pawn structure, rook and king terms are left out.
+    """
+    color, enemy = (LIGHT, DARK) if chess_board.turn == chess.WHITE else (DARK, LIGHT)
+    from_square, to_square = move.from_square, move.to_square
+    piece_type = chess_board.piece_type_at(from_square)
+    values = piece_square_values[color]
+    delta = values[move.promotion or piece_type][to_square] - values[piece_type][from_square]
+    if chess_board.occupied_co[not chess_board.turn] & chess.BB_SQUARES[to_square]:
+        captured, captured_square = chess_board.piece_type_at(to_square), to_square
+    elif piece_type == chess.PAWN and to_square == chess_board.ep_square and (to_square - from_square) & 1:
+        captured, captured_square = chess.PAWN, to_square ^ 8  # the pawn that passed the en passant square
+    else:
+        return delta, 0
+    return delta + piece_square_values[enemy][captured][captured_square], 8 * captured - piece_type
+
+
+def evaluate_pieces(chess_board: chess.Board):
+    """
+    Material of the pieces of each side (pawns excluded), and their material + piece-square score
+    """
+    white, black = chess_board.occupied_co[chess.WHITE], chess_board.occupied_co[chess.BLACK]
+    knights, bishops = chess_board.knights, chess_board.bishops
+    rooks, queens = chess_board.rooks, chess_board.queens
+    piece_mat = [0, 0]
+    piece_score = [0, 0]
+    for color, side in ((LIGHT, white), (DARK, black)):
+        values = piece_square_values[color]
+        heavy = 500 * (rooks & side).bit_count() + 900 * (queens & side).bit_count()
+        piece_mat[color] = 300 * ((knights | bishops) & side).bit_count() + heavy
+        score = heavy
+        for square in chess.scan_reversed(knights & side):
+            score += values[chess.KNIGHT][square]
+        for square in chess.scan_reversed(bishops & side):
+            score += values[chess.BISHOP][square]
+        piece_score[color] = score
+    return piece_mat, piece_score
+
+
+def evaluate_pawns(light_pawns, dark_pawns):
+    """
+    Pawn ranks and the pawn score (material, piece-square and pawn structure) of each side.
+    Both only depend on the pawns.
+    """
+    # rank of the least advanced pawn on each file, with an empty file on each side of the board
+    light_rank = [0] * 10
+    dark_rank = [7] * 10
+    for col, file_mask in BB_FILE_MASKS:
+        bits = light_pawns & file_mask
+        if bits:
+            light_rank[col] = 7 - ((bits & -bits).bit_length() - 1 >> 3)
+        bits = dark_pawns & file_mask
+        if bits:
+            dark_rank[col] = 7 - (bits.bit_length() - 1 >> 3)
+
+    light_values = piece_square_values[LIGHT][chess.PAWN]
+    score_light = 0
+    for square in chess.scan_reversed(light_pawns):
+        col = (square & 7) + 1
+        row = 7 - (square >> 3)
+        score_light += light_values[square]
+        if light_rank[col] > row:  # doubled pawn
+            score_light -= DOUBLED_PAWN_PENALTY
+        if light_rank[col - 1] == 0 and light_rank[col + 1] == 0:  # isolated pawn
+            score_light -= BACKWARDS_PAWN_PENALTY
+        elif light_rank[col - 1] < row and light_rank[col + 1] < row:  # backwards pawn
+            score_light -= BACKWARDS_PAWN_PENALTY
+        if dark_rank[col - 1] >= row and dark_rank[col] >= row and dark_rank[col + 1] >= row:  # passed pawn
+            score_light += (7 - row) * PASSED_PAWN_BONUS
+
+    dark_values = piece_square_values[DARK][chess.PAWN]
+    score_dark = 0
+    for square in chess.scan_reversed(dark_pawns):
+        col = (square & 7) + 1
+        row = 7 - (square >> 3)
+        score_dark += dark_values[square]
+        if dark_rank[col] < row:  # doubled pawn
+            score_dark -= DOUBLED_PAWN_PENALTY
+        if dark_rank[col - 1] == 7 and dark_rank[col + 1] == 7:  # isolated pawn
+            score_dark -= BACKWARDS_PAWN_PENALTY
+        elif dark_rank[col - 1] > row and dark_rank[col + 1] > row:  # backwards pawn
+            score_dark -= BACKWARDS_PAWN_PENALTY
+        if light_rank[col - 1] <= row and light_rank[col] <= row and light_rank[col + 1] <= row:  # passed pawn
+            score_dark += row * PASSED_PAWN_BONUS
+    return [light_rank, dark_rank], [score_light, score_dark]
+
+
+def evaluate_rooks(light_rooks, dark_rooks, pawn_rank):
+    """
+    Open file, semi-open file and seventh rank bonuses of the rooks of each side
+    """
+    light_rank, dark_rank = pawn_rank
+    score_light = ROOK_ON_SEVENTH_BONUS * (light_rooks & chess.BB_RANK_7).bit_count()
+    for square in chess.scan_reversed(light_rooks):
+        col = (square & 7) + 1
+        if light_rank[col] == 0:
+            score_light += ROOK_OPEN_FILE_BONUS if dark_rank[col] == 7 else ROOK_SEMI_OPEN_FILE_BONUS
+    score_dark = ROOK_ON_SEVENTH_BONUS * (dark_rooks & chess.BB_RANK_2).bit_count()
+    for square in chess.scan_reversed(dark_rooks):
+        col = (square & 7) + 1
+        if dark_rank[col] == 7:
+            score_dark += ROOK_OPEN_FILE_BONUS if light_rank[col] == 0 else ROOK_SEMI_OPEN_FILE_BONUS
+    return [score_light, score_dark]
+
+
+def king_shelter(pawn_rank):
+    """
+    Pawn shelter of a king of each side on each file, before it is scaled by the opponent's material.
+    Same terms as eval_light_king()/eval_dark_king() without the piece-square value.
+    """
+    # a king in the centre is penalized for the open files next to it (TSCP columns col to col + 2)
+    open_files = [pawn_rank[LIGHT][i] == 0 and pawn_rank[DARK][i] == 7 for i in range(10)]
+    centre = [-10 * sum(open_files[col:col + 3]) for col in (3, 4)]
+    shelter = []
+    for eval_kp in (eval_lkp, eval_dkp):
+        queenside = eval_kp(1, pawn_rank) + eval_kp(2, pawn_rank) + eval_kp(3, pawn_rank) / 2
+        kingside = eval_kp(8, pawn_rank) + eval_kp(7, pawn_rank) + eval_kp(6, pawn_rank) / 2
+        shelter.append([queenside] * 3 + centre + [kingside] * 3)
+    return shelter
+
+
+def evaluate_kings(light_kings, dark_kings, shelter, piece_mat):
+    """
+    King score of each side: endgame piece-square value, or king safety scaled by the opponent's material
+    """
+    score_light = 0
+    for square in chess.scan_reversed(light_kings):
+        if piece_mat[DARK] <= 1200:
+            score_light += king_endgame_pcsq[flip[square]]
+        else:
+            score_light += (king_pcsq[flip[square]] + shelter[LIGHT][square & 7]) * piece_mat[DARK] // 3100
+    score_dark = 0
+    for square in chess.scan_reversed(dark_kings):
+        if piece_mat[LIGHT] <= 1200:
+            score_dark += king_endgame_pcsq[flip[square]]
+        else:
+            score_dark += (king_pcsq[square] + shelter[DARK][square & 7]) * piece_mat[LIGHT] // 3100
+    return [score_light, score_dark]
+
+
+# ---- batch evaluation ----
+# tables indexed by python-chess square, as float64 so that the king safety terms can hold the halves of TSCP
+_PIECE_TYPES = (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN, chess.KING)
+_PIECE_SQUARE_ARRAY = np.array([[piece_square_values[color][piece_type] for piece_type in _PIECE_TYPES]
+                                for color in (LIGHT, DARK)], dtype=np.float64)  # [color, piece type, square]
+_PIECE_MATERIAL = np.array([0, 300, 300, 500, 900, 0], dtype=np.float64)  # pawns are not counted as pieces
+_ROWS = np.arange(7, -1, -1).reshape(1, 8, 1)  # TSCP row of each python-chess rank
+_LIGHT_KING_ARRAY = np.array([king_pcsq[flip[square]] for square in chess.SQUARES], dtype=np.float64).reshape(8, 8)
+_DARK_KING_ARRAY = np.array(king_pcsq, dtype=np.float64).reshape(8, 8)
+_KING_ENDGAME_ARRAY = np.array([king_endgame_pcsq[flip[square]] for square in chess.SQUARES],
+                               dtype=np.float64).reshape(8, 8)
+
+
+def board_bitboards(boards):
+    """
+    Bits of the pawn, knight, bishop, rook, queen and king bitboards of each color: bool array [N, 2, 6, 8, 8]
+    indexed by board, color (LIGHT, DARK), piece type, rank and file
+    """
+    bitboards = np.array([(board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK], board.pawns,
+                           board.knights, board.bishops, board.rooks, board.queens, board.kings)
+                          for board in boards], dtype=np.uint64).reshape(len(boards), 8)
+    pieces = bitboards[:, 2:]
+    colors = bitboards[:, :2]
+    bitboards = pieces[:, np.newaxis, :] & colors[:, :, np.newaxis]
+    bits = np.unpackbits(bitboards.view(np.uint8), bitorder='little')  # bitboards are little-endian words
+    return bits.reshape(len(boards), 2, 6, 8, 8).astype(bool)
+
+
+def evaluate_batch(boards, is_white):
+    """
+    Evaluate many boards at once with the TSCP evaluation function.
+    <is_white> is a single bool or one bool per board. Returns a float64 array with the same values as
+    evaluate() on each board.
+    """
+    if not len(boards):
+        return np.zeros(0)
+    is_white = np.broadcast_to(np.asarray(is_white, dtype=bool), (len(boards),))
+    pieces = board_bitboards(boards)
+    light, dark = pieces[:, LIGHT], pieces[:, DARK]
+    counts = pieces.sum(axis=(3, 4))  # [N, color, piece type]
+
+    # material and piece-square values of every piece, pawns included
+    piece_score = np.einsum('ncpij,cpij->nc', pieces, _PIECE_SQUARE_ARRAY.reshape(2, 6, 8, 8))
+    piece_mat = counts @ _PIECE_MATERIAL  # [N, color]
+
+    # rank of the least advanced pawn on each file, with an empty file on each side of the board
+    light_pawns, dark_pawns = light[:, 0], dark[:, 0]
+    light_rank = np.zeros((len(boards), 10), dtype=np.int64)
+    dark_rank = np.full((len(boards), 10), 7, dtype=np.int64)
+    light_rank[:, 1:9] = np.where(light_pawns, _ROWS, 0).max(axis=1)
+    dark_rank[:, 1:9] = np.where(dark_pawns, _ROWS, 7).min(axis=1)
+    # neighbouring files of every square, as [N, 1, 8] so that they broadcast against the rows
+    light_left, light_file, light_right = (light_rank[:, np.newaxis, i:i + 8] for i in range(3))
+    dark_left, dark_file, dark_right = (dark_rank[:, np.newaxis, i:i + 8] for i in range(3))
+
+    score = np.where(light_file > _ROWS, -DOUBLED_PAWN_PENALTY, 0)
+    isolated = (light_left == 0) & (light_right == 0)
+    backwards = (light_left < _ROWS) & (light_right < _ROWS)
+    score -= np.where(isolated | backwards, BACKWARDS_PAWN_PENALTY, 0)
+    passed = (dark_left >= _ROWS) & (dark_file >= _ROWS) & (dark_right >= _ROWS)
+    score += np.where(passed, (7 - _ROWS) * PASSED_PAWN_BONUS, 0)
+    light_pawn_score = (score * light_pawns).sum(axis=(1, 2))
+
+    score = np.where(dark_file < _ROWS, -DOUBLED_PAWN_PENALTY, 0)
+    isolated = (dark_left == 7) & (dark_right == 7)
+    backwards = (dark_left > _ROWS) & (dark_right > _ROWS)
+    score -= np.where(isolated | backwards, BACKWARDS_PAWN_PENALTY, 0)
+    passed = (light_left <= _ROWS) & (light_file <= _ROWS) & (light_right <= _ROWS)
+    score += np.where(passed, _ROWS * PASSED_PAWN_BONUS, 0)
+    dark_pawn_score = (score * dark_pawns).sum(axis=(1, 2))
+
+    # rooks: file bonuses per rook on the file, and the seventh rank
+    light_rooks, dark_rooks = light[:, 3], dark[:, 3]
+    light_open, dark_open = light_rank[:, 1:9] == 0, dark_rank[:, 1:9] == 7
+    bonus = np.where(light_open, np.where(dark_open, ROOK_OPEN_FILE_BONUS, ROOK_SEMI_OPEN_FILE_BONUS), 0)
+    light_rook_score = (bonus * light_rooks.sum(axis=1)).sum(axis=1) + \
+        ROOK_ON_SEVENTH_BONUS * light_rooks[:, 6].sum(axis=1)
+    bonus = np.where(dark_open, np.where(light_open, ROOK_OPEN_FILE_BONUS, ROOK_SEMI_OPEN_FILE_BONUS), 0)
+    dark_rook_score = (bonus * dark_rooks.sum(axis=1)).sum(axis=1) + \
+        ROOK_ON_SEVENTH_BONUS * dark_rooks[:, 1].sum(axis=1)
+
+    # kings: pawn shelter of a king on each file, then king safety scaled by the opponent's material
+    light_shelter = _king_shelter(light_rank, dark_rank, 6, 5, 0, (7, 5, 0))
+    dark_shelter = _king_shelter(dark_rank, light_rank, 1, 2, 7, (0, 2, 3))
+    open_files = light_open & dark_open
+    light_king_score = _king_score(light[:, 5], _LIGHT_KING_ARRAY, light_shelter, open_files, piece_mat[:, DARK])
+    dark_king_score = _king_score(dark[:, 5], _DARK_KING_ARRAY, dark_shelter, open_files, piece_mat[:, LIGHT])
+
+    score_light = piece_score[:, LIGHT] + light_pawn_score + light_rook_score + light_king_score
+    score_dark = piece_score[:, DARK] + dark_pawn_score + dark_rook_score + dark_king_score
+    scores = np.where(is_white, score_light - score_dark, score_dark - score_light)
+
+    # the side to move has been mated
+    mated = np.array([board.is_checkmate() for board in boards])
+    if mated.any():
+        turn = np.array([board.turn for board in boards])
+        scores[mated] = np.where(is_white == turn, -MAX_SCORE, MAX_SCORE)[mated]
+    return scores
+
+
+def _king_shelter(own_rank, enemy_rank, unmoved, moved_one, no_pawn, enemy_ranks):
+    """
+    eval_lkp()/eval_dkp() on all files at once: shelter penalty [N, 10] of the pawns on each TSCP column.
+    <enemy_ranks> are the enemy pawn ranks of no enemy pawn, an enemy pawn on the 3rd rank, and no penalty.
+    """
+    shelter = np.where(own_rank == unmoved, 0,
+                       np.where(own_rank == moved_one, -10, np.where(own_rank != no_pawn, -20, -25)))
+    no_enemy, enemy_third, no_penalty = enemy_ranks
+    shelter += np.where(enemy_rank == no_enemy, -15,
+                        np.where(enemy_rank == enemy_third, -10, np.where(enemy_rank != no_penalty, -5, 0)))
+    return shelter
+
+
+def _king_score(kings, king_array, shelter, open_files, enemy_mat):
+    """
+    evaluate_kings() of one side for every board: kings [N, 8, 8], shelter [N, 10], open files [N, 8]
+    """
+    queenside = shelter[:, 1] + shelter[:, 2] + shelter[:, 3] / 2
+    kingside = shelter[:, 8] + shelter[:, 7] + shelter[:, 6] / 2
+    # a king in the centre is penalized for the open files next to it (TSCP column col to col + 2)
+    padded = np.zeros((len(open_files), 10))
+    padded[:, 1:9] = open_files
+    centre = -10 * (padded[:, 0:8] + padded[:, 1:9] + padded[:, 2:10])
+    file_shelter = np.concatenate([np.repeat(queenside[:, np.newaxis], 3, axis=1), centre[:, 3:5],
+                                   np.repeat(kingside[:, np.newaxis], 3, axis=1)], axis=1)  # [N, 8]
+    enemy_mat = enemy_mat[:, np.newaxis, np.newaxis]
+    safety = (king_array + file_shelter[:, np.newaxis, :]) * enemy_mat // 3100
+    score = np.where(enemy_mat <= 1200, _KING_ENDGAME_ARRAY, safety)
+    return (score * kings).sum(axis=(1, 2))
+
+
+def evaluate_reference(chess_board: chess.Board, is_white: bool):
+    """
+    Board evaluation function from Tom Kerrigan's Simple Chess Program
+    Source: http://www.tckerrigan.com/Chess/TSCP/
+
+    Square by square implementation, kept as the reference for evaluate()
     """
     if chess_board.is_checkmate():
         if chess_board.result() == '1-0':  # if white win
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+import threading
+
+import chess
+
+from functions.eval import evaluate
+
+
+class EvalCache:
+    """
+    Bounded cache of evaluate() results with least recently used eviction.
+    Entries are keyed by the position (pieces, side to move, castling rights and en passant square), so a cached
+    value is always the one evaluate() would return. Only the evaluation for white is stored, the evaluation for
+    black is its negation. The table is locked, so one cache can be shared by the threads of a search.
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.table = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']  # locks cannot be pickled, a copy of the cache gets its own
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def evaluate(self, board: chess.Board, is_white: bool):
+        """
+        Drop-in replacement for functions.eval.evaluate()
+        """
+        key = board._transposition_key()
+        with self.lock:
+            score = self.table.get(key)
+            if score is not None:
+                self.hits += 1
+                self.table.move_to_end(key)
+                return score if is_white else -score
+            self.misses += 1
+        score = evaluate(board, True)
+        with self.lock:
+            if key not in self.table and len(self.table) >= self.max_size:
+                self.table.popitem(last=False)
+                self.evictions += 1
+            self.table[key] = score
+        return score if is_white else -score
+
+    def clear(self):
+        self.table.clear()
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'eval_cache_hits': self.hits,
+            'eval_cache_misses': self.misses,
+            'eval_cache_hit_rate': self.hits / lookups if lookups else 0,
+            'eval_cache_evictions': self.evictions,
+            'eval_cache_entries': len(self.table),
+        }
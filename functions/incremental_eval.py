@@ -0,0 +1,130 @@
+import chess
+
+from functions.eval import LIGHT, DARK, MAX_SCORE, piece_values, piece_square_values, pawn_hash, \
+    evaluate_pieces, evaluate_rooks, evaluate_kings
+
+
+class IncrementalEvaluator:
+    """
+    Evaluation of a board that is kept up to date while moves are pushed and popped through the evaluator.
+    Piece material and piece-square scores are updated from the move itself. Pawn terms are only looked up again when a
+    pawn moves or is captured, rook terms when a rook or a pawn changes and king terms when a king, a pawn or the
+    piece material changes.
+    evaluate() gives the same results as functions.eval.evaluate() on the current board.
+    """
+    def __init__(self, board):
+        self.board = board
+        self.piece_mat, self.piece_score = evaluate_pieces(board)
+        self.pawn_rank, self.pawn_score, self.shelter = self._evaluate_pawns()
+        self.rook_score = None  # computed on first use
+        self.king_score = None
+        self.stack = []  # evaluation state before each pushed move
+
+    def _evaluate_pawns(self):
+        board = self.board
+        pawns = board.pawns
+        return pawn_hash.get(pawns & board.occupied_co[chess.WHITE], pawns & board.occupied_co[chess.BLACK])
+
+    def push(self, move):
+        """
+        Play <move> on the board and update the evaluation terms
+        """
+        self.stack.append((self.piece_mat, self.piece_score, self.pawn_rank, self.pawn_score, self.shelter,
+                           self.rook_score, self.king_score))
+        self._make_move(move, self.board.push)
+
+    def play(self, move):
+        """
+        Play <move> with PlayoutBoard.play(), for moves that are never taken back
+        """
+        self._make_move(move, self.board.play)
+
+    def _make_move(self, move, make):
+        board = self.board
+        color = LIGHT if board.turn == chess.WHITE else DARK
+        enemy = DARK if color == LIGHT else LIGHT
+        from_square, to_square = move.from_square, move.to_square
+        piece_type = board.piece_type_at(from_square)
+        pawns_changed = piece_type == chess.PAWN
+        rooks_changed = piece_type == chess.ROOK
+        material_changed = False
+
+        if piece_type == chess.KING and board.is_castling(move):
+            captured = None  # the king can be moved onto its own rook, which is not a capture
+            rooks_changed = True
+        elif pawns_changed and board.is_en_passant(move):
+            captured = chess.PAWN
+        else:
+            captured = board.piece_type_at(to_square)
+
+        piece_score = self.piece_score
+        if piece_type != chess.PAWN or move.promotion or (captured and captured != chess.PAWN):
+            piece_score = list(piece_score)
+            if piece_type != chess.PAWN:
+                values = piece_square_values[color][piece_type]
+                piece_score[color] += values[to_square] - values[from_square]
+            if move.promotion:
+                piece_score[color] += piece_square_values[color][move.promotion][to_square]
+                rooks_changed = rooks_changed or move.promotion == chess.ROOK
+                material_changed = True
+            if captured and captured != chess.PAWN:
+                piece_score[enemy] -= piece_square_values[enemy][captured][to_square]
+                rooks_changed = rooks_changed or captured == chess.ROOK
+                material_changed = True
+            if material_changed:
+                piece_mat = list(self.piece_mat)
+                if move.promotion:
+                    piece_mat[color] += piece_values[move.promotion]
+                if captured and captured != chess.PAWN:
+                    piece_mat[enemy] -= piece_values[captured]
+                self.piece_mat = piece_mat
+            self.piece_score = piece_score
+        pawns_changed = pawns_changed or captured == chess.PAWN
+
+        make(move)
+        if pawns_changed:
+            self.pawn_rank, self.pawn_score, self.shelter = self._evaluate_pawns()
+        if pawns_changed or rooks_changed:
+            self.rook_score = None
+        if pawns_changed or material_changed or piece_type == chess.KING:
+            self.king_score = None
+
+    def pop(self):
+        """
+        Take back the last move pushed through the evaluator
+        """
+        move = self.board.pop()
+        self.piece_mat, self.piece_score, self.pawn_rank, self.pawn_score, self.shelter, self.rook_score, \
+            self.king_score = self.stack.pop()
+        return move
+
+    def evaluate(self, is_white):
+        """
+        Evaluate the current board from the point of view of white if <is_white>, otherwise black
+        """
+        board = self.board
+        if board.is_checkmate():  # the side to move has been mated
+            return -MAX_SCORE if bool(is_white) == board.turn else MAX_SCORE
+        white, black = board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]
+        if self.rook_score is None:
+            self.rook_score = evaluate_rooks(board.rooks & white, board.rooks & black, self.pawn_rank)
+        if self.king_score is None:
+            self.king_score = evaluate_kings(board.kings & white, board.kings & black, self.shelter,
+                                             self.piece_mat)
+        piece_score, pawn_score, rook_score, king_score = self.piece_score, self.pawn_score, self.rook_score, \
+            self.king_score
+        score_light = piece_score[LIGHT] + pawn_score[LIGHT] + rook_score[LIGHT] + king_score[LIGHT]
+        score_dark = piece_score[DARK] + pawn_score[DARK] + rook_score[DARK] + king_score[DARK]
+        if is_white:
+            return score_light - score_dark
+        return score_dark - score_light
+
+    def evaluate_move(self, move, is_white):
+        """
+        Evaluate the board after <move>, without changing the current position
+        """
+        self.push(move)
+        try:
+            return self.evaluate(is_white)
+        finally:
+            self.pop()
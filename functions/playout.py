@@ -0,0 +1,50 @@
+import chess
+
+from node.node import get_outcome
+
+# a position can occur again 4 plies later at the earliest, so a fivefold repetition needs 16 reversible plies
+MIN_FIVEFOLD_PLIES = 16
+
+
+class PlayoutBoard(chess.Board):
+    """
+    Board for random playouts. Every ply generates the legal moves once: the same list gives the game result
+    (see get_outcome()) and the move to play. Moves made with play() cannot be taken back, so the move stack only
+    keeps the moves played since the last capture or pawn move, which is all the history the fivefold repetition
+    and seventy-five move rules look at. push() and pop() still work for looking ahead between two plays.
+    """
+    @classmethod
+    def from_board(cls, board: chess.Board):
+        """
+        Copy the position of <board> and the part of its move history that can still be repeated
+        """
+        playout = cls(None, chess960=board.chess960)
+        chess._BoardState(board).restore(playout)
+        history = min(board.halfmove_clock, len(board.move_stack))
+        if history:
+            playout.move_stack = board.move_stack[-history:]
+            playout._stack = board._stack[-history:]
+        return playout
+
+    def play(self, move):
+        """
+        Play <move> for the rest of the playout
+        """
+        self.push(move)
+        if self.halfmove_clock == 0:  # no position before a capture or a pawn move can occur again
+            self.move_stack.clear()
+            self._stack.clear()
+
+    def legal_move_list(self):
+        return list(self.generate_legal_moves())
+
+    def outcome_of(self, moves):
+        """
+        Game result of the position from its list of legal moves, or None if the game is not over
+        """
+        return get_outcome(self, moves)
+
+    def is_fivefold_repetition(self):
+        if self.halfmove_clock < MIN_FIVEFOLD_PLIES:
+            return False  # skips replaying the move stack on almost every ply
+        return super().is_fivefold_repetition()
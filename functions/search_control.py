@@ -0,0 +1,151 @@
+import math
+import time
+
+# a game clock is spent as if this many moves were left, when the number of moves to go is not known
+DEFAULT_MOVES_TO_GO = 30
+CLOCK_RESERVE = 0.05  # fraction of the remaining clock that is never allocated to a single move
+
+
+class SearchController:
+    """
+    Time management and early stopping for the search of one move.
+
+    Time: without a clock, every move gets <max_time> seconds. With a game clock of <clock> seconds, <increment>
+    seconds added after every move and <moves_to_go> moves until the next time control (None for the whole game),
+    the remaining time is spread over the moves to go, and the increment is spent on the move it is given for.
+
+    Early stopping (<early_stop>, off by default): the search stops once the root has a single move, or the most
+    visited root child cannot be overtaken by the second one in the remaining playouts, since more playouts cannot
+    change the robust child. With <min_kld_gain>, it also stops once the visit distribution of the root children has converged: the
+    KL divergence between two distributions <kld_interval> playouts apart, per playout, is below <min_kld_gain>.
+    """
+    def __init__(self, max_time=5, clock=None, increment=0, moves_to_go=None, early_stop=False, min_kld_gain=None,
+                 kld_interval=100, check_interval=10):
+        self.max_time = max_time
+        self.clock = clock
+        self.increment = increment
+        self.moves_to_go = moves_to_go
+        self.early_stop = early_stop
+        self.min_kld_gain = min_kld_gain
+        self.kld_interval = kld_interval
+        self.check_interval = check_interval
+        self.new_game()
+        self.start()
+
+    def new_game(self):
+        self.remaining = self.clock
+        self.moves_played = 0
+
+    def allocate(self):
+        """
+        Seconds of the game clock to spend on the next move
+        """
+        moves_to_go = DEFAULT_MOVES_TO_GO
+        if self.moves_to_go:
+            moves_to_go = self.moves_to_go - self.moves_played % self.moves_to_go
+        budget = self.remaining / moves_to_go + self.increment
+        return max(0.0, min(budget, self.remaining * (1 - CLOCK_RESERVE)))
+
+    def start(self, max_playouts=math.inf, deadline=None):
+        """
+        Start the search of a move with a budget of <max_playouts> playouts. Returns its deadline, which is
+        <deadline> if it is given by the caller (the clock is then left to the caller), or None if there is no
+        time limit.
+        """
+        self.start_time = time.time()
+        self.max_playouts = max_playouts
+        self.timed = deadline is None and self.clock is not None
+        if deadline is None:
+            if self.clock is not None:
+                deadline = self.start_time + self.allocate()
+            elif self.max_time is not None:
+                deadline = self.start_time + self.max_time
+        self.deadline = deadline
+        self.next_check = 0
+        self.kld_visits = None
+        self.kld_playouts = 0
+        self.stop_reason = None
+        return deadline
+
+    def finish(self):
+        """
+        End the search of a move, and charge the time it took to the clock
+        """
+        time_taken = time.time() - self.start_time
+        if self.timed:
+            self.moves_played += 1
+            self.remaining = max(0.0, self.remaining - time_taken) + self.increment
+            if self.moves_to_go and self.moves_played % self.moves_to_go == 0:
+                self.remaining += self.clock  # a new time control period
+        return time_taken
+
+    def remaining_playouts(self, num_playouts):
+        """
+        Playouts the search has left after <num_playouts>: the rest of its budget, or fewer if the time left only
+        allows fewer at the rate of the search so far
+        """
+        remaining = self.max_playouts - num_playouts
+        if self.deadline is not None:
+            now = time.time()
+            rate = num_playouts / max(now - self.start_time, 1e-9)
+            remaining = min(remaining, rate * max(self.deadline - now, 0))
+        return remaining
+
+    def should_stop(self, root, num_playouts):
+        """
+        Check whether the search of <root> can stop after <num_playouts> playouts. The root children are only
+        looked at every <check_interval> playouts.
+        """
+        if not self.early_stop or num_playouts < self.next_check:
+            return False
+        self.next_check = num_playouts + self.check_interval
+        visits = [child.num_visits for child in root.children]
+        if not visits:
+            return False
+        if len(visits) == 1 and not root.untried_actions:
+            self.stop_reason = 'single move'
+            return True
+        remaining = self.remaining_playouts(num_playouts)
+        second, best = sorted(visits)[-2:] if len(visits) > 1 else (0, visits[0])
+        if best - second > remaining:
+            self.stop_reason = 'unassailable'
+            return True
+        if self.min_kld_gain is not None and num_playouts >= self.kld_playouts + self.kld_interval:
+            converged = self.kld_visits is not None and len(self.kld_visits) == len(visits) and \
+                kl_divergence(visits, self.kld_visits) / (num_playouts - self.kld_playouts) < self.min_kld_gain
+            self.kld_visits = visits
+            self.kld_playouts = num_playouts
+            if converged:
+                self.stop_reason = 'converged'
+                return True
+        return False
+
+
+def kl_divergence(visits, old_visits):
+    """
+    KL divergence of the visit distribution <visits> from the earlier distribution <old_visits>
+    """
+    total, old_total = sum(visits), sum(old_visits)
+    divergence = 0
+    for n, old_n in zip(visits, old_visits):
+        if n:
+            if not old_n:
+                return math.inf
+            divergence += n / total * math.log(n / total * old_total / old_n)
+    return divergence
+
+
+def make_snapshot(best_move, moves, visits, scores, simulations, time_taken, final=False):
+    """
+    Snapshot of a search, as yielded by search_iter: the current best move, the visits and mean values of the root
+    moves, the playouts performed and the time elapsed so far. <final> is True for the last snapshot of the search.
+    """
+    return {
+        'best_move': best_move,
+        'moves': moves,
+        'visits': visits,
+        'values': [float(score) / n if n else 0.0 for score, n in zip(scores, visits)],
+        'simulations': simulations,
+        'time': time_taken,
+        'final': final,
+    }
@@ -1,14 +1,44 @@
 import math
+import os
 import chess
 import time
 import random
 import numpy as np
-from node.node import MCTSNode
+from multiprocessing import Pool
+from functions.batch_playout import batch_playouts
+from functions.eval import evaluate
+from functions.eval_cache import EvalCache
+from functions.playout import PlayoutBoard
+from functions.search_control import SearchController, make_snapshot
+from node.arena import ArenaNode, NodeArena
+from node.node import MCTSNode, LegalMoveCache
+from node.transposition import TranspositionTable
 
 '''
 Base MCTS Class
 '''
 
+_leaf_model = None  # model used by the playouts of a leaf worker process
+
+
+def init_leaf_worker(model_class, model_kwargs):
+    global _leaf_model
+    random.seed((os.getpid() * int(time.time())) % 123456789)  # forked workers would share the random state
+    _leaf_model = model_class(**dict(model_kwargs, leaf_playouts=1, make_unmake=True))
+
+
+def leaf_playouts(board, num_playouts):
+    """
+    Run <num_playouts> playouts from <board> in a leaf worker process and return the sum of the results
+    """
+    model = _leaf_model
+    node = MCTSNode('leaf', board, store_state=False)
+    total = 0
+    for _ in range(num_playouts):
+        model.board = board.copy()
+        total += model.simulation(node)
+    return total
+
 
 class MCTS:
     def __init__(self, chess_board=chess.Board(), **kwargs):
@@ -16,16 +46,180 @@ class MCTS:
         self.max_moves = kwargs.get('max_moves', 1000)
         self.max_sims = kwargs.get('max_sims', 10000)
         self.C = kwargs.get('C', 1)
+        self.node_store = kwargs.get('node_store', 'tree')  # 'tree' (MCTSNode objects) or 'arena' (NodeArena)
+        if self.node_store == 'shared':
+            # a SharedNodeArena cannot be compacted when the root moves, so it is only used by the worker processes of
+            # MCTSTreeParallelization, which rebuild the tree for every search
+            raise ValueError("node_store='shared' does not support tree reuse, use "
+                             "MCTSTreeParallelization(workers='process') to search a tree in shared memory")
+        if self.node_store not in ('tree', 'arena'):
+            raise ValueError(f'Unknown node store: {self.node_store}')
+        # make/unmake mode: one board is carried down the tree with push() and unwound with pop(),
+        # so nodes do not store FEN strings and no FEN is parsed during the search.
+        self.make_unmake = kwargs.get('make_unmake', True)
         self.node_counter = 0
-        self.stats = {'total_time': 0, 'total_simulations': 0}
-        self.tree = MCTSNode(
+        self.stats = {'total_time': 0, 'total_simulations': 0, 'searches': 0, 'reuse_hits': 0, 'inherited_visits': 0,
+                      'early_stops': 0, 'ponder_searches': 0, 'ponder_time': 0, 'ponder_simulations': 0}
+        # time management: <max_time> seconds per move, or a game clock of <clock> seconds (see SearchController).
+        # Early stopping is opt-in (<early_stop>), so a search spends its whole budget unless asked otherwise.
+        self.controller = SearchController(self.max_time, kwargs.get('clock'), kwargs.get('increment', 0),
+                                           kwargs.get('moves_to_go'), kwargs.get('early_stop', False),
+                                           kwargs.get('min_kld_gain'))
+        # visits added below each root move by the last ponder search, and the root visits it started from
+        self.ponder_visits = {}
+        self.ponder_start_visits = {}
+        self.move_cache = LegalMoveCache(kwargs.get('move_cache_size', 100000))
+        # transposition table: nodes are shared between move orders, so the tree becomes a DAG
+        self.transpositions = None
+        if kwargs.get('transposition_table', False):
+            self.transpositions = TranspositionTable(kwargs.get('tt_size', 100000),
+                                                     kwargs.get('tt_replacement', 'fifo'))
+        self.tt_key = None  # key of the position being expanded, stored by new_node()
+        # evaluation cache: True for a cache of <eval_cache_size> positions, or an EvalCache shared with other models
+        self.eval_cache = kwargs.get('eval_cache', False)
+        if self.eval_cache is True:
+            self.eval_cache = EvalCache(kwargs.get('eval_cache_size', 100000))
+        self.search_path = []  # nodes selected by the last tree policy call, from the root to the leaf
+        # leaf parallelization: <leaf_playouts> playouts per selected leaf, backpropagated once.
+        # The playouts run in a pool of <leaf_processes> processes, or in this process if it is 0.
+        self.leaf_playouts = kwargs.get('leaf_playouts', 1)
+        self.leaf_processes = kwargs.get('leaf_processes', os.cpu_count())
+        self.leaf_pool = None
+        # lock-step playouts: the playouts of a leaf are run together as one batch of NumPy games
+        self.lockstep_playouts = kwargs.get('lockstep_playouts', False)
+        self.kwargs = kwargs  # used to build the model copy inside each worker process
+        self._set_board(chess_board)
+        self.tree = self.new_node(chess_board, score=0)
+
+    def new_node(self, board, score=0, heuristic_score=0, action=None, parent=None):
+        """
+        Create a node in the configured node store. Nodes without a parent start a new tree.
+        """
+        if self.transpositions is not None and parent is not None:
+            node = self._create_node(board, score, heuristic_score, action, parent)
+            self.transpositions.store(self.tt_key, node)
+            return node
+        return self._create_node(board, score, heuristic_score, action, parent)
+
+    def _create_node(self, board, score, heuristic_score, action, parent):
+        if self.node_store == 'arena':
+            arena = parent.arena if parent is not None else NodeArena(board)
+            return arena.add_node(board, score=score, heuristic_score=heuristic_score, action=action, parent=parent)
+        return MCTSNode(
             f'S{self.node_counter}',
-            board=chess_board,
-            score=0,
+            board=board,
+            score=score,
+            heuristic_score=heuristic_score,
+            action=action,
+            parent=parent,
+            store_state=not self.make_unmake,
         )
 
-    def get_random_move(self, curr_board):
-        return random.choice([move for move in curr_board.legal_moves])
+    def transposition(self, node, move, board):
+        """
+        Look up the position reached by playing <move> at <node> in the transposition table.
+        If it is found, the existing node is linked as a child of <node> so its statistics are reused, otherwise
+        the key is kept so the node created by new_node() can be stored.
+        """
+        if self.transpositions is None:
+            return None
+        self.tt_key = self.transpositions.get_key(board)
+        child_node = self.transpositions.lookup(self.tt_key)
+        if child_node is None or (self.node_store == 'arena' and child_node.arena is not node.arena):
+            return None  # not found, or left behind when the arena was compacted
+        self.transpositions.hits += 1
+        node.link_child(child_node, move)
+        return child_node
+
+    def _get_path(self, node):
+        """
+        Get the nodes from <node> up to the root. Nodes can have several parents when a transposition table is
+        used, so the path recorded by the tree policy is followed instead of the parent links.
+        """
+        if self.search_path and self.search_path[-1] == node:
+            return self.search_path[::-1]
+        path = []
+        while node:
+            path.append(node)
+            node = node.parent
+        return path
+
+    def _init_node(self, node, board=None):
+        """
+        Initialize a node on first use - legal moves, terminal flag and outcome are not computed at creation
+        """
+        if not node.initialized:
+            node.initialize(board if board is not None else self._node_board(node), self.move_cache)
+
+    def _set_board(self, board):
+        """
+        Set the search board to the root position. The move history is kept for repetition detection.
+        """
+        self.board = board.copy()
+        self.root_board = self.board  # back at the root between searches, also for the worker threads of a model
+        self.root_ply = len(self.board.move_stack)
+
+    def _node_board(self, node):
+        """
+        Get the board of a node reached by the tree policy
+        """
+        if self.make_unmake:
+            return self.board  # the search board has already been moved to the node by the tree policy
+        return chess.Board(node.state)
+
+    def _child_board(self, node, move):
+        """
+        Get the board resulting from playing <move> at <node>
+        """
+        board = self._node_board(node)
+        board.push(move)
+        return board
+
+    def _playout_board(self, node):
+        """
+        Get a playout board for the position of a node reached by the tree policy. Playouts never move the search
+        board, so only the tree path has to be unwound.
+        """
+        return PlayoutBoard.from_board(self._node_board(node))
+
+    def _unwind(self, ply=None):
+        """
+        Pop every move made on the search board since the root (tree path and playout), or since <ply>
+        """
+        if self.make_unmake:
+            board = self.board
+            for _ in range(len(board.move_stack) - (self.root_ply if ply is None else ply)):
+                board.pop()
+
+    def _find_node(self, board):
+        """
+        Find the node of the given board in the current tree by following the moves that were played since the
+        last search (usually our move, then the opponent's reply). Returns None if the position is not in the tree.
+        """
+        if not self.make_unmake:  # no move history is kept, so search the children and grandchildren by FEN
+            state = board.fen()
+            for child in self.tree.children:
+                if child.state == state:
+                    return child
+                for grandchild in child.children:
+                    if grandchild.state == state:
+                        return grandchild
+            return None
+        stack = board.move_stack
+        if len(stack) < self.root_ply or stack[:self.root_ply] != self.root_board.move_stack \
+                or board.root() != self.root_board.root():
+            return None  # not a continuation of the game that was searched
+        node = self.tree
+        for move in stack[self.root_ply:]:
+            node = next((n for n in node.children if node.get_action(n) == move), None)
+            if node is None:
+                return None
+        return node
+
+    def get_random_move(self, curr_board, moves=None):
+        if moves is None:
+            moves = [move for move in curr_board.legal_moves]
+        return random.choice(moves)
 
     def get_uct(self, curr_node, log):
         """
@@ -58,16 +252,13 @@ class MCTS:
         if node.untried_actions:
             move = node.untried_actions.pop()
             # make the move
-            new_board = chess.Board(node.state)
-            new_board.push(move)
+            new_board = self._child_board(node, move)
+            child_node = self.transposition(node, move, new_board)
+            if child_node is not None:
+                return child_node
 
             self.node_counter += 1
-            child_node = MCTSNode(
-                name=f'S{self.node_counter}',
-                board=new_board,
-                parent=node,
-                action=move,
-            )
+            child_node = self.new_node(new_board, parent=node, action=move)
             return child_node
         return node
 
@@ -76,16 +267,19 @@ class MCTS:
         Simulation phase - do random moves until the end of the game, and return the final outcome
         """
         # default policy: simulate the game using randomly selected moves.
-        curr_board = chess.Board(curr_node.state)
-        while not curr_board.is_game_over():
-            random_move = random.choice([move for move in curr_board.legal_moves])
-            curr_board.push(random_move)
-        if curr_board.result() == '1-0':  # if white win
+        curr_board = self._playout_board(curr_node)
+        while True:
+            moves = curr_board.legal_move_list()
+            result = curr_board.outcome_of(moves)
+            if result is not None:
+                break
+            curr_board.play(random.choice(moves))
+        if result == '1-0':  # if white win
             if curr_node.is_white:  # self.white_player:
                 return 1
             else:
                 return -1
-        elif curr_board.result() == '0-1':  # if white lose
+        elif result == '0-1':  # if white lose
             if curr_node.is_white:  # self.white_player:
                 return -1
             else:
@@ -93,89 +287,270 @@ class MCTS:
         else:  # if tie
             return 0
 
-    def backpropagation(self, node, result):
+    def simulate_leaf(self, node):
+        """
+        Simulation phase with leaf parallelization - run <leaf_playouts> playouts from the same leaf.
+        Returns the mean result and the number of playouts.
+        """
+        num_playouts = self.leaf_playouts
+        if num_playouts == 1:
+            return self.simulation(node), 1
+        if self.lockstep_playouts:
+            return self.simulate_batch(node, num_playouts), num_playouts
+        board = self._node_board(node)
+        if self.leaf_processes:
+            num_tasks = min(self.leaf_processes, num_playouts)
+            counts = [num_playouts // num_tasks + (i < num_playouts % num_tasks) for i in range(num_tasks)]
+            total = sum(self._get_leaf_pool().starmap(leaf_playouts, [(board, count) for count in counts]))
+        else:
+            ply = len(board.move_stack)
+            total = 0
+            for _ in range(num_playouts):
+                total += self.simulation(node)
+                self._unwind(ply)
+        return total / num_playouts, num_playouts
+
+    def simulate_batch(self, node, num_playouts):
+        """
+        Run <num_playouts> random playouts from the leaf in lock-step, and return their mean result
+        """
+        results, _, _ = batch_playouts([self._node_board(node)] * num_playouts)
+        return float(results.mean()) if node.is_white else -float(results.mean())
+
+    def _get_leaf_pool(self):
+        if self.leaf_pool is None:  # started on first use, and kept for the following searches
+            self.leaf_pool = Pool(self.leaf_processes, initializer=init_leaf_worker, initargs=(type(self), self.kwargs))
+        return self.leaf_pool
+
+    def backpropagation(self, node, result, visits=1):
         """
-        Backpropagation phase - backpropagate the result score and visits
+        Backpropagation phase - backpropagate the result score and visits.
+        <result> is the mean result of <visits> playouts.
         """
+        self._unwind()
         # update the tree by backpropagation of results
-        while node:
-            node.num_visits += 1
+        for node in self._get_path(node):
+            node.num_visits += visits
             # node.mean += result / node.num_visits
-            node.score += result
+            node.score += result * visits
             result = -result  # reward for one side = -reward for other side
-            node = node.parent
 
-    def _set_root(self, board):
+    def _set_root(self, board, ponder=False):
         """
         Set the root of the tree to the existing node, or create a new node if it does not exist (tree collapse)
-        This allows for tree reuse.
+        This allows for tree reuse. A <ponder> search is not counted as a search of a move.
         """
-        state = board.fen()
-        self.tree = next((n for n in self.tree.children if n.state == state), None)
+        self.stats['ponder_searches' if ponder else 'searches'] += 1
+        self.tree = self._find_node(board)
         if self.tree is None:  # if node cannot be found for a board state, then create a new node.
-            self.tree = MCTSNode(
-                f'S{self.node_counter}',
-                board=board,
-                score=0,
-            )
-        self.tree.parent = None  # deallocate the rest of the tree to save memory
+            if self.transpositions is not None:
+                self.transpositions.clear()  # no stored node can be reached from the new tree
+            self.tree = self._new_root(board)
+        else:
+            if self.transpositions is not None:
+                # positions at the ply of the root or before are not below it, and would keep the old tree alive
+                self.transpositions.prune(board.ply() + 1)
+            if self.tree.num_visits and not ponder:  # the simulations of the reused subtree do not have to be repeated
+                self.stats['reuse_hits'] += 1
+                self.stats['inherited_visits'] += self.tree.num_visits
+        self._detach_root()  # deallocate the rest of the tree to save memory
+        self._set_board(board)
+        if ponder:
+            self.ponder_start_visits = self.root_visits()
+
+    def _detach_root(self):
+        """
+        Detach the root from its parent. An arena is compacted into a new one, so the transposition table is moved
+        to the copies of its nodes, and the nodes that were not copied are dropped with the old arena.
+        """
+        root = self.tree
+        if self.node_store != 'arena' or root.parent is None:
+            root.parent = None
+            return
+        arena = root.arena
+        new_arena, remap = arena.extract(root.index)
+        self.tree = ArenaNode(new_arena, remap[root.index])
+        if self.transpositions is not None:
+            self.transpositions.relocate(lambda node: ArenaNode(new_arena, remap[node.index])
+                                         if node.arena is arena and node.index in remap else None)
+
+    def _new_root(self, board):
+        return self.new_node(board, score=0)
 
     def reset(self):
         board = chess.Board()
         self.node_counter = 0
-        self.tree = MCTSNode(
-            f'S{self.node_counter}',
-            board=board,
-            score=0,
-        )
+        self._set_board(board)
+        self.tree = self.new_node(board, score=0)
+        self._new_game()
+
+    def _new_game(self):
+        """
+        Forget the clock and the positions of the previous game
+        """
+        self.controller.new_game()
+        if self.transpositions is not None:
+            self.transpositions.clear()
 
     def tree_policy(self):
         """
         Tree policy implementation
         """
         current_node = self.tree
+        self.search_path = [current_node]
+        self._init_node(current_node)
         while not current_node.is_game_over:
             if current_node.untried_actions:
-                return self.expansion(current_node)
+                child_node = self.expansion(current_node)
+                self.search_path.append(child_node)
+                return child_node
             else:
-                current_node = self.selection(current_node)
+                selected_node = self.selection(current_node)
+                if selected_node == current_node:  # every child has been pruned
+                    break
+                if self.make_unmake:
+                    self.board.push(current_node.get_action(selected_node))
+                current_node = selected_node
+                self.search_path.append(current_node)
+                self._init_node(current_node)
         return current_node
 
-    def run(self, board, print_stats=False):
+    def search_iter(self, board, interval=0.1, ponder=False):
         """
-        Main search function
-        """
-        self._set_root(board)
-        start_time = time.time()
-        # computational budget = max number of steps and max allowed time
-        for i in range(self.max_sims):
-            # 1. tree policy
-            node = self.tree_policy()
-            # 3. simulation
-            score = -self.simulation(node)
-            # 4. backpropagation
-            self.backpropagation(node, score)
-            # check time limit
-            if self.max_time is not None and (time.time() - start_time) > self.max_time:
-                break
-        time_taken = time.time() - start_time
-        # get the best action using the 'robust child' method
-        if self.tree.is_game_over:
-            return None
-        best_child = np.argmax([child.num_visits for child in self.tree.children])
-        best_move = self.tree.children[best_child].action
+        Anytime search: a generator that yields a snapshot of the search (see make_snapshot) every <interval> seconds,
+        and a final snapshot once the budget is spent or the search stops early. With <interval> None, only the final
+        snapshot is yielded. The caller can stop the search at any time by closing the generator, or breaking out of
+        the loop, and the simulations performed so far are still counted.
+        A <ponder> search runs on the time of the opponent, until the caller stops it or <max_sims> are spent: it has
+        no time limit, only stops early on a single move (with <early_stop>), and is counted in the ponder statistics.
+        """
+        self._set_root(board, ponder)
+        controller = self.controller
+        if ponder:
+            deadline = controller.start(math.inf, math.inf)
+        else:
+            deadline = controller.start(self.max_sims * self.leaf_playouts)
+        next_snapshot = controller.start_time + interval if interval is not None else math.inf
+        num_playouts = 0
+        try:
+            # computational budget = max number of steps and max allowed time
+            for i in range(self.max_sims):
+                if self.solved():  # the value of the root is proven, more simulations cannot change the best move
+                    break
+                # 1. tree policy
+                node = self.tree_policy()
+                # 3. simulation
+                score, visits = self.simulate_leaf(node)
+                num_playouts += visits
+                # 4. backpropagation
+                self.backpropagation(node, -score, visits)
+                # check time limit
+                now = time.time()
+                if deadline is not None and now > deadline:
+                    break
+                if controller.should_stop(self.tree, num_playouts):
+                    if not ponder:
+                        self.stats['early_stops'] += 1
+                    break
+                if now >= next_snapshot:
+                    yield self.snapshot(num_playouts, now - controller.start_time)
+                    next_snapshot = time.time() + interval
+        finally:
+            time_taken = self.finish_search(num_playouts, ponder)
+        yield self.snapshot(num_playouts, time_taken, final=True)
 
-        self.stats['total_time'] += time_taken
-        self.stats['total_simulations'] += i + 1
+    def run(self, board, print_stats=False):
+        """
+        Main search function: search to the end, and return the best move
+        """
+        for snapshot in self.search_iter(board, interval=None):
+            pass
+        best_move = snapshot['best_move']
         if print_stats:  # for statistics
-            print(f'Time elapsed: {time_taken}, Simulations completed: {i + 1}')
-            print('Child node visits:', [child.num_visits for child in self.tree.children])
-            print('Child node scores:', [child.score for child in self.tree.children])
-            print(f'Best move: {best_move}, Num visits: {self.tree.children[best_child].num_visits}')
+            num_visits = snapshot['visits'][snapshot['moves'].index(best_move)] if best_move in snapshot['moves'] else 0
+            print(f'Time elapsed: {snapshot["time"]}, Simulations completed: {snapshot["simulations"]}')
+            print('Child node visits:', snapshot['visits'])
+            print('Child node values:', snapshot['values'])
+            print(f'Best move: {best_move}, Num visits: {num_visits}')
         return best_move
 
+    def snapshot(self, num_playouts, time_taken, final=False):
+        """
+        Snapshot of the search of the root. The best move is the 'robust child', None if the root is game over.
+        """
+        root = self.tree
+        children = root.children
+        best_move = None
+        if children and not root.is_game_over:
+            best_move = root.get_action(self.best_child(root))
+        return make_snapshot(best_move, [root.get_action(child) for child in children],
+                             [child.num_visits for child in children], [child.score for child in children],
+                             num_playouts, time_taken, final)
+
+    def finish_search(self, num_playouts, ponder=False, ponder_visits=None):
+        """
+        End the search of a move: charge its time to the clock and count its simulations. Returns the time taken.
+        A <ponder> search records the visits it added below each root move in <ponder_visits>, which are read from
+        the root unless they are given.
+        """
+        time_taken = self.controller.finish()
+        if ponder:
+            self.stats['ponder_time'] += time_taken
+            self.stats['ponder_simulations'] += num_playouts
+            if ponder_visits is None:
+                start_visits = self.ponder_start_visits
+                ponder_visits = {move: visits - start_visits.get(move, 0)
+                                 for move, visits in self.root_visits().items()}
+            self.ponder_visits = ponder_visits
+        else:
+            self.stats['total_time'] += time_taken
+            self.stats['total_simulations'] += num_playouts
+        return time_taken
+
+    def root_visits(self):
+        """
+        Visits of the root children, by move
+        """
+        return {self.tree.get_action(child): child.num_visits for child in self.tree.children}
+
+    def best_child(self, node):
+        """
+        Get the child to play using the 'robust child' method (most visits)
+        """
+        children = node.children
+        return children[np.argmax([child.num_visits for child in children])]
+
+    def solved(self):
+        """
+        Whether the value of the root is known, so the search can stop before its budget is spent
+        """
+        return False
+
+    def evaluate(self, board, is_white):
+        """
+        Evaluate <board> with the evaluation cache if there is one
+        """
+        if self.eval_cache:
+            return self.eval_cache.evaluate(board, is_white)
+        return evaluate(board, is_white)
+
+    def close(self):
+        """
+        Release the resources held by the model, such as worker processes
+        """
+        if self.leaf_pool is not None:
+            self.leaf_pool.terminate()
+            self.leaf_pool.join()
+            self.leaf_pool = None
+
     def get_stats(self):
-        return self.stats
+        stats = dict(self.stats)
+        stats['reuse_rate'] = stats['reuse_hits'] / stats['searches'] if stats['searches'] else 0
+        if self.transpositions is not None:
+            stats.update(self.transpositions.get_stats())
+        if self.eval_cache:
+            stats.update(self.eval_cache.get_stats())
+        return stats
 
 
 # testing
@@ -1,47 +1,67 @@
 import random
 import chess
 
-from functions.eval import evaluate, tanh
+from functions.decisive_moves import find_decisive_move, allows_decisive_move
+from functions.eval import tanh
 from models.mcts_progressive_unpruning import MCTSProgressiveUnpruning
 
 
 # MCTS with Decisive Move simulation
 class MCTSDecisiveMoves(MCTSProgressiveUnpruning):
+    """
+    Playouts play a decisive move (mate in one) whenever there is one, and a random move otherwise.
+    With <anti_decisive>, the random move is also chosen among the moves that do not allow the opponent a mate in one.
+    """
     def __init__(self, chess_board=chess.Board(), **kwargs):
         super().__init__(chess_board, **kwargs)
+        if self.lockstep_playouts:
+            raise ValueError('lock-step playouts only support random playout policies')
+        self.anti_decisive = kwargs.get('anti_decisive', False)
 
-    def choose_move(self, curr_board):
-        # Scan for any possible decisive moves (moves that will win the game).
-        temp_board = curr_board.copy()
-        for legal_move in curr_board.legal_moves:
-            temp_board.push(legal_move)
-            if temp_board.is_checkmate():
-                return legal_move
-            temp_board.pop()
-        return self.get_random_move(curr_board)
+    def choose_move(self, curr_board, moves=None):
+        if moves is None:
+            moves = list(curr_board.legal_moves)
+        # only the moves that give check are played to look for a mate
+        decisive_move = find_decisive_move(curr_board, moves)
+        if decisive_move is not None:
+            return decisive_move
+        if not self.anti_decisive:
+            return self.get_random_move(curr_board, moves)
+        # draw random moves until one does not allow a mate in one, so a safe move usually costs one check
+        candidates = list(moves)
+        while candidates:
+            index = random.randrange(len(candidates))
+            move = candidates[index]
+            if not allows_decisive_move(curr_board, move):
+                return move
+            candidates[index] = candidates[-1]
+            candidates.pop()
+        return self.get_random_move(curr_board, moves)  # every move loses
 
     # modification of epsilon-greedy simulation to include decisive moves
     def simulation(self, curr_node):
-        curr_board = chess.Board(curr_node.state)
+        curr_board = self._playout_board(curr_node)
         for i in range(self.max_moves):
             # first, check if the game is over
-            if curr_board.is_game_over():
-                if curr_board.result() == '1-0':  # if white win
+            moves = curr_board.legal_move_list()
+            result = curr_board.outcome_of(moves)
+            if result is not None:
+                if result == '1-0':  # if white win
                     if curr_node.is_white:
                         return 1
                     else:
                         return -1
-                elif curr_board.result() == '0-1':  # if white lose
+                elif result == '0-1':  # if white lose
                     if curr_node.is_white:
                         return -1
                     else:
                         return 1
                 else:  # if tie
                     return 0
-            next_move = self.choose_move(curr_board)
-            curr_board.push(next_move)
+            next_move = self.choose_move(curr_board, moves)
+            curr_board.play(next_move)
         # if there is no victor after the max number of moves has been made, use evaluation function.
-        score = evaluate(curr_board, curr_node.is_white)
+        score = self.evaluate(curr_board, curr_node.is_white)
         return tanh(score)
 
 
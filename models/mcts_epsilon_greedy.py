@@ -1,33 +1,50 @@
+import heapq
 import math
 import random
 
 import chess
 
-from functions.eval import evaluate, MAX_SCORE, tanh
+from functions.eval import MAX_SCORE, tanh, move_delta
+from functions.incremental_eval import IncrementalEvaluator
 from models.mcts_progressive_unpruning import MCTSProgressiveUnpruning
 
 
 # MCTS with Epsilon Greedy Search
 class MCTSEpsilonGreedy(MCTSProgressiveUnpruning):
+    """
+    Greedy playout policies:
+        'evaluate' - every legal move is scored with the full evaluation
+        'delta' - moves are ranked by move_delta(), only the <greedy_top_k> best of them (and the moves tied with
+                  the last one) are scored with the full evaluation
+    """
     def __init__(self, chess_board=chess.Board(), **kwargs):
         super().__init__(chess_board, **kwargs)
+        if self.lockstep_playouts:
+            raise ValueError('lock-step playouts only support random playout policies')
         self.epsilon = kwargs.get('epsilon', 0.4)
+        self.greedy_policy = kwargs.get('greedy_policy', 'evaluate')
+        if self.greedy_policy not in ('evaluate', 'delta'):
+            raise ValueError(f'Unknown greedy policy: {self.greedy_policy}')
+        self.greedy_top_k = kwargs.get('greedy_top_k', 3)
 
     def simulation(self, curr_node):
         """
         Modified simulation policy to randomly decide between a greedy simulation and random simulation
         with probability e.
         """
-        curr_board = chess.Board(curr_node.state)
+        curr_board = self._playout_board(curr_node)
+        evaluator = IncrementalEvaluator(curr_board)  # every playout move is played through the evaluator
         for i in range(self.max_moves):  # do until no more moves, or until game end?
             # first, check if the game is over
-            if curr_board.is_game_over():
-                if curr_board.result() == '1-0':  # if white win
+            moves = curr_board.legal_move_list()
+            result = curr_board.outcome_of(moves)
+            if result is not None:
+                if result == '1-0':  # if white win
                     if curr_node.is_white:
                         return 1
                     else:
                         return -1
-                elif curr_board.result() == '0-1':  # if white lose
+                elif result == '0-1':  # if white lose
                     if curr_node.is_white:
                         return -1
                     else:
@@ -36,33 +53,54 @@ class MCTSEpsilonGreedy(MCTSProgressiveUnpruning):
                     return 0
             e = random.random()  # epsilon
             if e < self.epsilon:
-                random_move = self.get_random_move(curr_board)
-                curr_board.push(random_move)
+                random_move = self.get_random_move(curr_board, moves)
+                evaluator.play(random_move)
+            elif self.greedy_policy == 'delta':
+                evaluator.play(self.get_delta_best_move(curr_board, evaluator, moves))
             else:
-                best_move = self.get_best_move(curr_board)
-                curr_board.push(best_move)
+                best_move = self.get_best_move(curr_board, evaluator, moves)
+                evaluator.play(best_move)
         # if there is no victor after the max number of moves has been made, use evaluation function.
-        score = evaluate(curr_board, curr_node.is_white)
+        score = evaluator.evaluate(curr_node.is_white)
         return tanh(score)
 
-    def get_best_move(self, curr_board):
+    def get_best_move(self, curr_board, evaluator=None, moves=None):
         """
-        Get the best move out of all legal moves according to the heuristic function
+        Get the best move out of all legal moves according to the heuristic function.
+        Moves are scored with an incremental evaluator of <curr_board>.
         """
+        if evaluator is None:
+            evaluator = IncrementalEvaluator(curr_board)
+        is_white = curr_board.turn
         best_move = None
         best_score = -math.inf
-        for legal_move in curr_board.legal_moves:
-            curr_board.push(legal_move)
-            score = evaluate(curr_board, not curr_board.turn)
+        if moves is None:
+            moves = list(curr_board.legal_moves)
+        for legal_move in moves:
+            score = evaluator.evaluate_move(legal_move, is_white)
             if score > best_score:
                 best_score = score
                 best_move = legal_move
                 if score == MAX_SCORE:
-                    curr_board.pop()
                     return best_move
-            curr_board.pop()
         return best_move
 
+    def get_delta_best_move(self, curr_board, evaluator=None, moves=None):
+        """
+        Get the best move according to the heuristic function, out of the legal moves with the best move_delta()
+        """
+        if moves is None:
+            moves = list(curr_board.legal_moves)
+        ranked = [(move_delta(curr_board, move), move) for move in moves]
+        if len(ranked) > self.greedy_top_k:
+            threshold = heapq.nlargest(self.greedy_top_k, [delta for delta, _ in ranked])[-1]
+            candidates = [move for delta, move in ranked if delta >= threshold]
+        else:
+            candidates = moves
+        if len(candidates) == 1:
+            return candidates[0]
+        return self.get_best_move(curr_board, evaluator, candidates)
+
 
 # testing
 if __name__ == '__main__':
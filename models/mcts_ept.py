@@ -1,7 +1,10 @@
 import chess
 
 from functions.compare_models import max_depth
-from functions.eval import evaluate, tanh
+import numpy as np
+
+from functions.batch_playout import batch_playouts
+from functions.eval import tanh, evaluate_batch
 from models.mcts import MCTS
 
 
@@ -16,28 +19,43 @@ class MCTSEarlyPlayoutTermination(MCTS):
         Terminate the simulation after <max_moves> plys
         """
         # default policy: simulate the game using randomly selected moves.
-        curr_board = chess.Board(curr_node.state)
+        curr_board = self._playout_board(curr_node)
         for i in range(self.max_moves):  # do until no more moves, or until game end?
             # first, check if the game is over
-            if curr_board.is_game_over():
-                if curr_board.result() == '1-0':  # if white win
+            moves = curr_board.legal_move_list()
+            result = curr_board.outcome_of(moves)
+            if result is not None:
+                if result == '1-0':  # if white win
                     if curr_node.is_white:
                         return 1
                     else:
                         return -1
-                elif curr_board.result() == '0-1':  # if white lose
+                elif result == '0-1':  # if white lose
                     if curr_node.is_white:
                         return -1
                     else:
                         return 1
                 else:  # if tie
                     return 0
-            random_move = self.get_random_move(curr_board)
-            curr_board.push(random_move)
+            random_move = self.get_random_move(curr_board, moves)
+            curr_board.play(random_move)
         # if there is no victor after the max number of moves has been made, use evaluation function.
-        score = evaluate(curr_board, curr_node.is_white)
+        score = self.evaluate(curr_board, curr_node.is_white)
         return tanh(score)
 
+    def simulate_batch(self, node, num_playouts):
+        """
+        Lock-step playouts terminated after <max_moves> plys. Games that are still running are evaluated together.
+        """
+        results, _, final_boards = batch_playouts([self._node_board(node)] * num_playouts, max_plies=self.max_moves)
+        if not node.is_white:
+            results = -results
+        running = np.isnan(results)
+        if running.any():
+            scores = evaluate_batch([board for board in final_boards if board is not None], node.is_white)
+            results[running] = tanh(scores)
+        return float(results.mean())
+
 
 # testing
 if __name__ == '__main__':
@@ -4,7 +4,7 @@ import anytree
 import chess
 from anytree import RenderTree
 
-from functions.eval import evaluate, tanh
+from functions.eval import tanh
 from models.mcts_ept import MCTSEarlyPlayoutTermination
 from node.node import MCTSNode
 
@@ -32,41 +32,38 @@ class MCTSProgressiveBias(MCTSEarlyPlayoutTermination):
         """
         if node.untried_actions:
             untried_move = node.untried_actions.pop()
-            new_board = chess.Board(node.state)
-            new_board.push(untried_move)
+            new_board = self._child_board(node, untried_move)
+            child_node = self.transposition(node, untried_move, new_board)
+            if child_node is not None:
+                return child_node
 
             self.node_counter += 1
-            child_node = MCTSNode(
-                name=f'S{self.node_counter}',
-                board=new_board,
+            child_node = self.new_node(
+                new_board,
                 parent=node,
                 action=untried_move,
-                heuristic_score=evaluate(new_board, node.is_white)
+                heuristic_score=self.evaluate(new_board, node.is_white)
             )
             return child_node
         return node
 
-    def _set_root(self, next_board):
-        state = next_board.fen()
-        self.tree = next((n for n in self.tree.children if n.state == state), None)
-        if self.tree is None:
-            self.tree = MCTSNode(
-                f'S{self.node_counter}',
-                board=next_board,
-                score=0,
-                heuristic_score=evaluate(next_board, not next_board.turn)
-            )
-        self.tree.parent = None  # deallocate the rest of the tree to save memory
+    def _new_root(self, next_board):
+        return self.new_node(
+            next_board,
+            score=0,
+            heuristic_score=self.evaluate(next_board, not next_board.turn)
+        )
 
     def reset(self):
         new_board = chess.Board()
         self.node_counter = 0
-        self.tree = MCTSNode(
-            f'S{self.node_counter}',
-            board=new_board,
+        self._set_board(new_board)
+        self.tree = self.new_node(
+            new_board,
             score=0,
             heuristic_score=0
         )
+        self._new_game()
 
 
 # testing
@@ -14,23 +14,24 @@ class MCTSProgressiveUnpruning(MCTSEarlyPlayoutTermination):
         self.n_unpruned = kwargs.get('n_unpruned', 5)
         self.PW_A = kwargs.get('PW_B', 50)
         self.PW_B = kwargs.get('PW_B', 1.3)
+        self.rank_interval = kwargs.get('rank_interval', 8)  # visits between two rankings of the children
 
     def selection(self, node):
         """
         Once all children nodes have been expanded, prune the nodes leaving only <n_unpruned> remaining.
         When a node receives more visits than the threshold value, begin unpruning nodes.
+        The unpruned children are ranked again every <rank_interval> visits.
         """
         selected_node = node
         best_uct = -math.inf
         if not node.untried_actions and node.children:
             log = math.log(node.num_visits)
             if node.num_visits >= self.PW_A:
-                node.sort_children()
                 threshold = self.PW_A * self.PW_B ** (node.num_unpruned + 1 - self.n_unpruned)
                 if node.num_visits > threshold:
                     node.num_unpruned += 1
-                j = min(node.num_unpruned, len(node.children))
-                for child_node in node.sorted_children[:j]:
+                node.rank_children(node.num_unpruned, self.rank_interval)
+                for child_node in node.sorted_children:
                     uct = self.get_uct(child_node, log)
                     if uct > best_uct:
                         selected_node = child_node
@@ -48,41 +49,29 @@ class MCTSProgressiveUnpruning(MCTSEarlyPlayoutTermination):
         if node.untried_actions:
             move = node.untried_actions.pop()
             # make the move
-            new_board = chess.Board(node.state)
-            new_board.push(move)
+            new_board = self._child_board(node, move)
+            child_node = self.transposition(node, move, new_board)
+            if child_node is not None:
+                return child_node
 
             self.node_counter += 1
-            child_node = MCTSNode(
-                name=f'S{self.node_counter}',
-                board=new_board,
-                parent=node,
-                action=move,
-            )
+            child_node = self.new_node(new_board, parent=node, action=move)
             child_node.num_unpruned = self.n_unpruned  # initialize the current amount of unpruned nodes for each node
             return child_node
         return node
 
-    def _set_root(self, board):
-        state = board.fen()
-        self.tree = next((n for n in self.tree.children if n.state == state), None)
-        if self.tree is None:
-            self.tree = MCTSNode(
-                f'S{self.node_counter}',
-                board=board,
-                score=0,
-            )
-            self.tree.num_unpruned = self.n_unpruned
-        self.tree.parent = None  # deallocate the rest of the tree to save memory
+    def _new_root(self, board):
+        root = self.new_node(board, score=0)
+        root.num_unpruned = self.n_unpruned
+        return root
 
     def reset(self):
         board = chess.Board()
         self.node_counter = 0
-        self.tree = MCTSNode(
-            f'S{self.node_counter}',
-            board=board,
-            score=0,
-        )
+        self._set_board(board)
+        self.tree = self.new_node(board, score=0)
         self.tree.num_unpruned = self.n_unpruned
+        self._new_game()
 
 
 # testing
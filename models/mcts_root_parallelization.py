@@ -5,8 +5,153 @@ import chess
 import numpy as np
 import random
 
+from functions.search_control import make_snapshot
 from models.mcts_score_bounded import MCTSScoreBounded
-from multiprocessing import Pool
+from multiprocessing import Event, Pipe, Process
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+
+MAX_ROOT_MOVES = 256  # more than the number of legal moves in any chess position
+POLL_INTERVAL = 0.01  # seconds between two reads of the shared root statistics by the coordinator
+
+
+class SharedRootStats:
+    """
+    Root statistics of every tree in one shared memory block: (visits, score) per tree and root move, the number of
+    simulations performed by each tree and a stop flag. Root moves are indexed in legal move generation order, which
+    is the same in every process for the same position. The block is created and unlinked by the coordinator, the
+    workers attach to it by name.
+    """
+    def __init__(self, num_trees, name=None):
+        size = num_trees * MAX_ROOT_MOVES * 2 + num_trees + 1
+        self.memory = SharedMemory(name=name, create=name is None, size=size * 8)
+        self.name = self.memory.name
+        array = np.ndarray((size,), dtype=np.float64, buffer=self.memory.buf)
+        self.children = array[:-num_trees - 1].reshape(num_trees, MAX_ROOT_MOVES, 2)
+        self.simulations = array[-num_trees - 1:-1]
+        self.flags = array[-1:]
+
+    @property
+    def stopped(self):
+        return self.flags[0] != 0
+
+    def stop(self):
+        self.flags[0] = 1
+
+    def clear(self):
+        self.children.fill(0)
+        self.simulations.fill(0)
+        self.flags.fill(0)
+
+    def close(self, unlink=False):
+        del self.children, self.simulations, self.flags  # views must be released before the buffer is closed
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def search_worker(connection, model_class, model_kwargs, stop_event=None):
+    """
+    Worker process loop. Each tree hosted by the worker is a model that stays resident between moves, so every job
+    only carries the root position, the deadline, the ids of the trees to search and the shared statistics block
+    (name, number of trees), if any. A None job shuts the worker down. The trees stop searching once <stop_event>
+    is set by the coordinator.
+    """
+    models = []
+    shared_stats = None
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        board, deadline, tree_ids, shared = job
+        if shared is not None and (shared_stats is None or shared_stats.name != shared[0]):
+            shared_stats = SharedRootStats(shared[1], name=shared[0])
+        num_trees = len(tree_ids)
+        while len(models) < num_trees:  # daemonic workers cannot start leaf processes, so playouts run in place
+            models.append(model_class(**dict(model_kwargs, leaf_processes=0)))
+            models[-1].stop_event = stop_event
+        results = []
+        for i, (tree_id, model) in enumerate(zip(tree_ids, models)):
+            # trees hosted by the same worker are searched one after another and share the remaining time
+            tree_deadline = None
+            if deadline is not None:
+                tree_deadline = time.time() + (deadline - time.time()) / (num_trees - i)
+            model._set_root(board)  # advance the resident tree by the moves played since its last search
+            inherited_visits = model.tree.num_visits
+            model.share_root_stats(shared_stats if shared is not None else None, tree_id)
+            results.append(model.parallel_search(tree_deadline) +
+                           (inherited_visits, model.controller.stop_reason is not None))
+        connection.send(results)
+    if shared_stats is not None:
+        shared_stats.close()
+    connection.close()
+
+
+class SearchWorkerPool:
+    """
+    Long-lived worker processes for parallel search, created once per model and reused across moves and games.
+    Each process runs <worker>(connection, model_class, model_kwargs, *args).
+    """
+    def __init__(self, num_processes, model_class, model_kwargs, worker=search_worker, args=()):
+        self.connections = []
+        self.processes = []
+        self.pending = []
+        for _ in range(num_processes):
+            parent_connection, child_connection = Pipe()
+            process = Process(target=worker, args=(child_connection, model_class, model_kwargs) + tuple(args),
+                              daemon=True)
+            process.start()
+            child_connection.close()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+
+    def __len__(self):
+        return len(self.processes)
+
+    def submit(self, jobs):
+        """
+        Send job i to worker i without waiting for the results
+        """
+        self.pending = self.connections[:len(jobs)]
+        for connection, job in zip(self.pending, jobs):
+            connection.send(job)
+
+    def wait(self, timeout=None):
+        """
+        Wait for the submitted jobs for at most <timeout> seconds. Returns True once every result is ready
+        """
+        waiting = [connection for connection in self.pending if not connection.poll()]
+        if waiting:
+            wait(waiting, timeout)
+        return all(connection.poll() for connection in self.pending)
+
+    def collect(self):
+        """
+        Wait for the results of the submitted jobs
+        """
+        results = [connection.recv() for connection in self.pending]
+        self.pending = []
+        return results
+
+    def map(self, jobs):
+        """
+        Send job i to worker i, then wait for all of the results
+        """
+        self.submit(jobs)
+        return self.collect()
+
+    def close(self):
+        for connection, process in zip(self.connections, self.processes):
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+        self.connections = []
+        self.processes = []
 
 
 # MCTS with Root Parallelization
@@ -15,57 +160,192 @@ class MCTSRootParallelization(MCTSScoreBounded):
         super().__init__(chess_board, **kwargs)
         self.num_processes = kwargs.get('num_processes', round(os.cpu_count() * .75))  # int(os.cpu_count()/1.5))
         self.num_trees = kwargs.get('num_trees', self.num_processes)
+        self.pool = None
+        # publish root statistics every <share_interval> simulations, None keeps the trees independent
+        self.share_interval = kwargs.get('share_interval', None)
+        self.share_root_stats(None, 0)
+        self.stop_event = None  # set to interrupt the search of every tree
+
+    def share_root_stats(self, shared_stats, tree_id):
+        """
+        Publish the root statistics of this tree as tree <tree_id> of <shared_stats>, and bias the root selection with
+        the statistics pooled from the other trees
+        """
+        self.shared_stats = shared_stats
+        self.tree_id = tree_id
+        self.root_moves = {move: i for i, move in enumerate(self.board.legal_moves)} if shared_stats else {}
+        self.root_children = {}  # root child node -> root move index
+        self.pooled = []  # [visits, score] of the other trees per root move
+        self.pooled_visits = 0
+        self.pooled_log = 0
+        self.pooling = False
+
+    def publish_root_stats(self, num_sims):
+        """
+        Write the root child statistics of this tree to the shared block and read back those of the other trees
+        """
+        shared_stats, root = self.shared_stats, self.tree
+        row = shared_stats.children[self.tree_id]
+        for child in root.children:
+            i = self.root_children.get(child)
+            if i is None:
+                i = self.root_children[child] = self.root_moves[root.get_action(child)]
+            row[i] = child.num_visits, child.score
+        shared_stats.simulations[self.tree_id] = num_sims
+        others = shared_stats.children.sum(axis=0) - row
+        self.pooled = others.tolist()
+        self.pooled_visits = others[:, 0].sum()
+
+    def selection(self, node):
+        """
+        At the root, select with the visits and scores pooled from all trees
+        """
+        if not self.pooled or node != self.tree:
+            return super().selection(node)
+        self.pooling = True
+        self.pooled_log = math.log(node.num_visits + self.pooled_visits) if node.num_visits else 0
+        try:
+            return super().selection(node)
+        finally:
+            self.pooling = False
+
+    def get_uct(self, curr_node, log):
+        i = self.root_children.get(curr_node) if self.pooling else None
+        if i is None:
+            return super().get_uct(curr_node, log)
+        visits, score = self.pooled[i]
+        visits += curr_node.num_visits
+        return (curr_node.score + score) / visits + self.C * math.sqrt(self.pooled_log / visits)
+
+    def best_move_decided(self, start_time, deadline):
+        """
+        Check the shared statistics for a most visited root move that can no longer be overtaken in the remaining
+        simulations
+        """
+        shared_stats = self.shared_stats
+        visits = np.sort(shared_stats.children[:, :, 0].sum(axis=0))
+        num_sims = shared_stats.simulations.sum()  # playouts, which add one visit each
+        remaining = self.max_sims * self.leaf_playouts * self.num_trees - num_sims
+        if deadline is not None:
+            now = time.time()
+            remaining = min(remaining, num_sims / max(now - start_time, 1e-9) * (deadline - now))
+        # every tree can have up to <share_interval> simulations that are not published yet
+        return visits[-1] - visits[-2] > remaining + self.share_interval * self.leaf_playouts * self.num_trees
 
-    def parallel_search(self):
+    def parallel_search(self, deadline=None):
         """
         Parallelized search with a random seed for each process
         """
         random.seed((os.getpid() * int(time.time())) % 123456789)  # set a random seed so that we get different results
-        start_time = time.time()
-        i = 0
+        deadline = self.controller.start(self.max_sims * self.leaf_playouts, deadline)
+        start_visits = self.root_visits()
+        num_playouts = 0
         for i in range(self.max_sims):
             node = self.tree_policy()
-            score = -self.simulation(node)
-            self.backpropagation(node, score)
+            score, visits = self.simulate_leaf(node)
+            num_playouts += visits
+            self.backpropagation(node, -score, visits)
             # check time limit
-            if self.max_time is not None and (time.time() - start_time) > self.max_time:
+            if deadline is not None and time.time() > deadline:
+                break
+            if self.stop_event is not None and self.stop_event.is_set():  # the search was interrupted
+                break
+            if self.shared_stats is not None:
+                if self.shared_stats.stopped:  # the coordinator has seen enough
+                    break
+                if (i + 1) % self.share_interval == 0:
+                    self.publish_root_stats(num_playouts)
+            elif self.controller.should_stop(self.tree, num_playouts):  # the vote of this tree is decided
                 break
         best_child = np.argmax([child.num_visits for child in self.tree.children])
-        best_move = self.tree.children[best_child].action
+        best_move = self.tree.get_action(self.tree.children[best_child])
         num_visits = self.tree.children[best_child].num_visits
-        # return move, total visits, total simulations performed, node stats
-        return best_move, num_visits, i + 1, [(n.score, n.num_visits, n.action) for n in self.tree.children]
+        # return move, total visits, total simulations performed, node stats (with the visits inherited by the node)
+        node_stats = []
+        for n in self.tree.children:
+            move = self.tree.get_action(n)
+            node_stats.append((n.score, n.num_visits, move, start_visits.get(move, 0)))
+        return best_move, num_visits, num_playouts, node_stats
 
-    def run(self, board, print_stats=False):
+    def search_iter(self, board, interval=0.1, ponder=False):
         """
-        Modify main run function to handle parallel execution and multiple tree aggregation
+        Search the trees in the worker processes, and aggregate them. Intermediate snapshots are taken from the root
+        statistics shared by the trees (<share_interval>). Independent trees only report at the end of the search, so
+        their intermediate snapshots carry the elapsed time but no root statistics. Closing the generator stops the
+        trees.
         """
+        self._set_root(board, ponder)
+        self._init_node(self.tree)
         if self.tree.is_game_over:
-            return None
-
-        self._set_root(board)
+            yield self.snapshot(0, 0, final=True)
+            return
 
-        start_time = time.time()
+        if self.pool is None:  # started once, outside of the time budget of the move
+            if self.share_interval:  # created first, so the workers inherit the resource tracker that owns it
+                self.shared_stats = SharedRootStats(self.num_trees)
+            self.stop_event = Event()
+            self.pool = SearchWorkerPool(min(self.num_processes, self.num_trees), type(self), self.kwargs,
+                                         args=(self.stop_event,))
 
-        with Pool(self.num_processes) as p:
-            ensemble_rewards = p.starmap(self.parallel_search, [() for _ in range(self.num_trees)])
+        # the deadline is shared by all workers, so the time budget holds end to end
+        deadline = self.controller.start(deadline=math.inf if ponder else None)
+        self.stop_event.clear()
+        start_time = self.controller.start_time
+        num_workers = len(self.pool)
+        shared = None
+        if self.shared_stats is not None:
+            self.shared_stats.clear()
+            shared = (self.shared_stats.name, self.num_trees)
+        jobs = [(board, deadline, list(range(i, self.num_trees, num_workers)), shared) for i in range(num_workers)]
+        self.pool.submit(jobs)
+        try:
+            if self.shared_stats is not None:
+                # read the pooled statistics while the workers search, and stop them once the best move is decided
+                next_snapshot = start_time + interval if interval is not None else math.inf
+                while not self.pool.wait(POLL_INTERVAL):
+                    if not ponder and self.controller.early_stop and self.best_move_decided(start_time, deadline):
+                        self.shared_stats.stop()
+                        self.stats['early_stops'] += 1
+                        break
+                    now = time.time()
+                    if now >= next_snapshot:
+                        yield self.shared_snapshot(board, now - start_time)
+                        next_snapshot = time.time() + interval
+            elif interval is not None:
+                while not self.pool.wait(interval):
+                    yield make_snapshot(None, [], [], [], 0, time.time() - start_time)
+        except GeneratorExit:
+            self.stop_event.set()  # the caller has seen enough
+            raise
+        finally:
+            ensemble_rewards = [result for results in self.pool.collect() for result in results]
+            total_sims = sum(sim_count for _, _, sim_count, *_ in ensemble_rewards)
+            ponder_visits = None
+            if ponder:  # the trees live in the workers, so the root of this process has no visits
+                ponder_visits = {}
+                for *_, tree_reward_list, _, _ in ensemble_rewards:
+                    for _, visits, move, start_visits in tree_reward_list:
+                        ponder_visits[move] = ponder_visits.get(move, 0) + visits - start_visits
+            # recorded before the generator is closed, which skips the rest of the search
+            time_taken = self.finish_search(total_sims, ponder, ponder_visits)
+        if not ponder and self.shared_stats is None and all(stopped for *_, stopped in ensemble_rewards):
+            self.stats['early_stops'] += 1  # the vote of every independent tree was decided early
 
-        time_taken = time.time() - start_time
-        total_sims = 0
+        inherited_visits = 0
         move_dict = {}
         vote_dict = {}
 
         # first, tally the votes and visits
-        for best_move, num_visits, sim_count, tree_reward_list in ensemble_rewards:
+        for best_move, num_visits, sim_count, tree_reward_list, tree_inherited_visits, _ in ensemble_rewards:
+            inherited_visits += tree_inherited_visits
             move_name = best_move.uci()
             if move_name not in vote_dict:
                 vote_dict[move_name] = [1, num_visits, best_move]
             else:
                 vote_dict[move_name][0] += 1
                 vote_dict[move_name][1] += num_visits
-            total_sims += sim_count
             for node_reward in tree_reward_list:
-                mean, visits, move = node_reward
+                mean, visits, move, _ = node_reward
                 move_name = move.uci()
                 if move_name not in move_dict:
                     # [[mean, total visits], count, move object]
@@ -74,33 +354,56 @@ class MCTSRootParallelization(MCTSScoreBounded):
                 move_dict[move_name][0][1] += visits
                 move_dict[move_name][1] += 1
 
-        # ----- majority voting -----
-        # we combine using the majority voting method.
-        # 1. each tree will vote on the best moves discovered independently.
-        # 2. the number of votes are tallied, and the move with the most votes wins.
-        # 3. if two (or more) moves have the same number of votes, then the move with the most visits wins.
-        best = [0, 0, None]
-        for move_stats in vote_dict.values():
-            if move_stats[0] > best[0]:  # for majority voting
-                best = move_stats
-            elif move_stats[0] == best[0]:  # if there is a tie, prefer the move with the most visits
-               if move_stats[1] > best[1]:
-                   best = move_stats
-        best_move = best[2]
-        total_visits = best[1]
-
-        self.stats['total_time'] += time_taken
-        self.stats['total_simulations'] += total_sims
-        if print_stats:  # for statistics
-            child_node_visits, child_node_scores = [], []  # for displaying stats
-            for key in move_dict.keys():
-                child_node_scores.append(move_dict[key][0][0])
-                child_node_visits.append(move_dict[key][0][1])
-            print(f'Time elapsed: {time_taken}, Simulations completed: {total_sims}')
-            print('Child node visits:', child_node_visits)
-            print('Child node scores:', child_node_scores)
-            print(f'Best move: {best_move}, Num visits: {total_visits}')
-        return best_move
+        if self.shared_stats is not None:
+            # the trees did not search independently, so the move with the most pooled visits is chosen
+            best = max(move_dict.values(), key=lambda move_stats: move_stats[0][1])
+            best_move = best[2]
+        else:
+            # ----- majority voting -----
+            # we combine using the majority voting method.
+            # 1. each tree will vote on the best moves discovered independently.
+            # 2. the number of votes are tallied, and the move with the most votes wins.
+            # 3. if two (or more) moves have the same number of votes, then the move with the most visits wins.
+            best = [0, 0, None]
+            for move_stats in vote_dict.values():
+                if move_stats[0] > best[0]:  # for majority voting
+                    best = move_stats
+                elif move_stats[0] == best[0]:  # if there is a tie, prefer the move with the most visits
+                   if move_stats[1] > best[1]:
+                       best = move_stats
+            best_move = best[2]
+
+        if inherited_visits and not ponder:  # the trees are reused inside the workers, not in this process
+            self.stats['reuse_hits'] += 1
+            self.stats['inherited_visits'] += inherited_visits
+        move_stats = list(move_dict.values())
+        yield make_snapshot(best_move, [stats[2] for stats in move_stats],
+                            [int(stats[0][1]) for stats in move_stats], [stats[0][0] for stats in move_stats],
+                            total_sims, time_taken, final=True)
+
+    def shared_snapshot(self, board, time_taken):
+        """
+        Snapshot of the root statistics pooled from the shared block, which lag behind the trees by up to
+        <share_interval> simulations each
+        """
+        pooled = self.shared_stats.children.sum(axis=0)
+        moves = list(board.legal_moves)  # the order of the root move indexes
+        visits = pooled[:len(moves), 0].astype(int).tolist()
+        best_move = moves[int(np.argmax(visits))] if any(visits) else None
+        return make_snapshot(best_move, moves, visits, pooled[:len(moves), 1].tolist(),
+                             int(self.shared_stats.simulations.sum()), time_taken)
+
+    def close(self):
+        """
+        Shut down the worker processes
+        """
+        super().close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        if self.shared_stats is not None:
+            self.shared_stats.close(unlink=True)
+            self.shared_stats = None
 
 
 # testing
@@ -111,6 +414,7 @@ if __name__ == '__main__':
     move = mcts.run(board, print_stats=True)
 
     board.push(move)
+    mcts.close()
 
     print(board)
     print(board.fen)
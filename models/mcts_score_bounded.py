@@ -5,7 +5,7 @@ import anytree
 import chess
 
 from functions.compare_models import max_depth
-from functions.eval import MAX_SCORE, tanh, evaluate
+from functions.eval import MAX_SCORE, tanh
 from models.mcts_progressive_unpruning import MCTSProgressiveUnpruning
 from node.node import MCTSNode
 
@@ -16,22 +16,25 @@ class MCTSScoreBounded(MCTSProgressiveUnpruning):
         super().__init__(chess_board, **kwargs)
         self.pess_bias = kwargs.get('pess_bias', 20)
         self.opti_bias = kwargs.get('opti_bas', 20)
+        # the pruned children are ranked again when bounds change (see update_bounds), but a node reached through a
+        # transposition changes the bounds of parents that are not on its path, so these are ranked on every visit
+        self.prune_rank_interval = self.rank_interval if self.transpositions is None else 1
 
     def selection(self, node):
         """
         Selection function is modified to include alpha beta pruning based on score bounds.
+        The ranking of the children is lazy for their order only: backpropagation drops it when bounds change, so the
+        pruned children are always up to date.
         """
         selected_node = node
         best_uct = -math.inf
         if not node.untried_actions and node.children:
-            node.alpha_beta_pruning()
-
             threshold = self.PW_A * self.PW_B ** (node.num_unpruned + 1 - self.n_unpruned)
             if node.num_visits > threshold:
                 node.num_unpruned += 1
+            node.rank_children(node.num_unpruned, self.prune_rank_interval, prune=True)
             log = math.log(node.num_visits)
-            j = min(node.num_unpruned, len(node.children))
-            for child_node in node.sorted_children[:j]:
+            for child_node in node.sorted_children:
                 uct = self.get_uct(child_node, log)
                 if uct > best_uct:
                     selected_node = child_node
@@ -43,83 +46,134 @@ class MCTSScoreBounded(MCTSProgressiveUnpruning):
         if node.untried_actions:
             move = node.untried_actions.pop()
             # make the move
-            new_board = chess.Board(node.state)
-            new_board.push(move)
+            new_board = self._child_board(node, move)
+            child_node = self.transposition(node, move, new_board)
+            if child_node is not None:
+                return child_node
 
             self.node_counter += 1
-            child_node = MCTSNode(
-                name=f'S{self.node_counter}',
-                board=new_board,
+            child_node = self.new_node(
+                new_board,
                 parent=node,
                 action=move,
-                heuristic_score=evaluate(new_board, new_board.turn)  # heuristic score is used to set the bounds
+                heuristic_score=self.evaluate(new_board, new_board.turn)  # heuristic score is used to set the bounds
             )
             child_node.num_unpruned = self.n_unpruned  # initialize the current amount of unpruned nodes for each node
             return child_node
         return node
 
-    def _set_root(self, board):
-        state = board.fen()
-        self.tree = next((n for n in self.tree.children if n.state == state), None)
-        if self.tree is None:
-            self.tree = MCTSNode(
-                f'S{self.node_counter}',
-                board=board,
-                score=0,
-                heuristic_score=evaluate(board, board.turn)
-            )
-            self.tree.num_unpruned = self.n_unpruned
-        self.tree.parent = None  # deallocate the rest of the tree to save memory
+    def _new_root(self, board):
+        root = self.new_node(
+            board,
+            score=0,
+            heuristic_score=self.evaluate(board, board.turn)
+        )
+        root.num_unpruned = self.n_unpruned
+        return root
 
     def reset(self):
         board = chess.Board()
         self.node_counter = 0
-        self.tree = MCTSNode(
-            f'S{self.node_counter}',
-            board=board,
+        self._set_board(board)
+        self.tree = self.new_node(
+            board,
             score=0,
             heuristic_score=0
         )
         self.tree.num_unpruned = self.n_unpruned
+        self._new_game()
 
-    def backpropagation(self, node, result):
+    def backpropagation(self, node, result, visits=1):
         """
         In score bounded search, we also backpropagate the optimistic and pessimistic bound values of the node.
         """
-        while node:
-            node.num_visits += 1
-            node.score += result
+        self._unwind()
+        path = self._get_path(node)
+        for node in path:
+            node.num_visits += visits
+            node.score += result * visits
             result = -result
+        self.update_bounds(path, self.propagate_bounds)
 
-            # update the bounds if this is a terminal node
-            if node.is_game_over:
-                if node.outcome == '1-0':  # if white win
-                    if node.is_white:
-                        node.pess_bound = MAX_SCORE
-                        node.opti_bound = MAX_SCORE
-                    else:
-                        node.pess_bound = -MAX_SCORE
-                        node.opti_bound = -MAX_SCORE
-                elif node.outcome == '0-1':  # if white lose
-                    if node.is_white:
-                        node.opti_bound = -MAX_SCORE
-                        node.pess_bound = -MAX_SCORE
-                    else:
-                        node.pess_bound = MAX_SCORE
-                        node.opti_bound = MAX_SCORE
-                else:  # if tie
-                    node.pess_bound = 0
-                    node.opti_bound = 0
-
-            node = node.parent
-
-            # propagate the pessimistic and optimistic bounds
-            if node and node.children:
-                pess_bound, opti_bound = self.get_bounds(node)
-                node.pess_bound = pess_bound
-                node.opti_bound = opti_bound
-
-            # since we use negated rewards, both bounds should try to minimize.
+    def update_bounds(self, path, propagate):
+        """
+        Update the bounds on <path> with <propagate>, and drop the ranking of the nodes whose pruned children may
+        have changed, so that the next selection ranks them again
+        """
+        old_bounds = [(node.pess_bound, node.opti_bound) for node in path]
+        propagate(path)
+        for i, node in enumerate(path):
+            if (node.pess_bound, node.opti_bound) != old_bounds[i]:
+                # the bounds of a node decide which of its children and of its siblings are pruned
+                node.ranking = None
+                if i + 1 < len(path):
+                    path[i + 1].ranking = None
+
+    def propagate_bounds(self, path):
+        """
+        Set the bounds of terminal nodes and propagate the bounds up the selected path, from the leaf to the root.
+        The parent of the leaf is recomputed from all of its children. Higher up, a node is only updated from the
+        change of its child on the path, and the propagation stops at the first node whose bounds did not change.
+        With a transposition table a node can have several parents, so every bound is recomputed.
+        """
+        if self.transpositions is not None:
+            self.recompute_bounds(path)
+            return
+        self.set_terminal_bounds(path[0])
+        if len(path) == 1:
+            return
+        parent = path[1]
+        old_bounds = (parent.pess_bound, parent.opti_bound)
+        parent.pess_bound, parent.opti_bound = self.get_bounds(parent)
+        for i in range(1, len(path) - 1):
+            child = path[i]
+            old_pess, old_opti = old_bounds
+            new_pess, new_opti = child.pess_bound, child.opti_bound
+            if new_pess == old_pess and new_opti == old_opti:
+                break
+            parent = path[i + 1]
+            old_bounds = (parent.pess_bound, parent.opti_bound)
+            # the bounds of the parent are the negated minimum bounds of its children
+            min_child_opti, min_child_pess = -parent.pess_bound, -parent.opti_bound
+            if (new_opti > min_child_opti and old_opti == min_child_opti) or \
+                    (new_pess > min_child_pess and old_pess == min_child_pess):
+                parent.pess_bound, parent.opti_bound = self.get_bounds(parent)  # the minimum may have gone up
+            else:
+                parent.pess_bound = -min(min_child_opti, new_opti)
+                parent.opti_bound = -min(min_child_pess, new_pess)
+
+    def recompute_bounds(self, path):
+        """
+        Set the bounds of terminal nodes and recompute the bounds of every node on the selected path from all of its
+        children, from the leaf to the root
+        """
+        self.set_terminal_bounds(path[0])
+        for node in path[1:]:
+            node.pess_bound, node.opti_bound = self.get_bounds(node)
+
+    def set_terminal_bounds(self, node):
+        """
+        Set both bounds of a terminal node to its game result. Leaves are initialized lazily, so a terminal leaf is
+        only known once it is selected again, and its bounds are set by the backpropagation of that visit.
+        """
+        if node.is_game_over:
+            if node.outcome == '1-0':  # if white win
+                if node.is_white:
+                    node.pess_bound = MAX_SCORE
+                    node.opti_bound = MAX_SCORE
+                else:
+                    node.pess_bound = -MAX_SCORE
+                    node.opti_bound = -MAX_SCORE
+            elif node.outcome == '0-1':  # if white lose
+                if node.is_white:
+                    node.opti_bound = -MAX_SCORE
+                    node.pess_bound = -MAX_SCORE
+                else:
+                    node.pess_bound = MAX_SCORE
+                    node.opti_bound = MAX_SCORE
+            else:  # if tie
+                node.pess_bound = 0
+                node.opti_bound = 0
 
     def get_bounds(self, node):
         """
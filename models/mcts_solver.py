@@ -0,0 +1,153 @@
+import math
+
+import chess
+
+from functions.compare_models import max_depth
+from functions.decisive_moves import find_decisive_move
+from models.mcts_score_bounded import MCTSScoreBounded
+
+# proven game values, for the side to move at the node
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+
+# MCTS-Solver
+class MCTSSolver(MCTSScoreBounded):
+    """
+    Score bounded search that also proves game values. A terminal node is proven by its result. A node is a proven
+    win once one of its children is a proven loss (for the opponent), and it is proven once all of its children have
+    been expanded and proven, with the best of their negated values.
+    With <prove_mates>, a node with a mate in one is a proven win as soon as it is initialized, without waiting for
+    the mating move to be expanded.
+    Proven children are never selected again, so proven losses are excluded and proven draws stop receiving
+    playouts. The search stops as soon as the root is proven, and never plays a move that is proven to lose.
+    """
+    def __init__(self, chess_board=chess.Board(), **kwargs):
+        super().__init__(chess_board, **kwargs)
+        self.prove_mates = kwargs.get('prove_mates', True)
+        self.stats.update({'proven_nodes': 0, 'solved_searches': 0, 'simulations_saved': 0})
+
+    def _init_node(self, node, board=None):
+        if node.initialized:
+            return
+        if board is None:
+            board = self._node_board(node)
+        super()._init_node(node, board)
+        if self.prove_mates and node.proven is None and not node.is_game_over and \
+                find_decisive_move(board) is not None:
+            node.proven = WIN
+            self.stats['proven_nodes'] += 1
+
+    def expansion(self, node):
+        """
+        Proofs start at the leaves, so unlike the score bounded search, a new leaf is initialized as soon as it is
+        created: a terminal leaf or a mate in one is proven before it is simulated, not when it is selected again
+        """
+        child_node = super().expansion(node)
+        if child_node is not node:
+            self._init_node(child_node)  # the search board is at the new leaf
+        return child_node
+
+    def get_uct(self, curr_node, log):
+        if curr_node.proven is not None:
+            return -math.inf
+        return super().get_uct(curr_node, log)
+
+    def selection(self, node):
+        selected_node = super().selection(node)
+        if selected_node == node and node.sorted_children and \
+                all(child.proven is not None for child in node.sorted_children):
+            # every unpruned child is proven, so the search moves on to the children that are not
+            best_uct = -math.inf
+            log = math.log(node.num_visits)
+            for child_node in node.children:
+                uct = self.get_uct(child_node, log)
+                if uct > best_uct:
+                    selected_node = child_node
+                    best_uct = uct
+        return selected_node
+
+    def backpropagation(self, node, result, visits=1):
+        super().backpropagation(node, result, visits)
+        self.propagate_proofs(self._get_path(node))
+
+    def propagate_proofs(self, path):
+        """
+        Prove the leaf if it is terminal, then prove its ancestors from their children, up to the first ancestor
+        that cannot be proven yet
+        """
+        leaf = path[0]
+        if leaf.proven is None and leaf.is_game_over:
+            if leaf.outcome == '1/2-1/2':
+                leaf.proven = DRAW
+            else:
+                leaf.proven = WIN if (leaf.outcome == '1-0') == leaf.is_white else LOSS
+            self.stats['proven_nodes'] += 1
+        for child, parent in zip(path, path[1:]):
+            if child.proven is None or parent.proven is not None:
+                break
+            if child.proven == LOSS:
+                parent.proven = WIN
+            elif parent.untried_actions:
+                break
+            else:
+                values = [node.proven for node in parent.children]
+                if None in values:
+                    break
+                parent.proven = -min(values)
+            self.stats['proven_nodes'] += 1
+
+    def solved(self):
+        # a root proven by its mate in one is still expanded once, so there is a child to report
+        return self.tree.proven is not None and bool(self.tree.children)
+
+    def best_child(self, node):
+        """
+        Play a move to a proven loss of the opponent if there is one, otherwise the robust child among the moves that
+        are not proven to lose
+        """
+        children = node.children
+        for child in children:
+            if child.proven == LOSS:
+                return child
+        candidates = [child for child in children if child.proven != WIN] or children
+        return max(candidates, key=lambda child: child.num_visits)
+
+    def snapshot(self, num_playouts, time_taken, final=False):
+        snapshot = super().snapshot(num_playouts, time_taken, final)
+        if self.tree.proven == WIN and all(child.proven != LOSS for child in self.tree.children):
+            # proven by its mate in one, which may not be expanded yet
+            snapshot['best_move'] = find_decisive_move(self.board)
+        return snapshot
+
+    def finish_search(self, num_playouts, ponder=False, ponder_visits=None):
+        """
+        A search that ends with the root proven is solved, and the simulations it had left are counted as saved: the
+        rest of its <max_sims> budget, or fewer if its time limit would have stopped it first
+        """
+        saved = self.controller.remaining_playouts(num_playouts)
+        time_taken = super().finish_search(num_playouts, ponder, ponder_visits)
+        if self.tree.proven is not None and not ponder:
+            self.stats['solved_searches'] += 1
+            self.stats['simulations_saved'] += max(0, int(saved))
+        return time_taken
+
+    def run(self, board, print_stats=False):
+        best_move = super().run(board, print_stats)
+        if print_stats and self.tree.proven is not None:
+            print(f'Root proven: {self.tree.proven}')
+        return best_move
+
+
+# testing
+if __name__ == '__main__':
+    # mate in two: 1. Qd8+ Bxd8 2. Re8#
+    board = chess.Board('r1b2k1r/ppp1bppp/8/1B1Q4/5q2/2P5/PPP2PPP/R3R1K1 w - - 1 1')
+    mcts = MCTSSolver(board, max_time=10, max_sims=100000)
+    move = mcts.run(board, print_stats=True)
+    board.push(move)
+
+    print(max_depth(mcts.tree))
+    print(board)
+    print(mcts.get_stats())
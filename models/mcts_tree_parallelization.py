@@ -0,0 +1,303 @@
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import threading
+import time
+
+import chess
+
+from functions.compare_models import max_depth
+from models.mcts_root_parallelization import SearchWorkerPool
+from models.mcts_score_bounded import MCTSScoreBounded
+from node.arena import ArenaNode
+from node.shared_arena import SharedNodeArena
+
+
+class ThreadLocal:
+    """
+    Descriptor for search state that belongs to one worker thread, such as the search board and path
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, model, owner=None):
+        if model is None:
+            return self
+        return getattr(model.local, self.name)
+
+    def __set__(self, model, value):
+        setattr(model.local, self.name, value)
+
+
+def tree_worker(connection, model_class, model_kwargs, arena, shard_locks, tree_lock, counter):
+    """
+    Worker process loop for tree parallelization across processes. Every worker searches the tree stored in the
+    shared arena, using the locks shared by all workers. A job is the root position, the deadline and the playout
+    budget used for early stopping, the worker replies with the number of simulations it performed and the reason it
+    stopped early, if it did. A None job shuts the worker down.
+    """
+    random.seed((os.getpid() * int(time.time())) % 123456789)  # forked workers would share the random state
+
+    def next_simulation():
+        with counter.get_lock():
+            counter.value += 1
+            return counter.value - 1
+
+    model = model_class(**dict(model_kwargs, workers='thread', num_workers=1, leaf_processes=0))
+    model.attach(arena, shard_locks, tree_lock)
+    while True:
+        job = connection.recv()
+        if job is None:
+            break
+        board, deadline, max_playouts = job
+        arena.clear_local(board)
+        model.tree = ArenaNode(arena, 0)
+        model._set_board(board)
+        model.controller.start(max_playouts, deadline)
+        connection.send((model.search(deadline, next_simulation), model.controller.stop_reason))
+    arena.close()
+    connection.close()
+
+
+def join_threads(threads, timeout):
+    """
+    Wait for <threads> for at most <timeout> seconds (None to wait until they finish). Returns True once every
+    thread has finished.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.time()) if deadline is not None else None)
+    return not any(thread.is_alive() for thread in threads)
+
+
+# MCTS with Tree Parallelization
+class MCTSTreeParallelization(MCTSScoreBounded):
+    """
+    Several workers search one shared tree. Each worker adds a virtual loss to the nodes it selects, so the other
+    workers are steered towards different paths until the result is backpropagated.
+
+    Locking:
+        - selection and expansion of a node hold the lock of its shard
+        - backpropagation holds the lock of one node at a time
+        - node creation and initialization hold the tree lock, which is never held while waiting for a shard lock
+
+    Workers:
+        'thread' - threads sharing the model, with a thread-local search board and path
+        'process' - processes sharing a fixed-capacity node arena in shared memory (<max_nodes> nodes)
+    """
+    board = ThreadLocal('board')
+    search_path = ThreadLocal('search_path')
+    tt_key = ThreadLocal('tt_key')
+
+    def __init__(self, chess_board=chess.Board(), **kwargs):
+        self.local = threading.local()
+        self.workers = kwargs.get('workers', 'thread')
+        if self.workers not in ('thread', 'process'):
+            raise ValueError(f'Unknown worker type: {self.workers}')
+        if kwargs.get('transposition_table', False):
+            raise ValueError('tree parallelization does not support a transposition table')
+        # locks and the shared arena are needed by the nodes created in the constructor
+        lock_module = multiprocessing if self.workers == 'process' else threading
+        self.shard_locks = [lock_module.Lock() for _ in range(kwargs.get('num_lock_shards', 64))]
+        self.tree_lock = lock_module.RLock()
+        self.shared_arena = None
+        self.counter = None
+        if self.workers == 'process':
+            kwargs = dict(kwargs, node_store='arena')
+            self.shared_arena = SharedNodeArena(kwargs.get('max_nodes', 200000))
+            self.counter = multiprocessing.Value('i', 0)
+        super().__init__(chess_board, **kwargs)
+        self.num_workers = kwargs.get('num_workers', os.cpu_count())
+        self.virtual_loss = kwargs.get('virtual_loss', 1)
+        if self.workers == 'process':  # rankings are kept per process, so they miss the bound changes of other workers
+            self.prune_rank_interval = 1
+        self.kwargs = kwargs  # used to build the model copy inside each worker process
+        self.pool = None
+
+    def attach(self, arena, shard_locks, tree_lock):
+        """
+        Search the tree of a shared arena, using the locks of the model that owns it
+        """
+        self.node_store = 'arena'
+        self.shared_arena = arena
+        self.shard_locks = shard_locks
+        self.tree_lock = tree_lock
+
+    def lock_for(self, node):
+        # arena indices are the same in every process, object hashes are not
+        key = node.index if self.node_store == 'arena' else hash(node)
+        return self.shard_locks[key % len(self.shard_locks)]
+
+    def add_virtual_loss(self, node):
+        with self.lock_for(node):
+            node.num_visits += self.virtual_loss
+            node.score -= self.virtual_loss
+
+    def new_node(self, board, score=0, heuristic_score=0, action=None, parent=None):
+        with self.tree_lock:
+            return super().new_node(board, score, heuristic_score, action, parent)
+
+    def _create_node(self, board, score, heuristic_score, action, parent):
+        if parent is None and self.shared_arena is not None:  # a new tree replaces the old one in shared memory
+            self.shared_arena.reset(board)
+            return self.shared_arena.add_node(board, score=score, heuristic_score=heuristic_score)
+        return super()._create_node(board, score, heuristic_score, action, parent)
+
+    def _init_node(self, node, board=None):
+        if not node.initialized:
+            with self.tree_lock:
+                super()._init_node(node, board)
+
+    def _find_node(self, board):
+        if self.shared_arena is not None:
+            return None  # the shared arena is rebuilt for every search
+        return super()._find_node(board)
+
+    def tree_policy(self):
+        self.add_virtual_loss(self.tree)
+        return super().tree_policy()
+
+    def selection(self, node):
+        with self.lock_for(node):
+            selected_node = super().selection(node)
+        if selected_node != node:
+            self.add_virtual_loss(selected_node)
+        return selected_node
+
+    def expansion(self, node):
+        with self.lock_for(node):
+            if self.shared_arena is not None and self.shared_arena.full():
+                return node  # no room left, so the node is simulated as a leaf
+            child_node = super().expansion(node)
+            if child_node != node:  # no other worker can select the child before the lock is released
+                child_node.num_visits += self.virtual_loss
+                child_node.score -= self.virtual_loss
+        return child_node
+
+    def backpropagation(self, node, result, visits=1):
+        """
+        Replace the virtual losses on the path with the result, locking one node at a time
+        """
+        self._unwind()
+        path = self._get_path(node)
+        if len(path) > 1 and path[0] == path[1]:  # the leaf was fully expanded by another worker in the meantime
+            path = path[1:]
+        virtual_loss = self.virtual_loss
+        for node in path:
+            with self.lock_for(node):
+                node.num_visits += visits - virtual_loss
+                node.score += result * visits + virtual_loss
+            result = -result
+        # bounds are recomputed from the children, so a stale read is corrected later
+        self.update_bounds(path, self.recompute_bounds)
+
+    def search(self, deadline, next_simulation):
+        """
+        Search loop of one worker. Simulations are numbered by <next_simulation>, which is shared by all workers.
+        Returns the number of playouts performed by this worker.
+        """
+        num_sims = 0
+        while not self.controller.stop_reason:  # set by any worker thread that stops early
+            simulation = next_simulation()
+            if simulation >= self.max_sims:
+                break
+            node = self.tree_policy()
+            score, visits = self.simulate_leaf(node)
+            self.backpropagation(node, -score, visits)
+            num_sims += visits
+            # check time limit
+            if deadline is not None and time.time() > deadline:
+                break
+            # the shared numbering counts the simulations of all workers
+            if self.controller.should_stop(self.tree, (simulation + 1) * self.leaf_playouts):
+                break
+        return num_sims
+
+    def search_thread(self, board, deadline, next_simulation, results):
+        self._set_board(board)
+        self.search_path = []
+        self.tt_key = None
+        results.append(self.search(deadline, next_simulation))
+
+    def search_iter(self, board, interval=0.1, ponder=False):
+        """
+        Search the shared tree with <num_workers> workers. Snapshots are taken from the shared root while the workers
+        search, and closing the generator stops the workers. The shared arena of worker processes is rebuilt for every
+        search, so the tree of a <ponder> search is not reused by the next search.
+        """
+        self._set_root(board, ponder)
+        self._init_node(self.tree)
+        if self.tree.is_game_over:
+            yield self.snapshot(0, 0, final=True)
+            return
+
+        if self.workers == 'process' and self.pool is None:  # started once, outside of the time budget of the move
+            self.pool = SearchWorkerPool(self.num_workers, type(self), self.kwargs, worker=tree_worker,
+                                         args=(self.shared_arena, self.shard_locks, self.tree_lock, self.counter))
+
+        if self.leaf_playouts > 1 and self.leaf_processes and not self.lockstep_playouts and self.workers == 'thread':
+            self._get_leaf_pool()  # shared by the worker threads, so it is started before them
+
+        max_playouts = math.inf if ponder else self.max_sims * self.leaf_playouts
+        deadline = self.controller.start(max_playouts, math.inf if ponder else None)
+        inherited_visits = self.tree.num_visits
+        results = []
+        if self.pool is not None:
+            self.counter.value = 0
+            self.pool.submit([(board, deadline, max_playouts)] * len(self.pool))
+        else:
+            next_simulation = itertools.count().__next__
+            threads = [threading.Thread(target=self.search_thread, args=(board, deadline, next_simulation, results))
+                       for _ in range(self.num_workers)]
+            for thread in threads:
+                thread.start()
+        try:
+            while not (self.pool.wait(interval) if self.pool is not None else join_threads(threads, interval)):
+                yield self.snapshot(self.tree.num_visits - inherited_visits, time.time() - self.controller.start_time)
+        except GeneratorExit:
+            # the caller has seen enough, so the workers do not start another simulation
+            self.controller.stop_reason = 'interrupted'
+            if self.pool is not None:
+                with self.counter.get_lock():
+                    self.counter.value = self.max_sims
+            raise
+        finally:
+            stop_reasons = [self.controller.stop_reason]
+            if self.pool is not None:
+                results, worker_stop_reasons = zip(*self.pool.collect())
+                stop_reasons.extend(worker_stop_reasons)
+            else:
+                join_threads(threads, None)
+            total_sims = sum(results)
+            if not ponder and 'interrupted' not in stop_reasons and any(stop_reasons):
+                self.stats['early_stops'] += 1
+            time_taken = self.finish_search(total_sims, ponder)
+        yield self.snapshot(total_sims, time_taken, final=True)
+
+    def close(self):
+        """
+        Shut down the worker processes and release the shared arena
+        """
+        super().close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        if self.shared_arena is not None and self.counter is not None:  # only the owner unlinks the block
+            self.shared_arena.close(unlink=True)
+            self.shared_arena = None
+
+
+# testing
+if __name__ == '__main__':
+    board = chess.Board()
+
+    mcts = MCTSTreeParallelization(board, num_workers=4)
+    move = mcts.run(board, print_stats=True)
+    mcts.close()
+
+    board.push(move)
+
+    print(board)
+    print(max_depth(mcts.tree))
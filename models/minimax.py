@@ -1,22 +1,27 @@
 import chess
 import math
 
-from functions.eval import evaluate
+from functions.incremental_eval import IncrementalEvaluator
 
 
-def minimax_search(depth, curr_board, is_max_node):
+def minimax_search(depth, curr_board, is_max_node, eval_cache=None):
     """
-    Perform minimax search with alpha beta pruning
+    Perform minimax search with alpha beta pruning.
+    Moves are made through an incremental evaluator, so leaves are scored from the evaluation of their parent.
+    With an EvalCache, leaves are looked up in the cache instead, so transposed leaves are evaluated once.
     """
+    evaluator = IncrementalEvaluator(curr_board)
     best_score = -9999 if is_max_node else 9999
     best_move = None
-    for legal_move in curr_board.legal_moves:
-        curr_board.push(legal_move)
+    for legal_move in list(curr_board.legal_moves):
+        evaluator.push(legal_move)
         if is_max_node:
-            value = max(best_score, _minimax(depth - 1, curr_board, -10000, 10000, not is_max_node))
+            value = max(best_score, _minimax(depth - 1, curr_board, -10000, 10000, not is_max_node, evaluator,
+                                             eval_cache))
         else:
-            value = min(best_score, _minimax(depth - 1, curr_board, -10000, 10000, not is_max_node))
-        curr_board.pop()
+            value = min(best_score, _minimax(depth - 1, curr_board, -10000, 10000, not is_max_node, evaluator,
+                                             eval_cache))
+        evaluator.pop()
         if is_max_node:
             if value > best_score:
                 best_score = value
@@ -28,25 +33,31 @@ def minimax_search(depth, curr_board, is_max_node):
     return best_move
 
 
-def _minimax(depth, curr_board, alpha, beta, is_max_node):
+def _minimax(depth, curr_board, alpha, beta, is_max_node, evaluator=None, eval_cache=None):
+    if evaluator is None:
+        evaluator = IncrementalEvaluator(curr_board)
     if depth == 0 or curr_board.is_game_over():
-        return evaluate(curr_board, True)
+        if eval_cache is not None:
+            return eval_cache.evaluate(curr_board, True)
+        return evaluator.evaluate(True)
     if is_max_node:
         best_score = -math.inf
-        for legal_move in curr_board.legal_moves:
-            curr_board.push(legal_move)
-            best_score = max(best_score, _minimax(depth - 1, curr_board, alpha, beta, not is_max_node))
-            curr_board.pop()
+        for legal_move in list(curr_board.legal_moves):
+            evaluator.push(legal_move)
+            best_score = max(best_score, _minimax(depth - 1, curr_board, alpha, beta, not is_max_node, evaluator,
+                                                  eval_cache))
+            evaluator.pop()
             alpha = max(alpha, best_score)
             if beta <= alpha:
                 return best_score
         return best_score
     else:
         best_score = math.inf
-        for legal_move in curr_board.legal_moves:
-            curr_board.push(legal_move)
-            best_score = min(best_score, _minimax(depth - 1, curr_board, alpha, beta, not is_max_node))
-            curr_board.pop()
+        for legal_move in list(curr_board.legal_moves):
+            evaluator.push(legal_move)
+            best_score = min(best_score, _minimax(depth - 1, curr_board, alpha, beta, not is_max_node, evaluator,
+                                                  eval_cache))
+            evaluator.pop()
             beta = min(beta, best_score)
             if beta <= alpha:
                 return best_score
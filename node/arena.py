@@ -0,0 +1,393 @@
+from array import array
+import random
+
+import chess
+
+from node.node import MCTSNode, MAX_SCORE, get_outcome
+
+NO_NODE = -1
+
+# flag bits packed into a single byte per node
+IS_WHITE = 1
+IS_GAME_OVER = 2
+OUTCOME_SHIFT = 2  # two bits: 0 = none, 1 = '1-0', 2 = '0-1', 3 = '1/2-1/2'
+INITIALIZED = 16
+
+OUTCOMES = [None, '1-0', '0-1', '1/2-1/2']
+OUTCOME_CODES = {'1-0': 1, '0-1': 2, '1/2-1/2': 3}
+
+
+def pack_move(move):
+    """
+    Pack a move into 15 bits: from square, to square and promotion piece type
+    """
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def unpack_move(code):
+    promotion = code >> 12
+    return chess.Move(code & 63, (code >> 6) & 63, promotion if promotion else None)
+
+
+class ColumnArena:
+    """
+    Operations on the typed node columns, shared by the node arenas. Subclasses create the columns and the side
+    tables, and add the nodes and their moves.
+    """
+    def initialize(self, index, board):
+        """
+        Generate the legal moves and the terminal state of a node. Nodes of the same position share one
+        slice of the move pool.
+        """
+        key = board._transposition_key()
+        move_slice = self.move_slices.get(key)
+        if move_slice is None:
+            moves = [pack_move(move) for move in board.legal_moves]
+            random.shuffle(moves)
+            move_slice = (self.store_moves(moves), len(moves))
+            self.move_slices[key] = move_slice
+        self.moves_start[index], self.num_untried[index] = move_slice
+        flags = self.flags[index] | INITIALIZED
+        outcome = get_outcome(board, self.move_pool[move_slice[0]:move_slice[0] + move_slice[1]])
+        if outcome is not None:
+            flags |= IS_GAME_OVER | (OUTCOME_CODES[outcome] << OUTCOME_SHIFT)
+        self.flags[index] = flags
+
+    def children(self, index):
+        children = []
+        child = self.first_child[index]
+        while child != NO_NODE:
+            children.append(ArenaNode(self, child))
+            child = self.next_sibling[child]
+        if index in self.linked_children:
+            children.extend(ArenaNode(self, child) for child in self.linked_children[index])
+        return children
+
+    def board_at(self, index):
+        """
+        Rebuild the board of a node by replaying the moves on its path from the root
+        """
+        path = []
+        while self.parent[index] != NO_NODE:
+            path.append(self.move[index])
+            index = self.parent[index]
+        board = self.root_board.copy(stack=False)
+        for code in reversed(path):
+            board.push(unpack_move(code))
+        return board
+
+    def edges(self, index):
+        """
+        Iterate over the (child index, packed move) edges of a node, including transposition edges
+        """
+        child = self.first_child[index]
+        while child != NO_NODE:
+            yield child, self.move[child]
+            child = self.next_sibling[child]
+        yield from self.linked_children.get(index, {}).items()
+
+    def nbytes(self):
+        """
+        Total number of bytes used by the columns and the move pool
+        """
+        columns = (self.parent, self.first_child, self.next_sibling, self.move, self.score, self.num_visits,
+                   self.flags, self.heuristic_score, self.pess_bound, self.opti_bound, self.num_unpruned,
+                   self.moves_start, self.num_untried, self.move_pool)
+        return sum(column.itemsize * len(column) for column in columns)
+
+
+class NodeArena(ColumnArena):
+    """
+    Struct-of-arrays node store for MCTS implementations.
+    Every node is an integer index into a set of typed columns, so the tree holds no per-node Python objects
+    and no parent/child reference cycles. Nodes are accessed through lightweight ArenaNode handles.
+    """
+    def __init__(self, root_board):
+        self.root_board = root_board.copy(stack=False)  # the position of node 0, used to rebuild node states
+        # ---- Tree structure ----
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.move = array('H')  # packed move performed by selecting this node from the parent
+        # ---- Search statistics ----
+        self.score = array('d')
+        self.num_visits = array('i')
+        self.flags = array('B')
+        # ---- Progressive bias / score bounded search ----
+        self.heuristic_score = array('f')
+        self.pess_bound = array('f')
+        self.opti_bound = array('f')
+        # ---- Progressive unpruning ----
+        self.num_unpruned = array('H')
+        self.sorted_children = {}  # only interior nodes are ever sorted, so this is kept as a side table
+        self.rankings = {}
+        self.proven = {}  # proven game values of the solved nodes (MCTS-Solver)
+        self.linked_children = {}  # transposition edges: {parent index: {child index: packed move}}
+        # ---- Untried actions (slices of a shared packed move pool) ----
+        self.moves_start = array('I')
+        self.num_untried = array('H')
+        self.move_pool = array('H')
+        self.move_slices = {}  # position key -> (start, count) of its legal moves in the pool
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add_node(self, board, score=0, heuristic_score=0, action=None, parent=None):
+        """
+        Append a node for the given board state and return its handle
+        """
+        index = len(self.parent)
+        parent_index = parent.index if parent is not None else NO_NODE
+        self.parent.append(parent_index)
+        self.first_child.append(NO_NODE)
+        self.next_sibling.append(self.first_child[parent_index] if parent_index != NO_NODE else NO_NODE)
+        self.move.append(pack_move(action) if action else 0)
+        self.score.append(score)
+        self.num_visits.append(0)
+        self.flags.append(IS_WHITE if board.turn else 0)
+        self.heuristic_score.append(heuristic_score)
+        self.pess_bound.append(-MAX_SCORE)
+        self.opti_bound.append(heuristic_score)
+        self.num_unpruned.append(0)
+        self.moves_start.append(0)
+        self.num_untried.append(0)
+        if parent_index != NO_NODE:  # linked last, so a node is never reachable before all of its columns are set
+            self.first_child[parent_index] = index
+        return ArenaNode(self, index)
+
+    def store_moves(self, moves):
+        """
+        Append packed moves to the move pool and return the start of their slice
+        """
+        start = len(self.move_pool)
+        self.move_pool.extend(moves)
+        return start
+
+    def extract(self, index):
+        """
+        Copy the subgraph reachable from <index> into a new, compact arena. Returns the new arena and the map from
+        the old to the new index of every copied node, the root being 0. The first edge that reaches a node becomes
+        its tree edge, any other edge is kept as a linked edge.
+        """
+        arena = NodeArena(self.board_at(index))
+        slices = {start: (key, count) for key, (start, count) in self.move_slices.items()}
+        copied = {}
+        remap = {index: 0}
+        order = [index]
+        new_parent = {index: NO_NODE}
+        new_move = {index: 0}
+        new_sibling = {}
+        for old in order:  # breadth-first, so parents and siblings are always remapped before they are copied
+            new = remap[old]
+            tree_children = []
+            for child, code in self.edges(old):
+                if child in remap:
+                    arena.linked_children.setdefault(new, {})[remap[child]] = code
+                    continue
+                remap[child] = len(order)
+                order.append(child)
+                new_parent[child] = new
+                new_move[child] = code
+                tree_children.append(remap[child])
+            for child, sibling in zip(tree_children, tree_children[1:]):
+                new_sibling[child] = sibling
+            arena.parent.append(new_parent[old])
+            arena.first_child.append(tree_children[0] if tree_children else NO_NODE)
+            arena.next_sibling.append(new_sibling.get(new, NO_NODE))
+            arena.move.append(new_move[old])
+            arena.score.append(self.score[old])
+            arena.num_visits.append(self.num_visits[old])
+            arena.flags.append(self.flags[old])
+            arena.heuristic_score.append(self.heuristic_score[old])
+            arena.pess_bound.append(self.pess_bound[old])
+            arena.opti_bound.append(self.opti_bound[old])
+            arena.num_unpruned.append(self.num_unpruned[old])
+            start = self.moves_start[old]
+            if self.flags[old] & INITIALIZED and start not in copied:  # copy each shared move slice once
+                key, count = slices[start]
+                copied[start] = len(arena.move_pool)
+                arena.move_pool.extend(self.move_pool[start:start + count])
+                arena.move_slices[key] = (copied[start], count)
+            arena.moves_start.append(copied.get(start, 0))
+            arena.num_untried.append(self.num_untried[old])
+        arena.proven = {remap[old]: value for old, value in self.proven.items() if old in remap}
+        return arena, remap
+
+
+class _Column:
+    """
+    Descriptor mapping a handle attribute onto an arena column
+    """
+    def __init__(self, column):
+        self.column = column
+
+    def __get__(self, node, owner=None):
+        if node is None:
+            return self
+        return getattr(node.arena, self.column)[node.index]
+
+    def __set__(self, node, value):
+        getattr(node.arena, self.column)[node.index] = value
+
+
+class UntriedActions:
+    """
+    List-like view over a node's slice of the arena move pool
+    """
+    __slots__ = ('arena', 'index')
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    def __len__(self):
+        return self.arena.num_untried[self.index]
+
+    def __bool__(self):
+        return self.arena.num_untried[self.index] > 0
+
+    def __iter__(self):
+        start = self.arena.moves_start[self.index]
+        for code in self.arena.move_pool[start:start + self.arena.num_untried[self.index]]:
+            yield unpack_move(code)
+
+    def pop(self):
+        arena, index = self.arena, self.index
+        remaining = arena.num_untried[index] - 1
+        if remaining < 0:
+            raise IndexError('pop from empty untried actions')
+        arena.num_untried[index] = remaining
+        return unpack_move(arena.move_pool[arena.moves_start[index] + remaining])
+
+
+class ArenaNode:
+    """
+    Handle to a node stored in a NodeArena. Exposes the same interface as MCTSNode, so it can be used as a
+    drop-in replacement by every MCTS model.
+    """
+    __slots__ = ('arena', 'index')
+
+    score = _Column('score')
+    num_visits = _Column('num_visits')
+    heuristic_score = _Column('heuristic_score')
+    pess_bound = _Column('pess_bound')
+    opti_bound = _Column('opti_bound')
+    num_unpruned = _Column('num_unpruned')
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    @property
+    def name(self):
+        return f'S{self.index}'
+
+    @property
+    def state(self):
+        return self.arena.board_at(self.index).fen()
+
+    @property
+    def is_white(self):
+        return bool(self.arena.flags[self.index] & IS_WHITE)
+
+    @property
+    def is_game_over(self):
+        return bool(self.arena.flags[self.index] & IS_GAME_OVER)
+
+    @property
+    def outcome(self):
+        return OUTCOMES[(self.arena.flags[self.index] >> OUTCOME_SHIFT) & 3]
+
+    @property
+    def action(self):
+        code = self.arena.move[self.index]
+        return unpack_move(code) if code else None
+
+    @property
+    def untried_actions(self):
+        return UntriedActions(self.arena, self.index)
+
+    @property
+    def initialized(self):
+        return bool(self.arena.flags[self.index] & INITIALIZED)
+
+    def initialize(self, board, move_cache=None):
+        """
+        Deferred initialization - the arena keeps its own move cache in the move pool
+        """
+        self.arena.initialize(self.index, board)
+
+    @property
+    def parent(self):
+        parent = self.arena.parent[self.index]
+        return ArenaNode(self.arena, parent) if parent != NO_NODE else None
+
+    @parent.setter
+    def parent(self, parent):
+        """
+        Only detaching is supported. The detached subtree is compacted into a new arena, which releases the
+        memory held by the rest of the old tree.
+        """
+        if parent is not None:
+            raise ValueError('arena nodes can only be re-parented by detaching them (parent = None)')
+        if self.arena.parent[self.index] != NO_NODE:
+            if not isinstance(self.arena, NodeArena):
+                raise ValueError('nodes of a shared arena cannot be detached, the tree is rebuilt for every search')
+            self.arena, remap = self.arena.extract(self.index)
+            self.index = remap[self.index]
+
+    @property
+    def children(self):
+        return self.arena.children(self.index)
+
+    def link_child(self, child, action):
+        """
+        Add an edge to a node of the transposition table, which turns the tree into a directed acyclic graph
+        """
+        self.arena.linked_children.setdefault(self.index, {})[child.index] = pack_move(action)
+
+    def get_action(self, child):
+        """
+        Get the move leading from this node to <child>
+        """
+        linked = self.arena.linked_children.get(self.index)
+        if linked and child.index in linked:
+            return unpack_move(linked[child.index])
+        return child.action
+
+    @property
+    def sorted_children(self):
+        return self.arena.sorted_children.get(self.index, [])
+
+    @sorted_children.setter
+    def sorted_children(self, children):
+        self.arena.sorted_children[self.index] = children
+
+    @property
+    def ranking(self):
+        return self.arena.rankings.get(self.index)
+
+    @ranking.setter
+    def ranking(self, ranking):
+        self.arena.rankings[self.index] = ranking
+
+    @property
+    def proven(self):
+        return self.arena.proven.get(self.index)
+
+    @proven.setter
+    def proven(self, value):
+        self.arena.proven[self.index] = value
+
+    sort_children = MCTSNode.sort_children
+    rank_children = MCTSNode.rank_children
+    __lt__ = MCTSNode.__lt__
+
+    def __eq__(self, other):
+        return isinstance(other, ArenaNode) and self.arena is other.arena and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.arena), self.index))
+
+    def __repr__(self):
+        return f'ArenaNode({self.name}, visits={self.num_visits}, score={self.score})'
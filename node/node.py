@@ -1,27 +1,99 @@
 from anytree import NodeMixin, RenderTree
+import heapq
 import random
 
 MAX_SCORE = 10000
 
+_tree_children = NodeMixin.children.fget
+
+
+def get_outcome(board, moves):
+    """
+    Get the game result of a board from its list of legal moves, or None if the game is not over.
+    Equivalent to board.result() for finished games, without generating the legal moves again.
+    """
+    if not moves:
+        if board.is_check():
+            return '0-1' if board.turn else '1-0'
+        return '1/2-1/2'
+    if board.is_insufficient_material() or board.is_seventyfive_moves() or board.is_fivefold_repetition():
+        return '1/2-1/2'
+    return None
+
+
+class LegalMoveCache:
+    """
+    Legal move lists shared between all nodes of the same position.
+    Each list is shuffled once when it is generated, so the expansion order stays random.
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.moves = {}
+
+    def get(self, board):
+        key = board._transposition_key()
+        moves = self.moves.get(key)
+        if moves is None:
+            if len(self.moves) >= self.max_size:
+                self.moves.clear()
+            moves = list(board.legal_moves)
+            random.shuffle(moves)
+            moves = tuple(moves)
+            self.moves[key] = moves
+        return moves
+
+
+def mean_score(node):
+    return node.score / node.num_visits
+
+
+class UntriedActions:
+    """
+    List-like view over the moves of a node that have not been expanded yet
+    """
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+    def __len__(self):
+        return self.node.num_untried
+
+    def __bool__(self):
+        return self.node.num_untried > 0
+
+    def __iter__(self):
+        return iter(self.node.moves[:self.node.num_untried])
+
+    def pop(self):
+        node = self.node
+        if node.num_untried == 0:
+            raise IndexError('pop from empty untried actions')
+        node.num_untried -= 1
+        return node.moves[node.num_untried]
+
 
 class MCTSNode(NodeMixin):
     """
     Node class for MCTS implementations.
     """
-    def __init__(self, name, board, score=0, heuristic_score=0, action=None, parent=None, children=None):
+    def __init__(self, name, board, score=0, heuristic_score=0, action=None, parent=None, children=None,
+                 store_state=True):
         super(MCTSNode, self).__init__()
         # ---- Base parameters ----
         self.name = name # node identifier
-        self.state = board.fen() # current board state (FEN string)
+        if store_state:  # not needed when the search threads a single board through the tree (make/unmake)
+            self.state = board.fen() # current board state (FEN string)
         self.score = score  # the total rewards from MCTS exploration
         self.num_visits = 0  # visit count of the node
-        self.is_game_over = board.is_game_over()  # terminal node identifier - precalculating this saves time
         self.is_white = board.turn  # store the turn of the node
-        moves = list(board.legal_moves)
-        random.shuffle(moves)
-        self.untried_actions = moves  # store all the untried actions as a list
+        self.moves = None  # shared legal move list, set by initialize()
+        self.num_untried = 0  # the first <num_untried> moves have not been expanded yet
+        self.outcome = None  # game result, set by initialize()
+        self.is_game_over = None  # terminal node identifier, None (falsy) until initialize() knows it
         if action:
             self.action = action  # the move performed by selecting this node from the parent
+        self.linked_children = None  # transposition edges: {child node created under another parent: move}
         self.parent = parent  # parent to this node
         if children:
             self.children = children  # children to this node
@@ -30,11 +102,58 @@ class MCTSNode(NodeMixin):
         # ---- Score bounded search parameters ----
         self.pess_bound = -MAX_SCORE  # lower boundary
         self.opti_bound = heuristic_score  # upper boundary
-        if self.is_game_over:
-            self.outcome = board.result()  # store game result
+        self.proven = None  # proven game value for the side to move (MCTS-Solver), None if unknown
         # ---- Progressive unpruning parameters ----
         self.sorted_children = []
         self.num_unpruned = 0
+        self.ranking = None  # (visits, number of children) of the last rank_children()
+
+    def initialize(self, board, move_cache):
+        """
+        Generate the legal moves, terminal flag and game result of the node.
+        This is deferred until the node is first selected or expanded, since most leaves are only simulated once.
+        """
+        moves = move_cache.get(board)
+        self.num_untried = len(moves)
+        self.outcome = get_outcome(board, moves)  # store game result
+        self.is_game_over = self.outcome is not None  # terminal node identifier
+        self.moves = moves  # set last, since a node with moves reads as initialized to the other search threads
+
+    @property
+    def initialized(self):
+        return self.moves is not None
+
+    @property
+    def untried_actions(self):
+        return UntriedActions(self)
+
+    @property
+    def children(self):
+        children = _tree_children(self)
+        if self.linked_children:
+            children += tuple(self.linked_children)
+        return children
+
+    @children.setter
+    def children(self, children):
+        NodeMixin.children.fset(self, children)
+
+    def link_child(self, child, action):
+        """
+        Add an edge to a node of the transposition table. The child keeps its original parent, which turns the
+        tree into a directed acyclic graph.
+        """
+        if self.linked_children is None:
+            self.linked_children = {}
+        self.linked_children[child] = action
+
+    def get_action(self, child):
+        """
+        Get the move leading from this node to <child>
+        """
+        if self.linked_children and child in self.linked_children:
+            return self.linked_children[child]
+        return child.action
 
     def sort_children(self):
         """
@@ -42,19 +161,23 @@ class MCTSNode(NodeMixin):
         """
         self.sorted_children = sorted(self.children, reverse=True)
 
-    def alpha_beta_pruning(self):
+    def rank_children(self, num_children, interval=1, prune=False):
         """
-        Do hard alpha beta pruning and return the sorted list of remaining children nodes
+        Keep the <num_children> children with the best average score in sorted_children, best first. With <prune>,
+        the children cut by hard alpha beta pruning on the score bounds are left out.
+        The ranking is refreshed lazily: only after <interval> more visits, or when more children are needed. A
+        refresh is a partial selection, O(n log k) instead of a full sort.
         """
-        self.sort_children()
-        new_child_list = []
-        pruned_list = []
-        for child in self.sorted_children:
-            if not -child.pess_bound <= self.pess_bound or (-child.pess_bound == self.opti_bound and child.pess_bound == child.opti_bound):
-                new_child_list.append(child)
-            else:
-                pruned_list.append(child)
-        self.sorted_children = new_child_list
+        ranking = self.ranking
+        if ranking is not None and num_children <= ranking[1] and self.num_visits < ranking[0] + interval:
+            return
+        children = self.children
+        if prune:
+            pess_bound, opti_bound = self.pess_bound, self.opti_bound
+            children = [child for child in children if not -child.pess_bound <= pess_bound or
+                        (-child.pess_bound == opti_bound and child.pess_bound == child.opti_bound)]
+        self.sorted_children = heapq.nlargest(num_children, children, key=mean_score)
+        self.ranking = (self.num_visits, num_children)
 
     def __lt__(self, other):
         return self.score / self.num_visits < other.score / other.num_visits
@@ -0,0 +1,120 @@
+from array import array
+from multiprocessing.shared_memory import SharedMemory
+
+from node.arena import ColumnArena, ArenaNode, NO_NODE, IS_WHITE, pack_move
+from node.node import MAX_SCORE
+
+# (column, type code), ordered by item size so that every column stays aligned
+COLUMNS = (
+    ('score', 'd'),
+    ('parent', 'i'), ('first_child', 'i'), ('next_sibling', 'i'), ('num_visits', 'i'), ('moves_start', 'I'),
+    ('heuristic_score', 'f'), ('pess_bound', 'f'), ('opti_bound', 'f'),
+    ('move', 'H'), ('num_unpruned', 'H'), ('num_untried', 'H'),
+    ('flags', 'B'),
+)
+ITEM_SIZES = {'d': 8, 'i': 4, 'I': 4, 'f': 4, 'H': 2, 'B': 1}
+HEADER_SIZE = 16  # number of nodes, number of moves in the pool
+MAX_MOVES = 256  # more than the number of legal moves in any chess position
+
+
+class SharedNodeArena(ColumnArena):
+    """
+    Fixed-capacity node arena in a shared memory block, so that one tree can be searched by several processes.
+    Columns are memoryviews over the block, and the node count and the move pool size are stored in the block
+    as well. Adding nodes and moves must be serialized by the caller. The side tables (sorted children, move
+    slices) are local to each process, and transposition edges are not supported. Since the move slices are local,
+    a subtree cannot be extracted into a compact arena: the tree is rebuilt for every search instead.
+    """
+    def __init__(self, capacity=200000, pool_capacity=None, name=None):
+        self.capacity = capacity
+        self.pool_capacity = pool_capacity or 48 * capacity
+        size = HEADER_SIZE + capacity * sum(ITEM_SIZES[code] for _, code in COLUMNS) + 2 * self.pool_capacity
+        self.memory = SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.memory.name
+        buffer = self.memory.buf
+        self.header = buffer[:HEADER_SIZE].cast('q')
+        offset = HEADER_SIZE
+        for column, code in COLUMNS:
+            end = offset + capacity * ITEM_SIZES[code]
+            setattr(self, column, buffer[offset:end].cast(code))
+            offset = end
+        self.move_pool = buffer[offset:offset + 2 * self.pool_capacity].cast('H')
+        self.root_board = None
+        self.sorted_children = {}
+        self.rankings = {}
+        self.proven = {}
+        self.linked_children = {}
+        self.move_slices = {}
+
+    def __getstate__(self):
+        return {'name': self.name, 'capacity': self.capacity, 'pool_capacity': self.pool_capacity}
+
+    def __setstate__(self, state):
+        self.__init__(state['capacity'], state['pool_capacity'], name=state['name'])
+
+    def __len__(self):
+        return self.header[0]
+
+    def full(self):
+        """
+        Check if there is no room for one more node and its legal moves
+        """
+        return self.header[0] >= self.capacity or self.header[1] + MAX_MOVES > self.pool_capacity
+
+    def reset(self, root_board):
+        """
+        Remove every node, so a new tree can be built from <root_board>
+        """
+        self.header[0] = 0
+        self.header[1] = 0
+        self.clear_local(root_board)
+
+    def clear_local(self, root_board):
+        """
+        Drop the side tables of this process, which refer to the nodes and moves of the previous tree
+        """
+        self.root_board = root_board.copy(stack=False)
+        self.sorted_children.clear()
+        self.rankings.clear()
+        self.proven.clear()
+        self.move_slices.clear()
+
+    def add_node(self, board, score=0, heuristic_score=0, action=None, parent=None):
+        index = self.header[0]
+        if index >= self.capacity:
+            raise MemoryError('shared node arena is full')
+        parent_index = parent.index if parent is not None else NO_NODE
+        self.parent[index] = parent_index
+        self.first_child[index] = NO_NODE
+        self.next_sibling[index] = self.first_child[parent_index] if parent_index != NO_NODE else NO_NODE
+        self.move[index] = pack_move(action) if action else 0
+        self.score[index] = score
+        self.num_visits[index] = 0
+        self.flags[index] = IS_WHITE if board.turn else 0
+        self.heuristic_score[index] = heuristic_score
+        self.pess_bound[index] = -MAX_SCORE
+        self.opti_bound[index] = heuristic_score
+        self.num_unpruned[index] = 0
+        self.moves_start[index] = 0
+        self.num_untried[index] = 0
+        self.header[0] = index + 1
+        if parent_index != NO_NODE:  # linked last, so other processes never reach a partly written node
+            self.first_child[parent_index] = index
+        return ArenaNode(self, index)
+
+    def store_moves(self, moves):
+        start = self.header[1]
+        if start + len(moves) > self.pool_capacity:
+            raise MemoryError('shared move pool is full')
+        self.move_pool[start:start + len(moves)] = array('H', moves)
+        self.header[1] = start + len(moves)
+        return start
+
+    def close(self, unlink=False):
+        for column, _ in COLUMNS:
+            getattr(self, column).release()
+        self.move_pool.release()
+        self.header.release()
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
@@ -0,0 +1,81 @@
+import chess.polyglot
+
+# number of the oldest entries that are compared by the 'visits' replacement policy
+REPLACEMENT_SAMPLE = 8
+
+
+class TranspositionTable:
+    """
+    Table of search nodes keyed by position, used to share one node between all move orders that reach it.
+    Keys combine the Zobrist hash with the ply, so every edge leads exactly one ply deeper and the resulting
+    graph can never contain a cycle.
+
+    Replacement policies when the table is full:
+        'fifo' - evict the oldest entry
+        'visits' - evict the least visited of the oldest entries
+    """
+    def __init__(self, max_size=100000, replacement='fifo'):
+        if replacement not in ('fifo', 'visits'):
+            raise ValueError(f'Unknown replacement policy: {replacement}')
+        self.max_size = max_size
+        self.replacement = replacement
+        self.table = {}
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_key(board):
+        return chess.polyglot.zobrist_hash(board), board.ply()
+
+    def lookup(self, key):
+        self.lookups += 1
+        return self.table.get(key)
+
+    def store(self, key, node):
+        if key not in self.table and len(self.table) >= self.max_size:
+            self.evict()
+        self.table[key] = node
+
+    def evict(self):
+        if self.replacement == 'visits':
+            oldest = []
+            for key, node in self.table.items():
+                oldest.append((node.num_visits, key))
+                if len(oldest) == REPLACEMENT_SAMPLE:
+                    break
+            key = min(oldest)[1]
+        else:
+            key = next(iter(self.table))
+        del self.table[key]
+        self.evictions += 1
+
+    def clear(self):
+        self.table.clear()
+
+    def prune(self, min_ply):
+        """
+        Drop the entries of the positions before <min_ply>, keeping the insertion order of the others
+        """
+        self.table = {key: node for key, node in self.table.items() if key[1] >= min_ply}
+
+    def relocate(self, move_node):
+        """
+        Replace every node by move_node(node), its copy in a compacted store, and drop the nodes that have no copy
+        (None)
+        """
+        table = {}
+        for key, node in self.table.items():
+            node = move_node(node)
+            if node is not None:
+                table[key] = node
+        self.table = table
+
+    def get_stats(self):
+        return {
+            'tt_lookups': self.lookups,
+            'tt_hits': self.hits,
+            'tt_hit_rate': self.hits / self.lookups if self.lookups else 0,
+            'tt_evictions': self.evictions,
+            'tt_entries': len(self.table),
+        }
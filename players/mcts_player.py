@@ -1,20 +1,87 @@
+import threading
+
 from players.player import Player
 
+PONDER_INTERVAL = 0.01  # seconds between two checks for the opponent's move by the pondering thread
+
 
 # MCTS player abstraction class
 class MCTSPlayer(Player):
-    def __init__(self, algo_model):
+    """
+    With <ponder>, the player keeps searching its tree in a background thread while the opponent is to move, from the
+    position after its own move. The search stops when the next move is asked for, and the model re-roots its tree on
+    the opponent's reply: a ponder hit if the ponder search visited the reply and the search of the move inherited it.
+    The visits added by pondering to the replies played (ponder_visits) are counted apart from those of normal reuse.
+    The thread shares the interpreter lock with the searches of the same process, so pondering gains the most against
+    an engine in another process, or with a model whose workers are processes.
+    """
+    def __init__(self, algo_model, ponder=False):
         self.algo_model = algo_model
+        self.ponder = ponder
+        self.ponder_thread = None
+        self.ponder_stop = threading.Event()
+        self.stats = {'pondered_moves': 0, 'ponder_hits': 0, 'ponder_visits': 0}
 
     def get_next_move(self, board, verbose):
+        pondered = self.stop_pondering()
+        reuse_hits = self.algo_model.stats['reuse_hits']
         move = self.algo_model.run(board, print_stats=verbose)
+        if pondered:
+            self.stats['pondered_moves'] += 1
+            # a hit only if the ponder search visited the reply and the search of the move inherited its subtree
+            ponder_visits = self.algo_model.ponder_visits.get(board.peek(), 0) if board.move_stack else 0
+            if ponder_visits > 0 and self.algo_model.stats['reuse_hits'] > reuse_hits:
+                self.stats['ponder_hits'] += 1
+                self.stats['ponder_visits'] += ponder_visits
+        if self.ponder and move is not None:
+            self.start_pondering(board, move)
         return move
 
+    def start_pondering(self, board, move):
+        """
+        Search the position after <move> in a background thread, until stop_pondering is called
+        """
+        board = board.copy()
+        board.push(move)
+        if board.is_game_over():
+            return
+        self.ponder_stop.clear()
+        self.ponder_thread = threading.Thread(target=self._ponder, args=(board,), daemon=True)
+        self.ponder_thread.start()
+
+    def _ponder(self, board):
+        for _ in self.algo_model.search_iter(board, PONDER_INTERVAL, ponder=True):
+            if self.ponder_stop.is_set():
+                break  # closes the search
+
+    def stop_pondering(self):
+        """
+        Stop the search of the background thread. Returns whether the player was pondering.
+        """
+        if self.ponder_thread is None:
+            return False
+        self.ponder_stop.set()
+        self.ponder_thread.join()
+        self.ponder_thread = None
+        return True
+
     def get_stats(self):
-        return self.algo_model.get_stats()
+        stats = self.algo_model.get_stats()
+        stats['inherited_visits_per_move'] = stats['inherited_visits'] / stats['searches'] if stats['searches'] else 0
+        if self.ponder:
+            stats.update(self.stats)
+            pondered_moves, ponder_hits = self.stats['pondered_moves'], self.stats['ponder_hits']
+            stats['ponder_hit_rate'] = ponder_hits / pondered_moves if pondered_moves else 0
+            stats['ponder_visits_per_hit'] = self.stats['ponder_visits'] / ponder_hits if ponder_hits else 0
+        return stats
+
+    def close(self):
+        self.stop_pondering()
+        self.algo_model.close()
 
     def get_name(self):
         return self.algo_model.__class__.__name__
 
     def reset(self):
+        self.stop_pondering()
         self.algo_model.reset()
@@ -1,14 +1,16 @@
+from functions.eval_cache import EvalCache
 from models.minimax import minimax_search
 from players.player import Player
 
 
 # Minimax model abstraction class
 class MinimaxPlayer(Player):
-    def __init__(self, depth=3):
+    def __init__(self, depth=3, eval_cache_size=0):
         self.depth = depth
+        self.eval_cache = EvalCache(eval_cache_size) if eval_cache_size else None  # kept between moves
 
     def get_next_move(self, board, verbose):
-        move = minimax_search(self.depth, board, board.turn)
+        move = minimax_search(self.depth, board, board.turn, self.eval_cache)
         return move
 
     def get_name(self):